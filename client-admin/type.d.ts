@@ -25,6 +25,7 @@ export type Report = {
   tokenUsage?: number; // トークン使用量（合計）
   tokenUsageInput?: number; // 入力トークン使用量
   tokenUsageOutput?: number; // 出力トークン使用量
+  tokenUsageCachedInput?: number; // 入力トークンのうちプロンプトキャッシュから読み込まれたもの
   estimatedCost?: number; // 推定コスト（USD）
   provider?: string; // LLMプロバイダー
   model?: string; // LLMモデル
@@ -46,12 +46,27 @@ type ReportProps = {
   result: Result;
 };
 
+const ANALYSIS_STEPS = [
+  "extraction",
+  "extraction_classification",
+  "embedding",
+  "hierarchical_clustering",
+  "hierarchical_initial_labelling",
+  "hierarchical_merge_labelling",
+  "hierarchical_overview",
+  "hierarchical_aggregation",
+  "hierarchical_visualization",
+];
+
 export function Analysis({ result }: ReportProps) {
   const [selectedData, setSelectedData] = useState<{
     title: string;
     body: string;
   } | null>(null);
   const clusterNum = getClusterNum(result);
+  // 公開APIのレスポンスには実行計画(plan)が含まれないため、設定に含まれるステップを順に表示する
+  const steps: { step: string }[] =
+    result.config.plan ?? ANALYSIS_STEPS.filter((step) => step in result.config).map((step) => ({ step }));
   const { open, onToggle } = useDisclosure();
 
   return (
@@ -131,7 +146,7 @@ export function Analysis({ result }: ReportProps) {
         </Flex>
         <Presence present={open}>
           <TimelineRoot size={"lg"}>
-            {result.config.plan.map((p) => (
+            {steps.map((p) => (
               <TimelineItem key={p.step}>
                 <TimelineConnector>
                   <CircleArrowDownIcon />
@@ -144,33 +159,40 @@ export function Analysis({ result }: ReportProps) {
                       <br />
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `抽出 - ${p.step}`,
-                            body: result.config.extraction.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `抽出 - ${p.step}`,
-                            body: result.config.extraction.prompt,
-                          })
-                        }
-                      >
-                        プロンプト
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`抽出 - ${p.step}`}
+                        body={result.config.extraction.source_code}
+                        onSelect={setSelectedData}
+                      />
+                      <DetailButton
+                        label={"プロンプト"}
+                        title={`抽出 - ${p.step}`}
+                        body={result.config.extraction.prompt}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
+                {p.step === "extraction_classification" && (
+                  <TimelineContent>
+                    <TimelineTitle fontWeight={"bold"}>カテゴリ分類 ({result.config.extraction.model})</TimelineTitle>
+                    <TimelineDescription>
+                      抽出された意見を、設定したカテゴリに分類するステップです。
+                      <br />
+                    </TimelineDescription>
+                    {result.config.extraction_classification && (
+                      <HStack>
+                        <DetailButton
+                          label={"ソースコード"}
+                          title={`カテゴリ分類 - ${p.step}`}
+                          body={result.config.extraction_classification?.source_code}
+                          onSelect={setSelectedData}
+                        />
+                      </HStack>
+                    )}
+                  </TimelineContent>
+                )}
                 {p.step === "embedding" && (
                   <TimelineContent>
                     <TimelineTitle fontWeight={"bold"}>
@@ -186,18 +208,12 @@ export function Analysis({ result }: ReportProps) {
                       これにより、意見の内容を数値ベクトルとして表現します。
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `埋め込み - ${p.step}`,
-                            body: result.config.embedding.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`埋め込み - ${p.step}`}
+                        body={result.config.embedding.source_code}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -209,18 +225,12 @@ export function Analysis({ result }: ReportProps) {
                       <br />
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `意見グループ化 - ${p.step}`,
-                            body: result.config.hierarchical_clustering.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`意見グループ化 - ${p.step}`}
+                        body={result.config.hierarchical_clustering.source_code}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -235,30 +245,18 @@ export function Analysis({ result }: ReportProps) {
                       このステップでは、最も細かい粒度の意見グループ（最下層の意見グループ）に対して、各意見グループに属する意見に基づいて意見グループのタイトルと説明文を生成します。
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `初期ラベリング - ${p.step}`,
-                            body: result.config.hierarchical_initial_labelling.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `初期ラベリング - ${p.step}`,
-                            body: result.config.hierarchical_initial_labelling.prompt,
-                          })
-                        }
-                      >
-                        プロンプト
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`初期ラベリング - ${p.step}`}
+                        body={result.config.hierarchical_initial_labelling.source_code}
+                        onSelect={setSelectedData}
+                      />
+                      <DetailButton
+                        label={"プロンプト"}
+                        title={`初期ラベリング - ${p.step}`}
+                        body={result.config.hierarchical_initial_labelling.prompt}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -273,30 +271,18 @@ export function Analysis({ result }: ReportProps) {
                       このステップでは、下層の意見グループのタイトル及び説明文と、意見に基づいて上層の意見グループのタイトル及び説明文を生成します。
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `統合ラベリング - ${p.step}`,
-                            body: result.config.hierarchical_merge_labelling.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `統合ラベリング - ${p.step}`,
-                            body: result.config.hierarchical_merge_labelling.prompt,
-                          })
-                        }
-                      >
-                        プロンプト
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`統合ラベリング - ${p.step}`}
+                        body={result.config.hierarchical_merge_labelling.source_code}
+                        onSelect={setSelectedData}
+                      />
+                      <DetailButton
+                        label={"プロンプト"}
+                        title={`統合ラベリング - ${p.step}`}
+                        body={result.config.hierarchical_merge_labelling.prompt}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -311,30 +297,18 @@ export function Analysis({ result }: ReportProps) {
                       各意見グループのタイトル及び説明文をもとに、全体の概要をまとめます。
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `要約 - ${p.step}`,
-                            body: result.config.hierarchical_overview.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `要約 - ${p.step}`,
-                            body: result.config.hierarchical_overview.prompt,
-                          })
-                        }
-                      >
-                        プロンプト
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`要約 - ${p.step}`}
+                        body={result.config.hierarchical_overview.source_code}
+                        onSelect={setSelectedData}
+                      />
+                      <DetailButton
+                        label={"プロンプト"}
+                        title={`要約 - ${p.step}`}
+                        body={result.config.hierarchical_overview.prompt}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -347,18 +321,12 @@ export function Analysis({ result }: ReportProps) {
                       意見および各分析結果を含むJSONファイルを出力します。
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `出力 - ${p.step}`,
-                            body: result.config.hierarchical_aggregation.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`出力 - ${p.step}`}
+                        body={result.config.hierarchical_aggregation.source_code}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -371,18 +339,12 @@ export function Analysis({ result }: ReportProps) {
                       意見グループの概要、意見の内容などを可視化します。あなたが見ているこの画面が出来上がります。
                     </TimelineDescription>
                     <HStack>
-                      <Button
-                        variant={"outline"}
-                        size={"xs"}
-                        onClick={() =>
-                          setSelectedData({
-                            title: `表示 - ${p.step}`,
-                            body: result.config.hierarchical_visualization.source_code,
-                          })
-                        }
-                      >
-                        ソースコード
-                      </Button>
+                      <DetailButton
+                        label={"ソースコード"}
+                        title={`表示 - ${p.step}`}
+                        body={result.config.hierarchical_visualization.source_code}
+                        onSelect={setSelectedData}
+                      />
                     </HStack>
                   </TimelineContent>
                 )}
@@ -413,3 +375,22 @@ export function Analysis({ result }: ReportProps) {
     </Box>
   );
 }
+
+type DetailButtonProps = {
+  label: string;
+  title: string;
+  body?: string;
+  onSelect: (data: { title: string; body: string }) => void;
+};
+
+// 公開APIのレスポンスにはプロンプト・ソースコードが含まれないため、含まれている場合だけ表示する
+function DetailButton({ label, title, body, onSelect }: DetailButtonProps) {
+  if (!body) {
+    return null;
+  }
+  return (
+    <Button variant={"outline"} size={"xs"} onClick={() => onSelect({ title, body })}>
+      {label}
+    </Button>
+  );
+}
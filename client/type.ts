@@ -94,44 +94,48 @@ export type Config = {
     properties: string[] | string; // 含めるプロパティのリスト（配列 or 文字列）
     categories: Record<string, Record<string, string>>; // 分類情報
     category_batch_size: number; // カテゴリ処理のバッチサイズ
-    source_code: string; // 実行するスクリプトのコード
-    prompt: string; // LLM に渡すプロンプト
+    source_code?: string; // 実行するスクリプトのコード
+    prompt?: string; // LLM に渡すプロンプト
     model: string; // 使用するモデル名
   };
+  extraction_classification?: {
+    source_code?: string; // カテゴリ分類のスクリプト
+  };
   hierarchical_clustering: {
     cluster_nums: number[]; // クラスタ数のリスト
-    source_code: string; // クラスタリングのスクリプト
+    source_code?: string; // クラスタリングのスクリプト
   };
   embedding: {
     model: string; // 使用する埋め込みモデル
-    source_code: string; // 埋め込みを生成するスクリプト
+    source_code?: string; // 埋め込みを生成するスクリプト
   };
   hierarchical_initial_labelling: {
     workers: number; // 並列処理数
-    source_code: string; // 初期ラベリングスクリプト
-    prompt: string; // LLM のプロンプト
+    source_code?: string; // 初期ラベリングスクリプト
+    prompt?: string; // LLM のプロンプト
     model: string; // 使用するモデル
   };
   hierarchical_merge_labelling: {
     workers: number; // 並列処理数
-    source_code: string; // マージラベリングスクリプト
-    prompt: string; // LLM のプロンプト
+    source_code?: string; // マージラベリングスクリプト
+    prompt?: string; // LLM のプロンプト
     model: string; // 使用するモデル
   };
   hierarchical_overview: {
-    source_code: string; // 概要生成スクリプト
-    prompt: string; // LLM のプロンプト
+    source_code?: string; // 概要生成スクリプト
+    prompt?: string; // LLM のプロンプト
     model: string; // 使用するモデル
   };
   hierarchical_aggregation: {
     hidden_properties: Record<string, string[]>; // 非表示プロパティ情報
-    source_code: string; // 集約スクリプト
+    source_code?: string; // 集約スクリプト
   };
   hierarchical_visualization: {
     replacements: Record<string, string[]>;
-    source_code: string; // 集約スクリプト
+    source_code?: string; // 集約スクリプト
   };
-  plan: {
+  // プロンプト・ソースコード・実行計画は公開APIのレスポンスに含まれない
+  plan?: {
     step: string; // ステップ名
     run: boolean | string; // 実行すべきか（真偽値 or 文字列）
     reason: string; // 実行理由
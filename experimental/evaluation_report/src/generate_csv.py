@@ -3,7 +3,12 @@ import math
 import sys
 from pathlib import Path
 
+# このスクリプトから3階層上の server/ を PYTHONPATH に追加
+root_path = Path(__file__).resolve().parents[3] / "server"
+sys.path.insert(0, str(root_path))
+
 import pandas as pd
+from broadlistening.pipeline.services.result_format import expand_result
 
 
 # -----------------------------
@@ -95,7 +100,8 @@ def generate_cluster_csv():
 # 意見単位の出力
 # -----------------------------
 def generate_comment_csv():
-    result_data = load_json_with_fallback(RESULT_JSON)
+    # コンパクト形式(列ごとの配列)で保存された結果は、意見のオブジェクトのリストに戻す
+    result_data = expand_result(load_json_with_fallback(RESULT_JSON))
     point_scores = load_json_with_fallback(SIL_POINTS_JSON)
 
     arguments = result_data.get("arguments", [])
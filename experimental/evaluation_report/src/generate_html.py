@@ -3,6 +3,11 @@ import json
 import sys
 from pathlib import Path
 
+# このスクリプトから3階層上の server/ を PYTHONPATH に追加
+root_path = Path(__file__).resolve().parents[3] / "server"
+sys.path.insert(0, str(root_path))
+
+from broadlistening.pipeline.services.result_format import expand_result
 from evaluate_silhouette_score import UMAP_THRESHOLDS
 from jinja2 import Environment, FileSystemLoader
 
@@ -37,7 +42,8 @@ def generate_html(slug: str, input_dir: Path, output_dir: Path, template_dir: Pa
     base_output = output_dir / slug
     base_output.mkdir(parents=True, exist_ok=True)
 
-    result_data = load_json(base_input / "hierarchical_result.json")
+    # コンパクト形式(列ごとの配列)で保存された結果は、意見のオブジェクトのリストに戻す
+    result_data = expand_result(load_json(base_input / "hierarchical_result.json"))
 
     llm_scores_l1 = load_json(base_input / "evaluation_consistency_llm_level1.json")
     llm_scores_l2 = load_json(base_input / "evaluation_consistency_llm_level2.json")
@@ -1,9 +1,12 @@
 import argparse
 import sys
 
-from hierarchical_utils import initialization, run_step, termination
+from hierarchical_utils import initialization, run_pipeline, termination
+from services.instrumentation import reset_tracer
+from services.llm_cache import configure_llm_cache
 from steps.embedding import embedding
 from steps.extraction import extraction
+from steps.extraction_classification import extraction_classification
 from steps.hierarchical_aggregation import hierarchical_aggregation
 from steps.hierarchical_clustering import hierarchical_clustering
 from steps.hierarchical_initial_labelling import hierarchical_initial_labelling
@@ -12,7 +15,7 @@ from steps.hierarchical_overview import hierarchical_overview
 from steps.hierarchical_visualization import hierarchical_visualization
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Run the annotation pipeline with optional flags.")
     parser.add_argument("config", help="Path to config JSON file that defines the pipeline execution.")
     parser.add_argument(
@@ -38,11 +41,19 @@ def parse_arguments():
         action="store_true",
         help="Skip the html output.",
     )
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parse_arguments()
+def main(argv=None):
+    """パイプラインを実行する
+
+    Args:
+        argv: コマンドライン引数(プログラム名を除く)。省略した場合は sys.argv を使う。
+            常駐ワーカー(src/services/pipeline_worker.py)からはジョブごとに引数を渡して呼び出す
+    """
+    args = parse_arguments(argv)
+    # 常駐ワーカーでは同じプロセスで複数のジョブを実行するため、計測はジョブごとにやり直す
+    reset_tracer()
 
     # Convert argparse namespace to sys.argv format for compatibility
     new_argv = [sys.argv[0], args.config]
@@ -56,16 +67,24 @@ def main():
         new_argv.append("--without-html")
 
     config = initialization(new_argv)
+    configure_llm_cache(config.get("use_llm_cache", True))
 
     try:
-        run_step("extraction", extraction, config)
-        run_step("embedding", embedding, config)
-        run_step("hierarchical_clustering", hierarchical_clustering, config)
-        run_step("hierarchical_initial_labelling", hierarchical_initial_labelling, config)
-        run_step("hierarchical_merge_labelling", hierarchical_merge_labelling, config)
-        run_step("hierarchical_overview", hierarchical_overview, config)
-        run_step("hierarchical_aggregation", hierarchical_aggregation, config)
-        run_step("hierarchical_visualization", hierarchical_visualization, config)
+        # 依存関係(hierarchical_specs.json)のないステップは並行して実行する
+        run_pipeline(
+            {
+                "extraction": extraction,
+                "extraction_classification": extraction_classification,
+                "embedding": embedding,
+                "hierarchical_clustering": hierarchical_clustering,
+                "hierarchical_initial_labelling": hierarchical_initial_labelling,
+                "hierarchical_merge_labelling": hierarchical_merge_labelling,
+                "hierarchical_overview": hierarchical_overview,
+                "hierarchical_aggregation": hierarchical_aggregation,
+                "hierarchical_visualization": hierarchical_visualization,
+            },
+            config,
+        )
 
         termination(config)
     except Exception as e:
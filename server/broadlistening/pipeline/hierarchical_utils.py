@@ -1,10 +1,16 @@
+import csv
 import json
 import os
 import sys
+import threading
 import traceback
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from services.instrumentation import TRACE_FILENAME, get_tracer
+
 # serverディレクトリをパスに追加
 current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if current_dir not in sys.path:
@@ -21,6 +27,11 @@ PIPELINE_DIR = Path(__file__).parent
 with open(PIPELINE_DIR / "hierarchical_specs.json") as f:
     specs = json.load(f)
 
+STEP_ORDER = {spec["step"]: i for i, spec in enumerate(specs)}
+
+# 並行して実行されるステップから同時にステータスを更新するためのロック
+_status_lock = threading.RLock()
+
 
 def validate_config(config):
     if "input" not in config:
@@ -38,6 +49,8 @@ def validate_config(config):
         "provider",
         "local_llm_address",
         "enable_source_link",
+        "profile",
+        "use_llm_cache",
     ]
     step_names = [x["step"] for x in specs]
     for key in config:
@@ -52,6 +65,38 @@ def validate_config(config):
                 raise Exception(f"Unknown option '{key}' for step '{step_spec['step']}' in config")
 
 
+def _migrate_previous_jobs(config, previous_jobs):
+    """ステップの構成が変わる前のステータスの completed_jobs を、現在のステップに合わせて補う
+
+    extraction_classification は extraction から分離したステップのため、分離前のレポートのステータスには
+    記録がない。そのままでは分類と、それに依存する hierarchical_aggregation 以降が再実行されるため、
+    前回の args.csv に分類結果のカラムがそろっている(またはカテゴリが指定されていない)場合は、
+    分類を実行済みとして扱う。
+
+    hierarchical_clustering.dedup を追加する前のレポートは意見をまとめずにクラスタリングしているため、
+    記録がない場合は "off" として扱う(デフォルト値との差分で再実行されないようにする)。
+    """
+    previous_jobs = [
+        {**job, "params": {"dedup": "off", **job["params"]}} if job["step"] == "hierarchical_clustering" else job
+        for job in previous_jobs
+    ]
+    steps = {job["step"] for job in previous_jobs}
+    if "extraction" not in steps or "extraction_classification" in steps:
+        return previous_jobs
+    categories = list(config.get("extraction", {}).get("categories") or {})
+    if categories:
+        args_path = PIPELINE_DIR / f"outputs/{config['output_dir']}/args.csv"
+        try:
+            with open(args_path, newline="") as f:
+                columns = next(csv.reader(f), [])
+        except OSError:
+            return previous_jobs
+        if not all(category in columns for category in categories):
+            return previous_jobs
+    print("(!) treating extraction_classification as completed by the previous extraction")
+    return previous_jobs + [{"step": "extraction_classification", "params": {}}]
+
+
 def decide_what_to_run(config, previous):
     # find last previously tracked jobs (digging in case previous run failed)
     previous_jobs = []
@@ -60,6 +105,7 @@ def decide_what_to_run(config, previous):
         _previous = _previous["previous"]
     if _previous:
         previous_jobs = _previous.get("completed_jobs", []) + _previous.get("previously_completed_jobs", [])
+        previous_jobs = _migrate_previous_jobs(config, previous_jobs)
 
     # utility function to check if params changed
 
@@ -111,6 +157,10 @@ def decide_what_to_run(config, previous):
                 else:
                     run = False
                     reason = "nothing changed"
+        if run and step.get("journal") and not config.get("force", False):
+            # 前回の実行が途中で失敗していても、記録済みの結果を再利用して続きから実行する
+            if os.path.exists(PIPELINE_DIR / f"outputs/{config['output_dir']}/{step['journal']}"):
+                reason += " (resuming from journal)"
         plan.append({"step": stepname, "run": run, "reason": reason})
     return plan
 
@@ -208,6 +258,7 @@ def initialization(sysargv):
             "total_token_usage": 0,  # トークン使用量の累積を初期化
             "token_usage_input": 0,  # 入力トークン使用量を初期化
             "token_usage_output": 0,  # 出力トークン使用量を初期化
+            "token_usage_cached_input": 0,  # プロンプトキャッシュから読み込まれた入力トークン数を初期化
             "provider": config.get("provider"),  # プロバイダー情報を追加
             "model": config.get("model"),  # モデル情報を追加
         },
@@ -218,14 +269,19 @@ def initialization(sysargv):
 # (!) make sure to always use this function to update status...
 def update_status(config, updates):
     output_dir = config["output_dir"]
-    for key, value in updates.items():
-        if value is None and key in config:
-            del config[key]
-        else:
-            config[key] = value
-    config["lock_until"] = (datetime.now() + timedelta(minutes=5)).isoformat()
-    with open(PIPELINE_DIR / f"outputs/{output_dir}/hierarchical_status.json", "w") as file:
-        json.dump(config, file, indent=2)
+    with _status_lock:
+        for key, value in updates.items():
+            if value is None and key in config:
+                del config[key]
+            else:
+                config[key] = value
+        config["lock_until"] = (datetime.now() + timedelta(minutes=5)).isoformat()
+        # サーバーが書き込み途中のファイルを読まないよう、一時ファイルに書き出してから置き換える
+        status_path = PIPELINE_DIR / f"outputs/{output_dir}/hierarchical_status.json"
+        tmp_path = status_path.with_name(status_path.name + ".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(dict(config), file, indent=2)
+        os.replace(tmp_path, status_path)
 
 
 def update_progress(config, incr=None, total=None):
@@ -242,55 +298,116 @@ def run_step(step, func, config):
         print(f"Skipping '{step}'")
         return
     # update status before running...
-    update_status(
-        config,
-        {
-            "current_job": step,
-            "current_job_started": datetime.now().isoformat(),
-        },
-    )
+    started = datetime.now()
+    with _status_lock:
+        updates = {"running_jobs": config.get("running_jobs", []) + [step]}
+        # 並行して実行中のステップがある場合も、current_job は最も後のステップを指すようにする
+        current_job = config.get("current_job")
+        if current_job is None or STEP_ORDER.get(current_job, -1) <= STEP_ORDER[step]:
+            updates.update({"current_job": step, "current_job_started": started.isoformat()})
+        update_status(config, updates)
     print("Running step:", step)
     # run the step...
-    token_usage_before = config.get("total_token_usage", 0)
-    func(config)
-    token_usage_after = config.get("total_token_usage", token_usage_before)
-    token_usage_step = token_usage_after - token_usage_before
+    output_dir = PIPELINE_DIR / f"outputs/{config['output_dir']}"
+    try:
+        with get_tracer().span(step, output_dir=output_dir, profile=config.get("profile")) as span:
+            func(config)
+    finally:
+        export_trace(config)
+    # 並行して実行中のほかのステップの使用量を含めないよう、このステップのスパンに記録されたトークン数を使う
+    token_usage_step = span.llm_tokens()
 
     estimated_cost = 0.0
     provider = config.get("provider")
     model = config.get("model")
     token_usage_input = config.get("token_usage_input", 0)
     token_usage_output = config.get("token_usage_output", 0)
+    # 入力トークンのうちプロンプトキャッシュから読み込まれたもの(割引価格で計算する)
+    token_usage_cached_input = get_tracer().cached_input_tokens()
 
     if provider and model and token_usage_input > 0 and token_usage_output > 0:
         if LLMPricing:
-            estimated_cost = LLMPricing.calculate_cost(provider, model, token_usage_input, token_usage_output)
+            estimated_cost = LLMPricing.calculate_cost(
+                provider, model, token_usage_input, token_usage_output, token_usage_cached_input
+            )
             print(f"Estimated cost: ${estimated_cost:.4f} ({provider} {model})")
         else:
             estimated_cost = 0.0
 
     # update status after running...
-    update_status(
-        config,
-        {
-            "current_job_progress": None,
-            "current_jop_tasks": None,
-            "completed_jobs": config.get("completed_jobs", [])
-            + [
-                {
-                    "step": step,
-                    "completed": datetime.now().isoformat(),
-                    "duration": (
-                        datetime.fromisoformat(datetime.now().isoformat())
-                        - datetime.fromisoformat(config["current_job_started"])
-                    ).total_seconds(),
-                    "params": config[step],
-                    "token_usage": token_usage_step,  # ステップ毎のトークン使用量を追加
-                }
-            ],
-            "estimated_cost": estimated_cost,  # 推定コストを追加
-        },
-    )
+    with _status_lock:
+        running_jobs = [job for job in config.get("running_jobs", []) if job != step]
+        update_status(
+            config,
+            {
+                "running_jobs": running_jobs or None,
+                "current_job_progress": None,
+                "current_jop_tasks": None,
+                "completed_jobs": config.get("completed_jobs", [])
+                + [
+                    {
+                        "step": step,
+                        "completed": datetime.now().isoformat(),
+                        "duration": (datetime.now() - started).total_seconds(),
+                        "params": config[step],
+                        "token_usage": token_usage_step,  # ステップ毎のトークン使用量を追加
+                        "cpu_time": span.cpu_time,
+                        "process_peak_rss_bytes": span.process_peak_rss_bytes,
+                        "peak_rss_increase_bytes": span.peak_rss_increase_bytes,
+                    }
+                ],
+                "token_usage_cached_input": token_usage_cached_input,
+                "estimated_cost": estimated_cost,  # 推定コストを追加
+            },
+        )
+
+
+def run_pipeline(steps: dict[str, Callable], config) -> None:
+    """hierarchical_specs.json の dependencies.steps に従ってステップを実行する
+
+    依存するステップがすべて終了(またはスキップ)したステップから開始し、互いに依存しない
+    ステップは並行して実行する。実行するかどうかの判定は従来どおり run_step が plan に従って行う。
+    いずれかのステップが失敗した場合は新しいステップを開始せず、実行中のステップの終了を待ってから
+    最初の例外を送出する。
+    プロファイラは同時に1つしか有効にできないため、config の "profile" を指定した場合はステップを1つずつ実行する。
+    """
+    dependencies = {
+        spec["step"]: [dep for dep in spec["dependencies"]["steps"] if dep in steps]
+        for spec in specs
+        if spec["step"] in steps
+    }
+    pending = list(dependencies)
+    finished: set[str] = set()
+    running = {}
+    error: Exception | None = None
+    max_workers = 1 if config.get("profile") else max(1, len(pending))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline-step") as executor:
+        while pending or running:
+            if error is None:
+                ready = [step for step in pending if all(dep in finished for dep in dependencies[step])]
+                for step in ready:
+                    pending.remove(step)
+                    running[executor.submit(run_step, step, steps[step], config)] = step
+            if not running:
+                if error is None and pending:
+                    raise RuntimeError(f"Unresolvable step dependencies: {pending}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    error = error or e
+                else:
+                    finished.add(step)
+    if error is not None:
+        raise error
+
+
+def export_trace(config):
+    """計測結果を outputs/{dataset}/hierarchical_trace.json に書き出す"""
+    get_tracer().export(PIPELINE_DIR / f"outputs/{config['output_dir']}/{TRACE_FILENAME}")
 
 
 def termination(config, error=None):
@@ -303,6 +420,7 @@ def termination(config, error=None):
         config["previously_completed_jobs"] = [o for o in old_jobs if o["step"] not in newly_completed]
         # now we can drop previous key (we don't want to store infinite history)
         del config["previous"]
+    export_trace(config)
     if error is None:
         print(f"Total token usage: {config.get('total_token_usage', 0)}")
         update_status(
@@ -0,0 +1,191 @@
+"""パイプラインの中間ファイル(artifact)の読み書き
+
+各ステップは outputs/{dataset}/ 以下のファイルを直接読み書きせず、このモジュールを経由する。
+
+- 表形式のデータ(args, hierarchical_clusters など)は、サーバーや評価スクリプトからも読まれるため
+  常にCSVで書き出す。環境変数 PIPELINE_TABLE_FORMAT=parquet を指定し pyarrow がインストール
+  されている場合は、型付きの列指向フォーマットであるParquetも併せて書き出し、読み込み時はそちらを
+  優先する(CSVの方が新しい場合は、サーバー側で編集されたものとしてCSVを読む)。
+- 埋め込みベクトルは float32 の .npy ファイルとして保存し、読み込み時はメモリマップで開く。
+  行の順序に対応する arg-id は embeddings_index.csv に保存する。
+"""
+
+import logging
+import os
+from collections.abc import Callable, Sequence
+from importlib.util import find_spec
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .instrumentation import get_tracer
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+EMBEDDINGS_INDEX_FILENAME = "embeddings_index.csv"
+LEGACY_EMBEDDINGS_FILENAME = "embeddings.pkl"
+
+Columns = Sequence[str] | Callable[[str], bool] | None
+
+
+def artifact_path(dataset: str, filename: str) -> Path:
+    return Path("outputs") / dataset / filename
+
+
+def table_format() -> str:
+    table_format = os.getenv("PIPELINE_TABLE_FORMAT", "csv").lower()
+    if table_format == "parquet" and find_spec("pyarrow") is None:
+        logging.warning("PIPELINE_TABLE_FORMAT=parquet requires pyarrow; falling back to csv")
+        return "csv"
+    return table_format
+
+
+def _parquet_path(dataset: str, name: str) -> Path | None:
+    """読み込みに使えるParquetファイルがあればそのパスを返す"""
+    parquet_path = artifact_path(dataset, f"{name}.parquet")
+    csv_path = artifact_path(dataset, f"{name}.csv")
+    if not parquet_path.exists() or find_spec("pyarrow") is None:
+        return None
+    if csv_path.exists() and csv_path.stat().st_mtime > parquet_path.stat().st_mtime:
+        return None
+    return parquet_path
+
+
+def read_table(dataset: str, name: str, columns: Columns = None) -> pd.DataFrame:
+    """表形式の中間ファイルを読み込む
+
+    Args:
+        dataset: 出力ディレクトリ名
+        name: 拡張子を除いたファイル名(例: "args")
+        columns: 読み込むカラム名のリスト、またはカラム名を受け取って読み込むかどうかを返す関数。
+            Noneの場合はすべてのカラムを読み込む
+    """
+    parquet_path = _parquet_path(dataset, name)
+    if parquet_path is not None:
+        if callable(columns):
+            import pyarrow.parquet as pq
+
+            columns = [c for c in pq.read_schema(parquet_path).names if columns(c)]
+        get_tracer().record_read(parquet_path)
+        return pd.read_parquet(parquet_path, columns=list(columns) if columns is not None else None)
+    csv_path = artifact_path(dataset, f"{name}.csv")
+    get_tracer().record_read(csv_path)
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def write_table(dataset: str, name: str, df: pd.DataFrame) -> None:
+    """表形式の中間ファイルを書き出す(CSVは常に書き出す)
+
+    並行して実行中の他のステップが書き込み途中のファイルを読まないよう、一時ファイルに書き出してから置き換える。
+    """
+    _write_atomically(artifact_path(dataset, f"{name}.csv"), lambda path: df.to_csv(path, index=False))
+    if table_format() == "parquet":
+        _write_atomically(artifact_path(dataset, f"{name}.parquet"), lambda path: df.to_parquet(path, index=False))
+
+
+def _write_atomically(path: Path, write: Callable[[Path], None]) -> None:
+    """一時ファイルに書き出してから置き換える(失敗した場合は一時ファイルを削除する)"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def save_embeddings(dataset: str, arg_ids: Sequence[str], embeddings: np.ndarray) -> None:
+    """埋め込みベクトルを float32 の .npy とarg-idのインデックスファイルとして保存する"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.shape[0] != len(arg_ids):
+        raise ValueError(f"embeddings has {embeddings.shape[0]} rows but {len(arg_ids)} arg-ids were given")
+    with EmbeddingWriter(dataset, arg_ids) as writer:
+        writer.write(range(len(arg_ids)), embeddings)
+
+
+class EmbeddingWriter:
+    """埋め込みベクトルを行単位で、あらかじめ確保した float32 のメモリマップに書き込む
+
+    行列全体をPythonのリストとして保持せずに、バッチごとに該当する行へ書き込む。
+    次元数は最初に書き込むベクトルから決まる。一時ファイルに書き込み、close()で置き換える。
+    with文で使うと、ブロックが正常に終了した場合は close() し、例外で終了した場合は discard() で一時ファイルを
+    削除するため、途中で失敗した場合に不完全なファイルが残らない。
+    """
+
+    def __init__(self, dataset: str, arg_ids: Sequence[str]):
+        self.dataset = dataset
+        self.arg_ids = list(arg_ids)
+        self.path = artifact_path(dataset, EMBEDDINGS_FILENAME)
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._array: np.memmap | None = None
+        self._written = np.zeros(len(self.arg_ids), dtype=bool)
+
+    def write(self, rows: Sequence[int], vectors) -> None:
+        """rows番目の行にvectorsを書き込む"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(rows) == 0:
+            return
+        if self._array is None:
+            self._array = np.lib.format.open_memmap(
+                self._tmp_path, mode="w+", dtype=np.float32, shape=(len(self.arg_ids), vectors.shape[1])
+            )
+        self._array[np.asarray(rows)] = vectors
+        self._written[np.asarray(rows)] = True
+
+    def __enter__(self) -> "EmbeddingWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def close(self) -> None:
+        if not self._written.all():
+            self.discard()
+            raise RuntimeError(f"{int((~self._written).sum())} embeddings were not written")
+        try:
+            _write_atomically(
+                artifact_path(self.dataset, EMBEDDINGS_INDEX_FILENAME),
+                lambda path: pd.DataFrame({"arg-id": self.arg_ids}).to_csv(path, index=False),
+            )
+            if self._array is None:
+                # 意見が0件の場合
+                np.save(self.path, np.zeros((0, 0), dtype=np.float32))
+                return
+            self._array.flush()
+            self._array = None
+            os.replace(self._tmp_path, self.path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self) -> None:
+        """書き込み途中の一時ファイルを削除する"""
+        self._array = None
+        self._tmp_path.unlink(missing_ok=True)
+
+
+def load_embeddings(dataset: str, mmap: bool = True) -> tuple[list[str], np.ndarray]:
+    """埋め込みベクトルを (arg-idのリスト, 行列) として読み込む
+
+    .npy はメモリマップで開くため、行列全体をメモリに読み込まない。
+    以前のバージョンで作成された embeddings.pkl しかない場合はそちらを読み込む。
+    """
+    path = artifact_path(dataset, EMBEDDINGS_FILENAME)
+    if path.exists():
+        index_path = artifact_path(dataset, EMBEDDINGS_INDEX_FILENAME)
+        get_tracer().record_read(path)
+        get_tracer().record_read(index_path)
+        embeddings = np.load(path, mmap_mode="r" if mmap else None)
+        arg_ids = pd.read_csv(index_path)["arg-id"].astype(str).tolist()
+        return arg_ids, embeddings
+
+    legacy_path = artifact_path(dataset, LEGACY_EMBEDDINGS_FILENAME)
+    if legacy_path.exists():
+        get_tracer().record_read(legacy_path)
+        df = pd.read_pickle(legacy_path)
+        return df["arg-id"].astype(str).tolist(), np.asarray(df["embedding"].tolist(), dtype=np.float32)
+
+    raise FileNotFoundError(f"Embeddings not found: {path}")
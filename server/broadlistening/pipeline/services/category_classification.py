@@ -4,7 +4,8 @@ import json
 import pandas as pd
 from tqdm import tqdm
 
-from services.llm import request_to_openai
+from services.instrumentation import bind_current_span
+from services.llm import request_to_chat_ai
 
 BASE_CLASSIFICATION_PROMPT = """与えられた意見群をカテゴリに分類してください
 
@@ -112,16 +113,24 @@ def _parse_arg_result(classification_results: dict, arg_id: str, categories: lis
     return parsed_result
 
 
-def classify_batch_args(batch_args: pd.DataFrame, categories: dict, model: str) -> dict:
+def classify_batch_args(
+    batch_args: pd.DataFrame,
+    categories: dict,
+    model: str,
+    provider: str = "openai",
+    local_llm_address: str | None = None,
+) -> dict:
     category_string = _build_categories_string(categories)
     batch_args_string = _build_batch_args_string(batch_args)
     prompt = BASE_CLASSIFICATION_PROMPT.format(categories_string=category_string, args_string=batch_args_string)
-    result = request_to_openai(
+    result, _, _, _ = request_to_chat_ai(
         messages=[
             {"role": "system", "content": prompt},
         ],
         model=model,
         is_json=True,
+        provider=provider,
+        local_llm_address=local_llm_address,
     )
     try:
         return json.loads(result)
@@ -137,10 +146,12 @@ def classify_args(args: pd.DataFrame, config, workers: int) -> pd.DataFrame:
         batch_start_indices = range(0, len(args), batch_size)
         future_to_batch = {
             executor.submit(
-                classify_batch_args,
+                bind_current_span(classify_batch_args),
                 args.loc[batch_idx : batch_idx + batch_size],
                 config["extraction"]["categories"],
                 config["extraction"]["model"],
+                config.get("provider", "openai"),
+                config.get("local_llm_address"),
             ): batch_idx
             for batch_idx in batch_start_indices
         }
@@ -0,0 +1,260 @@
+"""コメント・意見の重複排除
+
+パブリックコメントなどでは、同じ文面(テンプレートのコピー)のコメントが大量に含まれることがある。
+抽出(extraction)の前に本文が同じコメントをまとめ、代表のコメントだけをLLMに送り、抽出結果を同じグループの
+すべてのコメントに割り当てる。
+
+重複とみなす基準(mode):
+- "exact": 本文が完全に一致するもの
+- "normalized": 全角・半角の揺れ(NFKC)、空白、句読点・記号、英字の大文字・小文字の違いを無視して一致するもの
+- "near": normalized に加えて、文字の3-gramの集合のJaccard係数が threshold 以上のもの(MinHash/LSHで候補を絞り込む)
+- "off": 重複排除を行わない
+
+抽出後の意見についても、クラスタリングの前にほぼ同じ意見をまとめ、代表の意見だけを UMAP/KMeans に渡す
+(find_argument_representatives)。意見の本文による判定("text")と、埋め込みのコサイン類似度による判定
+("embedding"、ランダムな超平面によるLSHで候補を絞り込む)がある。
+"""
+
+import hashlib
+import unicodedata
+from collections import defaultdict
+from collections.abc import Hashable, Sequence
+
+import numpy as np
+
+DEDUP_MODES = ("off", "exact", "normalized", "near")
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+# LSHのバンド数(1バンドあたり NUM_PERMUTATIONS // NUM_BANDS 個のハッシュ値)
+NUM_BANDS = 16
+_MERSENNE_PRIME = (1 << 61) - 1
+
+ARGUMENT_DEDUP_MODES = ("off", "text", "embedding")
+DEFAULT_TEXT_THRESHOLD = 0.9
+DEFAULT_COSINE_THRESHOLD = 0.95
+# 埋め込みのLSHのバンド数と、1バンドあたりの超平面の数(ビット数)
+EMBEDDING_LSH_BANDS = 32
+EMBEDDING_LSH_BITS = 16
+# 埋め込みを射影するときに一度に読み込む行数(メモリマップの行列全体をメモリに載せないため)
+_PROJECTION_CHUNK_ROWS = 65536
+
+
+class _DisjointSet:
+    """行番号のUnion-Find。先に現れた(番号が小さい)ものを根にする"""
+
+    def __init__(self, size: int):
+        self.parents = list(range(size))
+
+    def find(self, i: int) -> int:
+        parents = self.parents
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    def roots(self) -> np.ndarray:
+        return np.array([self.find(i) for i in range(len(self.parents))], dtype=np.int64)
+
+
+def normalize_comment(text: str) -> str:
+    """重複判定用にコメント本文を正規化する
+
+    全角・半角を揃え(NFKC)、英字を小文字にし、空白・句読点・記号を取り除く。
+    """
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return "".join(ch for ch in text if not ch.isspace() and unicodedata.category(ch)[0] not in ("P", "S"))
+
+
+def group_duplicates(
+    items: Sequence[tuple[Hashable, str]], mode: str = "normalized", threshold: float = 0.9
+) -> dict[Hashable, list[Hashable]]:
+    """(comment-id, 本文) のリストを重複ごとにまとめる
+
+    Returns:
+        代表のcomment-idから、そのグループに属するcomment-idのリスト(代表を含む、items の順)への辞書。
+        代表は各グループで items の中で最初に現れるコメントで、辞書のキーも items の順に並ぶ
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode: {mode}")
+    if mode == "off":
+        return {comment_id: [comment_id] for comment_id, _ in items}
+
+    # 記号だけのコメントなど、正規化すると空になるものは本文が完全に一致する場合だけまとめる
+    keys = [str(body) if mode == "exact" else (normalize_comment(body) or f"\0{body}") for _, body in items]
+    # 先に現れたコメントを代表にする
+    disjoint_set = _DisjointSet(len(items))
+    first_by_key: dict[str, int] = {}
+    for i, key in enumerate(keys):
+        if key in first_by_key:
+            disjoint_set.union(first_by_key[key], i)
+        else:
+            first_by_key[key] = i
+
+    if mode == "near":
+        unique = [i for i in first_by_key.values() if not keys[i].startswith("\0")]
+        for i, j in _near_duplicate_pairs([keys[i] for i in unique], threshold):
+            disjoint_set.union(unique[i], unique[j])
+
+    groups: dict[Hashable, list[Hashable]] = {}
+    representatives: dict[int, Hashable] = {}
+    for i, (comment_id, _) in enumerate(items):
+        root = disjoint_set.find(i)
+        if root not in representatives:
+            representatives[root] = items[root][0]
+            groups[items[root][0]] = []
+        groups[representatives[root]].append(comment_id)
+    return groups
+
+
+def _shingles(text: str) -> set[str]:
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def _near_duplicate_pairs(texts: list[str], threshold: float) -> list[tuple[int, int]]:
+    """MinHash/LSHで候補を絞り込み、Jaccard係数が threshold 以上のテキストの組を返す"""
+    shingle_sets = [_shingles(text) for text in texts]
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, _MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=NUM_PERMUTATIONS, dtype=np.uint64)
+    rows = NUM_PERMUTATIONS // NUM_BANDS
+
+    buckets: dict[tuple[int, bytes], list[int]] = defaultdict(list)
+    for index, shingles in enumerate(shingle_sets):
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=7).digest(), "little") for s in shingles],
+            dtype=np.uint64,
+        )
+        # (a * x + b) mod p を各ハッシュ関数について計算し、最小値をシグネチャにする(uint64の桁あふれは許容する)
+        signature = ((np.outer(hashes, a) + b) % np.uint64(_MERSENNE_PRIME)).min(axis=0)
+        for band in range(NUM_BANDS):
+            buckets[(band, signature[band * rows : (band + 1) * rows].tobytes())].append(index)
+
+    # 同じバケットのテキストは、バケットの先頭のテキストとだけ比較する(テンプレートの変形が大量にある場合でも
+    # 比較回数が件数に比例するようにする。先頭と似ていないテキスト同士は他のバンドのバケットで比較される)
+    pairs: set[tuple[int, int]] = set()
+    for head, *members in buckets.values():
+        for j in members:
+            if (head, j) not in pairs and _jaccard(shingle_sets[head], shingle_sets[j]) >= threshold:
+                pairs.add((head, j))
+    return sorted(pairs)
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    return len(a & b) / len(a | b)
+
+
+def find_argument_representatives(
+    arguments: Sequence[str],
+    embeddings: np.ndarray | None = None,
+    mode: str = "off",
+    threshold: float | None = None,
+) -> np.ndarray:
+    """クラスタリングの前に、ほぼ同じ意見をまとめる
+
+    Args:
+        arguments: 意見の本文(埋め込みの行と同じ順)
+        embeddings: 意見の埋め込み(mode が "embedding" の場合に使う)
+        mode: "off" / "text"(本文の3-gramのJaccard係数) / "embedding"(埋め込みのコサイン類似度)
+        threshold: 同じ意見とみなす類似度の下限。None の場合は mode ごとのデフォルト値
+
+    Returns:
+        各意見の代表の行番号の配列。代表は各グループで最初に現れる意見で、代表自身の値は自分の行番号になる
+    """
+    if mode not in ARGUMENT_DEDUP_MODES:
+        raise ValueError(f"Unknown argument dedup mode: {mode}")
+    if mode == "off":
+        return np.arange(len(arguments), dtype=np.int64)
+    if mode == "text":
+        groups = group_duplicates(
+            list(enumerate(arguments)),
+            mode="near",
+            threshold=DEFAULT_TEXT_THRESHOLD if threshold is None else threshold,
+        )
+        representatives = np.empty(len(arguments), dtype=np.int64)
+        for representative, members in groups.items():
+            representatives[members] = representative
+        return representatives
+    if embeddings is None or len(embeddings) != len(arguments):
+        raise ValueError("embeddings must have one row per argument")
+    return group_near_duplicate_embeddings(embeddings, DEFAULT_COSINE_THRESHOLD if threshold is None else threshold)
+
+
+def group_near_duplicate_embeddings(embeddings: np.ndarray, threshold: float = DEFAULT_COSINE_THRESHOLD) -> np.ndarray:
+    """コサイン類似度が threshold 以上の埋め込みをまとめ、各行の代表の行番号を返す
+
+    ランダムな超平面のどちら側にあるか(SimHash)をバンドに分けてハッシュし、同じバケットに入った行だけを比較する。
+    バケットの中では先頭の行と残りの行を比較して似ているものを取り除いていくため、同じ意見が大量にある場合も
+    比較回数は件数にほぼ比例する。
+    """
+    n_rows = len(embeddings)
+    disjoint_set = _DisjointSet(n_rows)
+    if n_rows < 2:
+        return disjoint_set.roots()
+
+    # 埋め込みは全体が一方向に偏っていることが多いため、平均を引いてから射影して、無関係な意見が
+    # 同じバケットに入りにくくする(類似度の判定には元の埋め込みを使う)
+    mean = np.asarray(embeddings.mean(axis=0), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    planes = rng.standard_normal((embeddings.shape[1], EMBEDDING_LSH_BANDS * EMBEDDING_LSH_BITS)).astype(np.float32)
+    band_keys = np.empty((n_rows, EMBEDDING_LSH_BANDS), dtype=np.uint64)
+    norms = np.empty(n_rows, dtype=np.float32)
+    weights = np.uint64(1) << np.arange(EMBEDDING_LSH_BITS, dtype=np.uint64)
+    for start in range(0, n_rows, _PROJECTION_CHUNK_ROWS):
+        chunk = np.asarray(embeddings[start : start + _PROJECTION_CHUNK_ROWS], dtype=np.float32)
+        norms[start : start + len(chunk)] = np.linalg.norm(chunk, axis=1)
+        bits = ((chunk - mean) @ planes > 0).reshape(len(chunk), EMBEDDING_LSH_BANDS, EMBEDDING_LSH_BITS)
+        band_keys[start : start + len(chunk)] = (bits.astype(np.uint64) * weights).sum(axis=2)
+    norms[norms == 0] = 1
+
+    for band in range(EMBEDDING_LSH_BANDS):
+        keys = band_keys[:, band]
+        order = np.argsort(keys, kind="stable")
+        bucket_of = np.concatenate(([0], np.cumsum(np.diff(keys[order]) != 0)))
+        # バケットごとに先頭の行と残りの行をまとめて比較し、先頭と似ていなかった行で同じことを繰り返す
+        # 前のバンドですでに同じグループになった組は比較しない
+        roots = disjoint_set.roots()
+        positions = _in_shared_buckets(np.arange(n_rows), bucket_of)
+        while len(positions) > 1:
+            buckets = bucket_of[positions]
+            is_head = np.concatenate(([True], buckets[1:] != buckets[:-1]))
+            heads = order[positions[is_head][np.cumsum(is_head) - 1]][~is_head]
+            rest = positions[~is_head]
+            similar = roots[order[rest]] == roots[heads]
+            similar[~similar] = (
+                _cosine_similarities(embeddings, norms, order[rest[~similar]], heads[~similar]) >= threshold
+            )
+            for head, member in zip(heads[similar], order[rest[similar]], strict=True):
+                disjoint_set.union(int(head), int(member))
+            positions = _in_shared_buckets(rest[~similar], bucket_of)
+    return disjoint_set.roots()
+
+
+def _in_shared_buckets(positions: np.ndarray, bucket_of: np.ndarray) -> np.ndarray:
+    """positions(昇順)のうち、同じバケットの行がほかにもあるものだけを返す"""
+    if len(positions) == 0:
+        return positions
+    buckets = bucket_of[positions]
+    same_as_next = np.concatenate((buckets[1:] == buckets[:-1], [False]))
+    same_as_previous = np.concatenate(([False], buckets[1:] == buckets[:-1]))
+    return positions[same_as_next | same_as_previous]
+
+
+def _cosine_similarities(embeddings: np.ndarray, norms: np.ndarray, rows: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """rows[i] と others[i] の行のコサイン類似度"""
+    similarities = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), _PROJECTION_CHUNK_ROWS):
+        a = rows[start : start + _PROJECTION_CHUNK_ROWS]
+        b = others[start : start + _PROJECTION_CHUNK_ROWS]
+        dots = np.einsum(
+            "ij,ij->i", np.asarray(embeddings[a], dtype=np.float32), np.asarray(embeddings[b], dtype=np.float32)
+        )
+        similarities[start : start + len(a)] = dots / (norms[a] * norms[b])
+    return similarities
@@ -0,0 +1,145 @@
+"""埋め込みベクトルの永続キャッシュ
+
+(provider, model, 正規化したテキスト) のハッシュをキーとして、float32 の埋め込みベクトルを
+SQLite に保存する。同じ意見テキストが別のレポートや同じレポートの再実行で現れた場合に、
+埋め込みAPIを呼ばずに再利用するためのもの。
+
+キャッシュファイルは複数のパイプラインプロセスから同時に参照されるため、WALモードで開く。
+合計サイズが上限を超えた場合は、最後に参照された時刻が古いものから削除する。
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = Path(__file__).parent.parent / "cache"
+DEFAULT_MAX_BYTES = 2 * 1024**3  # 2GB
+
+# SQLiteのプレースホルダ数の上限(古いバージョンでは999)を超えないように分割して問い合わせる
+_QUERY_CHUNK_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用にテキストを正規化する
+
+    全角・半角の揺れ(NFKC)と前後の空白の違いは同じテキストとして扱う。
+    """
+    return unicodedata.normalize("NFKC", str(text)).strip()
+
+
+def cache_key(provider: str, model: str, text: str) -> str:
+    payload = "\0".join([provider, model, normalize_text(text)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLiteをバックエンドとした、内容アドレス方式の埋め込みキャッシュ"""
+
+    def __init__(self, path: str | Path | None = None, max_bytes: int | None = None):
+        if path is None:
+            cache_dir = Path(os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR))
+            path = cache_dir / "embeddings.sqlite3"
+        if max_bytes is None:
+            max_bytes = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_accessed ON embeddings (last_accessed)")
+        self._conn.commit()
+
+    def get_many(self, provider: str, model: str, texts: Sequence[str]) -> list[np.ndarray | None]:
+        """テキストごとのキャッシュ済みベクトルを返す。未キャッシュのものはNone"""
+        keys = [cache_key(provider, model, text) for text in texts]
+        found: dict[str, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _QUERY_CHUNK_SIZE):
+                chunk = list(set(keys[i : i + _QUERY_CHUNK_SIZE]))
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_accessed = ? WHERE key IN ({placeholders})",
+                        [now, *chunk],
+                    )
+            self._conn.commit()
+        return [found.get(key) for key in keys]
+
+    def put_many(self, provider: str, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """テキストと埋め込みベクトルの組をキャッシュに保存する"""
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings, strict=True):
+            vector = np.asarray(embedding, dtype=np.float32)
+            rows.append((cache_key(provider, model, text), provider, model, len(vector), vector.tobytes(), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, provider, model, dim, vector, last_accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._evict()
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        return int(total)
+
+    def _evict(self) -> None:
+        """合計サイズが上限を超えている場合、参照が古いものから削除する"""
+        excess = self._total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+
+        removed = 0
+        keys_to_remove = []
+        cursor = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_accessed ASC")
+        for key, size in cursor:
+            keys_to_remove.append(key)
+            removed += size
+            if removed >= excess:
+                break
+        for i in range(0, len(keys_to_remove), _QUERY_CHUNK_SIZE):
+            chunk = keys_to_remove[i : i + _QUERY_CHUNK_SIZE]
+            self._conn.execute(f"DELETE FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+        self._conn.commit()
+        logging.info(f"Evicted {len(keys_to_remove)} embeddings ({removed} bytes) from cache")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,166 @@
+"""埋め込みリクエストの並列実行
+
+意見を推定トークン数に基づいてリクエストごとの上限に収まるバッチに詰め、複数のバッチを並行して
+埋め込みAPIに送る。失敗したバッチだけを再試行する。
+
+- レート制限(429)・サーバーエラー(5xx)・接続エラーは、そのバッチだけを待機してから再試行する
+- リクエストが大きすぎる等の400エラーは、バッチを半分に分割して再試行する
+
+環境変数で上限を設定できる:
+    EMBEDDING_CONCURRENCY: 同時に送るバッチ数(デフォルト 4)
+    EMBEDDING_MAX_BATCH_SIZE: 1リクエストあたりの意見数の上限(デフォルト 1000)
+    EMBEDDING_MAX_BATCH_TOKENS: 1リクエストあたりの推定トークン数の上限(デフォルト 200000)
+    EMBEDDING_MAX_RETRIES: 1つのバッチを再試行する回数の上限(デフォルト 5)
+"""
+
+import logging
+import os
+import time
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import openai
+
+from .instrumentation import bind_current_span, get_tracer
+from .llm import request_to_embed
+from .llm_scheduler import MAX_BACKOFF_SECONDS, parse_retry_after
+from .local_embedding import CHUNK_SIZE as LOCAL_CHUNK_SIZE
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_BATCH_SIZE = 1000
+# OpenAIの埋め込みAPIは1リクエストあたり30万トークンまで。文字数で見積もるため余裕を持たせる
+DEFAULT_MAX_BATCH_TOKENS = 200_000
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_SECONDS = 2.0
+
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+def estimate_text_tokens(text: str) -> int:
+    """テキストのトークン数を大まかに見積もる(日本語は概ね1文字1トークン以下になるため文字数を上限側の値とする)"""
+    return max(1, len(text))
+
+
+def pack_batches(texts: Sequence[str], max_batch_size: int, max_batch_tokens: int) -> list[list[int]]:
+    """テキストのインデックスを、件数と推定トークン数の上限に収まるバッチに分ける"""
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_text_tokens(text)
+        if batch and (len(batch) >= max_batch_size or batch_tokens + tokens > max_batch_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.RateLimitError):
+        message = str(error).lower()
+        return "insufficient_quota" not in message
+    return isinstance(error, _RETRYABLE_ERRORS)
+
+
+class EmbeddingEngine:
+    """埋め込みリクエストをバッチに分けて並行して送る"""
+
+    def __init__(
+        self,
+        embed: Callable[[list[str]], Sequence],
+        name: str = "embedding",
+        concurrency: int | None = None,
+        max_batch_size: int | None = None,
+        max_batch_tokens: int | None = None,
+        max_retries: int | None = None,
+    ):
+        self.embed = embed
+        self.name = name
+        self.concurrency = concurrency or int(os.getenv("EMBEDDING_CONCURRENCY", DEFAULT_CONCURRENCY))
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE))
+        self.max_batch_tokens = max_batch_tokens or int(
+            os.getenv("EMBEDDING_MAX_BATCH_TOKENS", DEFAULT_MAX_BATCH_TOKENS)
+        )
+        self.max_retries = (
+            max_retries if max_retries is not None else int(os.getenv("EMBEDDING_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        )
+
+    @classmethod
+    def from_config(cls, config) -> "EmbeddingEngine":
+        model = config["embedding"]["model"]
+        is_embedded_at_local = config["is_embedded_at_local"]
+        provider = config["provider"]
+
+        def embed(texts: list[str]):
+            return request_to_embed(texts, model, is_embedded_at_local, provider, config.get("local_llm_address"))
+
+        if is_embedded_at_local:
+            # ローカルのモデルはプロセス内で計算するため並行して送っても速くならない。
+            # 大きめの単位で渡し、ローカル埋め込みエンジン側で文字数順のバッチに分けさせる
+            return cls(
+                embed,
+                name="local-embedding",
+                concurrency=1,
+                max_batch_size=LOCAL_CHUNK_SIZE,
+                max_batch_tokens=LOCAL_CHUNK_SIZE * 1000,
+            )
+        return cls(embed, name=f"{provider}-embedding")
+
+    def iter_embeddings(self, texts: Sequence[str]) -> Iterator[tuple[list[int], np.ndarray]]:
+        """(テキストのインデックスのリスト, float32の埋め込み行列) をバッチが完了した順に返す"""
+        texts = list(texts)
+        batches = pack_batches(texts, self.max_batch_size, self.max_batch_tokens)
+        if not batches:
+            return
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embedding") as executor:
+            futures = {
+                executor.submit(bind_current_span(self._embed_with_retry), [texts[i] for i in batch]): batch
+                for batch in batches
+            }
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def embed_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """テキストの埋め込みを入力と同じ順序の float32 行列として返す"""
+        result: np.ndarray | None = None
+        for rows, vectors in self.iter_embeddings(texts):
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[rows] = vectors
+        return result if result is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def _embed_with_retry(self, texts: list[str]) -> np.ndarray:
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.embed(texts), dtype=np.float32)
+            except openai.BadRequestError:
+                get_tracer().record_llm_call(self.name, time.perf_counter() - start, 0.0, attempt, error=True)
+                if len(texts) == 1:
+                    raise
+                # リクエストが大きすぎる場合などは、半分に分けてそれぞれ送り直す
+                middle = len(texts) // 2
+                logging.warning(f"Embedding request rejected; splitting batch of {len(texts)} into two")
+                return np.concatenate([self._embed_with_retry(texts[:middle]), self._embed_with_retry(texts[middle:])])
+            except Exception as e:
+                if not _is_retryable(e) or attempt > self.max_retries:
+                    get_tracer().record_llm_call(self.name, time.perf_counter() - start, 0.0, attempt, error=True)
+                    raise
+                wait = parse_retry_after(e)
+                if wait is None:
+                    wait = min(BACKOFF_SECONDS * 2 ** (attempt - 1), MAX_BACKOFF_SECONDS)
+                logging.warning(f"Embedding request failed ({type(e).__name__}); retrying batch in {wait:.1f}s")
+                time.sleep(wait)
+                continue
+            get_tracer().record_llm_call(self.name, time.perf_counter() - start, 0.0, attempt)
+            return vectors
@@ -0,0 +1,129 @@
+"""抽出と並行して埋め込みを計算するプリフェッチャー
+
+extraction ステップで意見が抽出されるたびにキューへ投入し、バックグラウンドのスレッドでバッチごとに
+埋め込みAPIへ送って埋め込みキャッシュに保存する。embedding ステップはキャッシュから読み込むだけになるため、
+抽出の完了から数秒で埋め込みが揃う。
+
+プリフェッチに失敗した意見は embedding ステップで改めて計算するため、ここでのエラーは警告に留める。
+"""
+
+import logging
+import os
+import queue
+import threading
+from collections.abc import Callable, Iterable, Sequence
+
+import numpy as np
+
+from .embedding_cache import EmbeddingCache
+from .embedding_engine import EmbeddingEngine
+from .instrumentation import bind_current_span
+from .local_embedding import get_local_embedding_engine
+
+DEFAULT_BATCH_SIZE = 1000
+# バッチが埋まらなくても、この秒数だけ新しい意見が来なければ送信する
+FLUSH_INTERVAL_SECONDS = 1.0
+
+
+def embedding_cache_namespace(config) -> tuple[str, str]:
+    """埋め込みキャッシュのキーに使う(provider, model)を返す
+
+    実際に埋め込みを計算するモデルが変われば別のキーになるようにする。
+    ローカルの埋め込みでは、バックエンド(torch / onnx / onnx-int8)と量子化の設定も含める。
+    """
+    if config["is_embedded_at_local"]:
+        return "sentence-transformers", get_local_embedding_engine().cache_namespace()
+    provider = config["provider"]
+    if provider == "azure":
+        return provider, os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME", config["embedding"]["model"])
+    return provider, config["embedding"]["model"]
+
+
+class EmbeddingPrefetcher:
+    """投入された意見の埋め込みをバックグラウンドで計算し、埋め込みキャッシュに保存する"""
+
+    def __init__(
+        self,
+        embed: Callable[[list[str]], Sequence],
+        cache: EmbeddingCache,
+        provider: str,
+        model: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL_SECONDS,
+        on_progress: Callable[[dict], None] | None = None,
+    ):
+        self.embed = embed
+        self.cache = cache
+        self.provider = provider
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_progress = on_progress
+        self.stats = {"submitted": 0, "cached": 0, "embedded": 0, "failed": 0}
+        self._seen: set[str] = set()
+        self._queue: queue.Queue[list[str] | None] = queue.Queue()
+        self._thread = threading.Thread(target=bind_current_span(self._run), name="embedding-prefetch", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, on_progress: Callable[[dict], None] | None = None) -> "EmbeddingPrefetcher | None":
+        """embedding ステップを実行する予定で、キャッシュとプリフェッチが有効な場合にプリフェッチャーを作成する"""
+        embedding_config = config["embedding"]
+        plan = {step["step"]: step["run"] for step in config.get("plan", [])}
+        if not plan.get("embedding", True):
+            return None
+        if not embedding_config.get("use_cache", True) or not embedding_config.get("prefetch", True):
+            return None
+
+        provider, model = embedding_cache_namespace(config)
+        engine = EmbeddingEngine.from_config(config)
+        return cls(engine.embed_texts, EmbeddingCache(), provider, model, on_progress=on_progress)
+
+    def submit(self, texts: Iterable[str]) -> None:
+        """意見をキューに投入する(同じテキストは1回だけ計算する)"""
+        new_texts = []
+        for text in texts:
+            if text not in self._seen:
+                self._seen.add(text)
+                new_texts.append(text)
+        if new_texts:
+            self.stats["submitted"] += len(new_texts)
+            self._queue.put(new_texts)
+
+    def close(self) -> dict:
+        """キューに残っている意見の埋め込みを計算し終えるまで待ち、集計を返す"""
+        self._queue.put(None)
+        self._thread.join()
+        return dict(self.stats)
+
+    def _run(self) -> None:
+        pending: list[str] = []
+        closed = False
+        while not closed:
+            try:
+                item = self._queue.get(timeout=self.flush_interval if pending else None)
+            except queue.Empty:
+                item = []
+            if item is None:
+                closed = True
+            else:
+                pending.extend(item)
+            # バッチが埋まったとき、新しい意見がしばらく来なかったとき、終了時に送信する
+            while len(pending) >= self.batch_size or (pending and (closed or not item)):
+                batch, pending = pending[: self.batch_size], pending[self.batch_size :]
+                self._embed_batch(batch)
+
+    def _embed_batch(self, batch: list[str]) -> None:
+        cached = self.cache.get_many(self.provider, self.model, batch)
+        missing = [text for text, embedding in zip(batch, cached, strict=True) if embedding is None]
+        self.stats["cached"] += len(batch) - len(missing)
+        if missing:
+            try:
+                embeddings = np.asarray(self.embed(missing), dtype=np.float32)
+                self.cache.put_many(self.provider, self.model, missing, embeddings)
+                self.stats["embedded"] += len(missing)
+            except Exception as e:
+                logging.warning(f"Embedding prefetch failed for {len(missing)} arguments: {e}")
+                self.stats["failed"] += len(missing)
+        if self.on_progress is not None:
+            self.on_progress(dict(self.stats))
@@ -0,0 +1,110 @@
+"""複数のコメントをまとめた抽出リクエスト
+
+抽出(extraction)は1コメントにつき1リクエストを送るため、1文程度の短いコメントが多いデータセットでは、
+毎回送るシステムプロンプトが入力トークンの大半を占める。短いコメントを推定トークン数の上限まで1リクエストに
+まとめ、コメントごとの意見のリストを structured output で返させる。
+
+- 入力はコメントをリクエスト内の連番のIDを付けたJSONの配列として送り、{"results": [{"id", "extractedOpinionList"}]}
+  の形式で返させる(IDはリクエストごとに振り直し、元の comment-id はLLMに送らない)
+- 推定トークン数が上限の1/4を超える長いコメントは、まとめずに1件ずつ送る
+- レスポンスに結果が含まれなかったコメントや、リクエストが失敗したコメントは呼び出し側で1件ずつ送り直す
+"""
+
+import json
+from collections.abc import Hashable, Sequence
+
+from pydantic import BaseModel, Field
+
+from .embedding_engine import estimate_text_tokens
+
+DEFAULT_TOKEN_BUDGET = 2000
+DEFAULT_MAX_COMMENTS = 20
+
+PACKED_PROMPT_SUFFIX = """
+
+# 複数のコメントの処理
+入力には複数のコメントが {"id": コメントのID, "comment": コメント本文} のJSONの配列として与えられます。
+それぞれのコメントについて、ほかのコメントの内容を混ぜずに上記の指示に従って意見を抽出し、
+{"results": [{"id": コメントのID, "extractedOpinionList": [抽出した意見, ...]}, ...]} の形式で
+すべてのコメントの結果を出力してください。意見が含まれないコメントの extractedOpinionList は空の配列にしてください。
+"""
+
+Comment = tuple[Hashable, str]
+
+
+class PackedExtractionItem(BaseModel):
+    id: str = Field(..., description="コメントのID")
+    extractedOpinionList: list[str] = Field(..., description="抽出した意見のリスト")
+
+
+class PackedExtractionResponse(BaseModel):
+    results: list[PackedExtractionItem] = Field(..., description="コメントごとの抽出結果")
+
+
+def _packed_item(local_id: int, body) -> dict:
+    return {"id": str(local_id), "comment": str(body)}
+
+
+def pack_comments(
+    items: Sequence[Comment], token_budget: int = DEFAULT_TOKEN_BUDGET, max_comments: int = DEFAULT_MAX_COMMENTS
+) -> tuple[list[list[Comment]], list[Comment]]:
+    """(comment-id, 本文) のリストを、まとめて送るコメントのグループと1件ずつ送るコメントに分ける
+
+    items の順に、推定トークン数の合計が token_budget、件数が max_comments を超えないようにグループを作る。
+    推定トークン数が token_budget の1/4を超えるコメントと、1件しか入らなかったグループのコメントは1件ずつ送る。
+
+    Returns:
+        (まとめて送るコメントのグループのリスト, 1件ずつ送るコメントのリスト)
+    """
+    packs: list[list[Comment]] = []
+    singles: list[Comment] = []
+    pack: list[Comment] = []
+    pack_tokens = 0
+    for comment_id, body in items:
+        tokens = estimate_text_tokens(json.dumps(_packed_item(0, body), ensure_ascii=False))
+        if tokens > token_budget // 4:
+            singles.append((comment_id, body))
+            continue
+        if pack and (pack_tokens + tokens > token_budget or len(pack) >= max_comments):
+            packs.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append((comment_id, body))
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+
+    singles.extend(comment for pack in packs if len(pack) == 1 for comment in pack)
+    return [pack for pack in packs if len(pack) > 1], singles
+
+
+def build_packed_messages(prompt: str, pack: Sequence[Comment]) -> list[dict]:
+    """まとめて送るコメントのリクエストのメッセージを作る(コメントのIDは pack 内の1始まりの連番)"""
+    comments = [_packed_item(i, body) for i, (_, body) in enumerate(pack, start=1)]
+    return [
+        {"role": "system", "content": prompt + PACKED_PROMPT_SUFFIX},
+        {"role": "user", "content": json.dumps(comments, ensure_ascii=False)},
+    ]
+
+
+def parse_packed_response(response: str | dict, pack: Sequence[Comment]) -> dict[Hashable, list[str]]:
+    """レスポンスから comment-id -> 抽出した意見のリスト を取り出す
+
+    レスポンスに含まれなかったコメントや、形式が正しくない結果のコメントは含めない(1件ずつ送り直す)。
+    """
+    try:
+        results = (json.loads(response) if isinstance(response, str) else response)["results"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        print("Failed to parse packed extraction response", response)
+        return {}
+
+    comment_ids = {str(i): comment_id for i, (comment_id, _) in enumerate(pack, start=1)}
+    extracted: dict[Hashable, list[str]] = {}
+    for result in results if isinstance(results, list) else []:
+        if not isinstance(result, dict):
+            continue
+        comment_id = comment_ids.get(str(result.get("id")))
+        opinions = result.get("extractedOpinionList")
+        if comment_id is None or comment_id in extracted or not isinstance(opinions, list):
+            continue
+        extracted[comment_id] = [opinion for opinion in opinions if isinstance(opinion, str) and opinion]
+    return extracted
@@ -0,0 +1,345 @@
+"""パイプラインの計測
+
+ステップごとのスパン(経過時間・CPU時間・メモリ使用量・読み書きした中間ファイルのバイト数)と、
+LLMリクエストごとのレイテンシ・待ち時間・再試行回数を集計し、トレースファイル
+(outputs/{dataset}/hierarchical_trace.json)として書き出す。
+
+設定ファイルで "profile": "cprofile" または "pyinstrument" を指定した場合は、各ステップの
+プロファイルも outputs/{dataset}/profile_{step}.prof(.html) に保存する。プロファイラはプロセスで
+同時に1つしか有効にできない(Python 3.12以降の cProfile は2つ目の enable() で例外になる)ため、
+プロファイル中は run_pipeline がステップを1つずつ実行する。
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TRACE_FILENAME = "hierarchical_trace.json"
+TRACE_VERSION = 2
+
+
+def latency_summary(values: list[float]) -> dict[str, float]:
+    """レイテンシ(秒)の件数・合計・パーセンタイルを返す"""
+    if not values:
+        return {"count": 0, "total": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "count": len(values),
+        "total": float(sum(values)),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": float(max(values)),
+    }
+
+
+def _peak_rss_bytes() -> int | None:
+    """プロセスの開始からのピークRSS"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxではキロバイト、macOSではバイト単位
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+def _snapshot(directory: Path) -> dict[str, tuple[int, int]]:
+    """ディレクトリ直下のファイルの (サイズ, 更新時刻) を返す"""
+    if not directory.exists():
+        return {}
+    snapshot = {}
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class _LLMStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.queue_waits: list[float] = []
+        self.errors = 0
+        self.retries = 0
+        self.tokens = 0
+        self.cache_hits = 0
+        self.tokens_saved = 0
+        self.cached_input_tokens = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "calls": len(self.latencies),
+            "errors": self.errors,
+            "retries": self.retries,
+            "tokens": self.tokens,
+            "cache_hits": self.cache_hits,
+            "tokens_saved": self.tokens_saved,
+            "cached_input_tokens": self.cached_input_tokens,
+            "latency": latency_summary(self.latencies),
+            "queue_wait": latency_summary(self.queue_waits),
+        }
+
+
+class Span:
+    """1つのステップの計測結果"""
+
+    def __init__(self, name: str, output_dir: Path | None):
+        self.name = name
+        self.output_dir = output_dir
+        self.started_at = datetime.now().isoformat()
+        self.duration: float | None = None
+        self.cpu_time: float | None = None
+        # ru_maxrss はプロセスの開始からのピークのため、ステップのメモリ使用量としては
+        # ステップの実行中にピークがどれだけ増えたかを記録する(並行するステップの分も含む)
+        self.process_peak_rss_bytes: int | None = None
+        self.peak_rss_increase_bytes: int | None = None
+        self.bytes_read: dict[str, int] = {}
+        self.bytes_written: dict[str, int] = {}
+        self.llm: dict[str, _LLMStats] = {}
+        self.profile: str | None = None
+        self.error: str | None = None
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._files_before = _snapshot(output_dir) if output_dir else {}
+        self._peak_rss_start = _peak_rss_bytes()
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+        self.cpu_time = time.process_time() - self._cpu_start
+        self.process_peak_rss_bytes = _peak_rss_bytes()
+        if self.process_peak_rss_bytes is not None and self._peak_rss_start is not None:
+            self.peak_rss_increase_bytes = self.process_peak_rss_bytes - self._peak_rss_start
+        if self.output_dir:
+            # ステップの実行中に作成・更新されたファイルを、書き込んだファイルとして記録する
+            for name, (size, mtime) in _snapshot(self.output_dir).items():
+                if self._files_before.get(name, (None, None))[1] != mtime:
+                    self.bytes_written[name] = size
+
+    def llm_tokens(self) -> int:
+        """このステップのLLMリクエストで使用したトークン数の合計"""
+        return sum(stats.tokens for stats in self.llm.values())
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "cpu_time": self.cpu_time,
+            "process_peak_rss_bytes": self.process_peak_rss_bytes,
+            "peak_rss_increase_bytes": self.peak_rss_increase_bytes,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "llm": {provider: stats.to_dict() for provider, stats in self.llm.items()},
+            "profile": self.profile,
+            "error": self.error,
+        }
+
+
+class Tracer:
+    """プロセス内で共有する計測器
+
+    LLMリクエストやファイルの読み込みは、それを発行したステップのスパンに記録する。実行中のスパンは
+    コンテキスト変数で管理するため、複数のステップが並行して実行されていても取り違えない。ステップが
+    スレッドプールなどの別スレッドで処理する場合は、bind_current_span で包んだ関数を投入する。
+    スパンの外で発生したものは、トレースの "unattributed" に記録する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self.spans: list[Span] = []
+        self.unattributed = Span("unattributed", None)
+        self.started_at = datetime.now().isoformat()
+
+    def _current(self) -> Span:
+        span = _current_span.get()
+        # 前のジョブ(reset_tracer 前)のスパンが残っているスレッドから記録された場合は unattributed に記録する
+        return span if span is not None and span in self.spans else self.unattributed
+
+    @contextmanager
+    def span(self, name: str, output_dir: Path | None = None, profile: str | None = None):
+        span = Span(name, output_dir)
+        with self._lock:
+            self.spans.append(span)
+        token = _current_span.set(span)
+        profiler = _start_profiler(profile)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+            if profiler is not None:
+                span.profile = _stop_profiler(profiler, profile, output_dir and output_dir / f"profile_{name}")
+
+    def record_llm_call(
+        self,
+        provider: str,
+        latency: float,
+        queue_wait: float,
+        attempts: int = 1,
+        tokens: int | None = None,
+        error: bool = False,
+    ) -> None:
+        with self._lock:
+            stats = self._current().llm.setdefault(provider, _LLMStats())
+            stats.latencies.append(latency)
+            stats.queue_waits.append(queue_wait)
+            stats.retries += attempts - 1
+            stats.tokens += tokens or 0
+            if error:
+                stats.errors += 1
+
+    def record_llm_cache_hit(self, provider: str, tokens: int) -> None:
+        """LLMのレスポンスをキャッシュから返したことを記録する"""
+        with self._lock:
+            stats = self._current().llm.setdefault(provider, _LLMStats())
+            stats.cache_hits += 1
+            stats.tokens_saved += tokens
+
+    def record_prompt_cache(self, provider: str, cached_input_tokens: int) -> None:
+        """入力トークンのうち、プロバイダーのプロンプトキャッシュから読み込まれたトークン数を記録する"""
+        with self._lock:
+            stats = self._current().llm.setdefault(provider, _LLMStats())
+            stats.cached_input_tokens += cached_input_tokens
+
+    def cached_input_tokens(self) -> int:
+        """プロセス内のすべてのステップで、プロンプトキャッシュから読み込まれた入力トークン数の合計"""
+        with self._lock:
+            spans = [*self.spans, self.unattributed]
+            return sum(stats.cached_input_tokens for span in spans for stats in span.llm.values())
+
+    def record_read(self, path: str | Path) -> None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            span = self._current()
+            name = Path(path).name
+            span.bytes_read[name] = span.bytes_read.get(name, 0) + size
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+            unattributed = self.unattributed.to_dict()
+        return {
+            "version": TRACE_VERSION,
+            "started_at": self.started_at,
+            "updated_at": datetime.now().isoformat(),
+            "spans": spans,
+            "unattributed": unattributed,
+        }
+
+    def export(self, path: str | Path) -> None:
+        with self._export_lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+            os.replace(tmp_path, path)
+
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+def bind_current_span(func: Callable) -> Callable:
+    """func を別スレッドで実行しても、呼び出し元と同じステップのスパンに記録されるようにする
+
+    ThreadPoolExecutor.submit / map やスレッドの起動時に、投入する関数をこれで包む。
+    呼び出しごとにコンテキストを複製するため、包んだ関数を複数のスレッドで同時に実行してもよい。
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
+
+
+# プロファイラはプロセスで同時に1つしか有効にできないため、有効にしている間はロックを保持する
+_profiler_lock = threading.Lock()
+
+
+def _start_profiler(profile: str | None):
+    if not profile:
+        return None
+    if not _profiler_lock.acquire(blocking=False):
+        print("Warning: another step is being profiled; skipping the profile of this step")
+        return None
+    try:
+        return _create_profiler(profile)
+    except BaseException:
+        _profiler_lock.release()
+        raise
+
+
+def _create_profiler(profile: str):
+    if profile == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Warning: pyinstrument is not installed; falling back to cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, profile: str, path_prefix: Path | None) -> str | None:
+    """プロファイラを止めてプロファイルを保存し、保存したファイル名を返す(path_prefix が None の場合は保存しない)"""
+    try:
+        if profile == "pyinstrument" and hasattr(profiler, "output_html"):
+            profiler.stop()
+            if path_prefix is None:
+                return None
+            path = path_prefix.with_name(path_prefix.name + ".html")
+            path.write_text(profiler.output_html())
+        else:
+            profiler.disable()
+            if path_prefix is None:
+                return None
+            path = path_prefix.with_name(path_prefix.name + ".prof")
+            profiler.dump_stats(path)
+        return path.name
+    finally:
+        _profiler_lock.release()
+
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def reset_tracer() -> None:
+    """計測結果を破棄する(同じプロセスで次のジョブを実行する前に呼ぶ)"""
+    global _tracer
+    with _tracer_lock:
+        _tracer = None
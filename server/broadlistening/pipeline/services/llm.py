@@ -1,12 +1,22 @@
+import hashlib
+import json
 import logging
 import os
+import sqlite3
 import threading
+from collections.abc import Callable
+from functools import partial
+from typing import Any
 
 import openai
 from dotenv import load_dotenv
-from openai import AzureOpenAI, OpenAI
+from openai import AzureOpenAI, DefaultHttpxClient, OpenAI
 from pydantic import BaseModel
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from .instrumentation import get_tracer
+from .llm_cache import get_llm_cache, llm_cache_key
+from .llm_scheduler import estimate_tokens, get_scheduler
+from .local_embedding import get_local_embedding_engine
 
 DOTENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../../.env"))
 load_dotenv(DOTENV_PATH)
@@ -33,19 +43,66 @@ if use_azure == "true":
         raise RuntimeError("AZURE_EMBEDDING_DEPLOYMENT_NAME environment variable is not set")
 
 
-@retry(
-    retry=retry_if_exception_type(openai.RateLimitError),
-    wait=wait_exponential(multiplier=3, min=3, max=20),
-    stop=stop_after_attempt(3),
-    reraise=True,
-)
+__clients = {}
+__clients_lock = threading.Lock()
+
+
+def _get_client(client_class, provider: str | None = None, **kwargs):
+    """接続設定ごとにクライアントを1つだけ生成して使い回す
+
+    クライアント内部のHTTPコネクションプールをリクエスト間で共有するため、
+    リクエストのたびにクライアントを生成しないようにする。
+    provider を指定した場合は、レスポンスのレート制限ヘッダーをスケジューラのそのプロバイダーの予算に反映する。
+    """
+    key = (client_class, provider, tuple(sorted(kwargs.items())))
+    with __clients_lock:
+        if key not in __clients:
+            if provider is not None:
+                kwargs["http_client"] = DefaultHttpxClient(
+                    event_hooks={"response": [partial(_observe_rate_limit_headers, provider)]}
+                )
+            __clients[key] = client_class(**kwargs)
+        return __clients[key]
+
+
+def _observe_rate_limit_headers(provider: str, response: Any) -> None:
+    get_scheduler().observe_rate_limit_headers(provider, response.headers)
+
+
+def _prompt_cache_key(model: str, messages: list[dict]) -> str | None:
+    """先頭の system メッセージ(ステップごとの固定のプロンプト)が同じリクエストに、同じキーを返す
+
+    OpenAI はプロンプトの先頭部分が一致するリクエストの処理結果を自動でキャッシュするが、キャッシュは
+    リクエストを処理したサーバーごとに保持される。固定のプロンプトごとのキー(prompt_cache_key)を付けて、
+    同じプロンプトのリクエストが同じサーバーに振り分けられるようにする。
+    """
+    prefix = []
+    for message in messages:
+        if message.get("role") != "system":
+            break
+        prefix.append(message.get("content"))
+    if not prefix:
+        return None
+    payload = json.dumps([model, prefix], ensure_ascii=False, default=str)
+    return "kouchou-" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _record_prompt_cache(provider: str, response) -> None:
+    """レスポンスの使用量のうち、プロンプトキャッシュから読み込まれた入力トークン数を計測結果に記録する"""
+    details = getattr(getattr(response, "usage", None), "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if isinstance(cached_tokens, int) and cached_tokens > 0:
+        get_tracer().record_prompt_cache(provider, cached_tokens)
+
+
 def request_to_openai(
     messages: list[dict],
     model: str = "gpt-4",
     is_json: bool = False,
     json_schema: dict | type[BaseModel] | None = None,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
-    openai.api_type = "openai"
+    client = _get_client(OpenAI, provider="openai")
+    prompt_cache_key = _prompt_cache_key(model, messages)
     token_usage_input = 0  # 入力トークン使用量を追跡する変数
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
@@ -53,7 +110,7 @@ def request_to_openai(
     try:
         if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
             # Use beta.chat.completions.create for Pydantic BaseModel
-            response = openai.beta.chat.completions.parse(
+            response = client.beta.chat.completions.parse(
                 model=model,
                 messages=messages,
                 temperature=0,
@@ -61,7 +118,9 @@ def request_to_openai(
                 seed=0,
                 response_format=json_schema,
                 timeout=30,
+                extra_body={"prompt_cache_key": prompt_cache_key} if prompt_cache_key else None,
             )
+            _record_prompt_cache("openai", response)
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
@@ -85,9 +144,12 @@ def request_to_openai(
             }
             if response_format:
                 payload["response_format"] = response_format
+            if prompt_cache_key:
+                payload["extra_body"] = {"prompt_cache_key": prompt_cache_key}
 
-            response = openai.chat.completions.create(**payload)
+            response = client.chat.completions.create(**payload)
 
+            _record_prompt_cache("openai", response)
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
@@ -105,12 +167,6 @@ def request_to_openai(
         raise
 
 
-@retry(
-    retry=retry_if_exception_type(openai.RateLimitError),
-    wait=wait_exponential(multiplier=1, min=2, max=20),
-    stop=stop_after_attempt(3),
-    reraise=True,
-)
 def request_to_azure_chatcompletion(
     messages: list[dict],
     is_json: bool = False,
@@ -124,7 +180,9 @@ def request_to_azure_chatcompletion(
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = AzureOpenAI(
+    client = _get_client(
+        AzureOpenAI,
+        provider="azure",
         api_version=api_version,
         azure_endpoint=azure_endpoint,
         api_key=api_key,
@@ -143,6 +201,7 @@ def request_to_azure_chatcompletion(
                 response_format=json_schema,
                 timeout=30,
             )
+            _record_prompt_cache("azure", response)
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
@@ -173,6 +232,8 @@ def request_to_azure_chatcompletion(
 
             response = client.chat.completions.create(**payload)
 
+            _record_prompt_cache("azure", response)
+
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
@@ -229,7 +290,8 @@ def request_to_local_llm(
     base_url = f"http://{host}:{port}/v1"
 
     try:
-        client = OpenAI(
+        client = _get_client(
+            OpenAI,
             base_url=base_url,
             api_key="not-needed",  # OllamaとLM Studioは認証不要
         )
@@ -263,6 +325,8 @@ def request_to_local_llm(
 
         response = client.chat.completions.create(**payload)
 
+        _record_prompt_cache("local", response)
+
         if hasattr(response, "usage") and response.usage:
             token_usage_input = response.usage.prompt_tokens or 0
             token_usage_output = response.usage.completion_tokens or 0
@@ -283,6 +347,7 @@ def request_to_chat_ai(
     json_schema: dict | type[BaseModel] | None = None,
     provider: str = "openai",
     local_llm_address: str | None = None,
+    validate: Callable[[Any], object] | None = None,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
     """AIプロバイダーにチャットリクエストを送信する関数
 
@@ -293,6 +358,8 @@ def request_to_chat_ai(
         json_schema: JSONスキーマ（Pydanticモデルまたは辞書）
         provider: 使用するプロバイダー（"openai", "azure", "local", "openrouter"）
         local_llm_address: ローカルLLMのアドレス（provider="local"の場合のみ使用）
+        validate: レスポンスを検証する関数（呼び出し側のパース処理）。例外を送出するかFalseを返した場合は
+            レスポンスをキャッシュに保存しない。省略した場合はJSON・structured outputのレスポンスがパースできるかを確認する
 
     Returns:
         AIからのレスポンスとトークン使用量(入力・出力・合計)のタプル
@@ -302,20 +369,75 @@ def request_to_chat_ai(
         - provider="azure": Azure OpenAI APIを使用
         - provider="local": ローカルLLM（OllamaやLM Studio）を使用
         - provider="openrouter": OpenRouter APIを使用（OpenAIやGeminiのモデルにアクセス可能）
+        - リクエストはプロセス共通のスケジューラ（services/llm_scheduler.py）を経由して発行され、
+          プロバイダーごとのRPM/TPM・同時実行数の上限を全ステップで共有する
+        - 同じリクエストのレスポンスはキャッシュ（services/llm_cache.py）から返し、トークン使用量は0とする。
+          キャッシュに保存するのは、空でない文字列で検証に成功したレスポンスだけ
     """
+    # serving_model: 実際にリクエストを処理するモデル(キャッシュのキーに使う)
     if provider == "azure":
-        return request_to_azure_chatcompletion(messages, is_json, json_schema)
+        request = partial(request_to_azure_chatcompletion, messages, is_json, json_schema)
+        # Azureは model ではなくデプロイメントに送られる
+        serving_model = (
+            f"{os.getenv('AZURE_CHATCOMPLETION_ENDPOINT')}/{os.getenv('AZURE_CHATCOMPLETION_DEPLOYMENT_NAME')}"
+        )
     elif provider == "openai":
-        return request_to_openai(messages, model, is_json, json_schema)
+        request = partial(request_to_openai, messages, model, is_json, json_schema)
+        serving_model = model
     elif provider == "local":
         address = local_llm_address or "localhost:11434"
-        return request_to_local_llm(messages, model, is_json, json_schema, address)
+        request = partial(request_to_local_llm, messages, model, is_json, json_schema, address)
+        # 同じモデル名でもアドレスが違えば別のサーバー(別のモデル・量子化)の可能性がある
+        serving_model = f"{address}/{model}"
     elif provider == "openrouter":
         # OpenRouterのモデル名を直接使用
-        return request_to_openrouter_chatcompletion(messages, model, is_json, json_schema)
+        request = partial(request_to_openrouter_chatcompletion, messages, model, is_json, json_schema)
+        serving_model = model
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
+    cache = get_llm_cache()
+    if cache is None:
+        return get_scheduler().submit(provider, request, estimate_tokens(messages))
+
+    key = llm_cache_key(provider, serving_model, messages, is_json, json_schema)
+    cached = cache.get(key)
+    if cached is not None:
+        get_tracer().record_llm_cache_hit(provider, cached[3])
+        return cached[0], 0, 0, 0
+    response = get_scheduler().submit(provider, request, estimate_tokens(messages))
+    if _is_cacheable(response[0], is_json, json_schema, validate):
+        try:
+            cache.put(key, provider, serving_model, response)
+        except sqlite3.Error as e:
+            # 費用のかかったレスポンスは、キャッシュに保存できなくても呼び出し元に返す
+            logging.warning(f"Failed to cache LLM response: {e}")
+    return response
+
+
+def _is_cacheable(
+    content: Any,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    validate: Callable[[Any], object] | None,
+) -> bool:
+    """レスポンスをキャッシュに保存してよいか(空でない文字列で、検証に成功したか)を返す
+
+    不正なレスポンスを保存すると、再実行や再試行のたびに同じ不正なレスポンスが返されてしまうため。
+    """
+    if not isinstance(content, str) or not content.strip():
+        return False
+    try:
+        if validate is not None:
+            return bool(validate(content))
+        if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+            json_schema.model_validate_json(content)
+        elif is_json or json_schema:
+            json.loads(content)
+    except Exception:
+        return False
+    return True
+
 
 EMBDDING_MODELS = [
     "text-embedding-3-large",
@@ -356,7 +478,8 @@ def request_to_local_llm_embed(args, model, address="localhost:11434"):
     base_url = f"http://{host}:{port}/v1"
 
     try:
-        client = OpenAI(
+        client = _get_client(
+            OpenAI,
             base_url=base_url,
             api_key="not-needed",  # OllamaとLM Studioは認証不要
         )
@@ -380,7 +503,7 @@ def request_to_embed(args, model, is_embedded_at_local=False, provider="openai",
     elif provider == "openai":
         logging.info("request_to_openai_embed")
         _validate_model(model)
-        client = OpenAI()
+        client = _get_client(OpenAI)
         response = client.embeddings.create(input=args, model=model)
         embeds = [item.embedding for item in response.data]
         return embeds
@@ -399,7 +522,8 @@ def request_to_azure_embed(args, model):
     api_version = os.getenv("AZURE_EMBEDDING_VERSION")
     deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
 
-    client = AzureOpenAI(
+    client = _get_client(
+        AzureOpenAI,
         api_version=api_version,
         azure_endpoint=azure_endpoint,
         api_key=api_key,
@@ -409,24 +533,9 @@ def request_to_azure_embed(args, model):
     return [item.embedding for item in response.data]
 
 
-__local_emb_model = None
-__local_emb_model_loading_lock = threading.Lock()
-
-
 def request_to_local_embed(args):
-    global __local_emb_model
-    # memo: モデルを遅延ロード＆キャッシュするために、グローバル変数を使用
-
-    with __local_emb_model_loading_lock:
-        # memo: スレッドセーフにするためにロックを使用
-        if __local_emb_model is None:
-            from sentence_transformers import SentenceTransformer
-
-            model_name = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
-            __local_emb_model = SentenceTransformer(model_name)
-
-    result = __local_emb_model.encode(args)
-    return result.tolist()
+    # モデルはプロセスごとに1回だけ読み込み、float32の行列として返す
+    return get_local_embedding_engine().encode(args)
 
 
 def _test():
@@ -530,12 +639,6 @@ def _local_llm_test():
     print(response)
 
 
-@retry(
-    retry=retry_if_exception_type(openai.RateLimitError),
-    wait=wait_exponential(multiplier=3, min=3, max=20),
-    stop=stop_after_attempt(3),
-    reraise=True,
-)
 def request_to_openrouter_chatcompletion(
     messages: list[dict],
     model: str,
@@ -550,7 +653,9 @@ def request_to_openrouter_chatcompletion(
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = OpenAI(
+    client = _get_client(
+        OpenAI,
+        provider="openrouter",
         base_url="https://openrouter.ai/api/v1",
         api_key=api_key,
     )
@@ -566,6 +671,7 @@ def request_to_openrouter_chatcompletion(
                 response_format=json_schema,
                 timeout=30,
             )
+            _record_prompt_cache("openrouter", response)
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
@@ -587,6 +693,7 @@ def request_to_openrouter_chatcompletion(
                 payload["response_format"] = json_schema
 
             response = client.chat.completions.create(**payload)
+            _record_prompt_cache("openrouter", response)
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
                 token_usage_output = response.usage.completion_tokens or 0
@@ -0,0 +1,174 @@
+"""LLMのレスポンスの永続キャッシュ
+
+LLMへのリクエストはすべて temperature=0, seed=0 で送っているため、同じリクエストには同じレスポンスが返ることを
+前提に、(provider, model, messages, レスポンス形式) のハッシュをキーとしてレスポンスとトークン使用量を
+SQLite に保存する。model には実際にリクエストを処理するモデルを使う(Azure はエンドポイントとデプロイメント名、
+ローカルLLMはアドレスとモデル名)。-f での再実行や、クラスタリングを変えた後のラベリングの再実行では、入力が変わらなかった
+リクエストをLLMに送らずにキャッシュから返す。
+
+- キャッシュから返したリクエストのトークン使用量は 0 として返す(実際にかかった費用だけを計上するため)。
+  節約したトークン数は計測結果(hierarchical_trace.json)の cache_hits / tokens_saved に記録する
+- 保存から LLM_CACHE_TTL_DAYS 日(デフォルト30日)が過ぎたものは使わずに削除する
+- 合計サイズが LLM_CACHE_MAX_BYTES を超えた場合は、最後に参照された時刻が古いものから削除する
+- 設定ファイルで "use_llm_cache": false を指定したレポートではキャッシュを使用しない
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
+
+from .embedding_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_MAX_BYTES = 512 * 1024**2  # 512MB
+DEFAULT_TTL_DAYS = 30
+# リクエストの送り方(temperature など)を変えた場合に、以前のキャッシュを使わないようにするためのバージョン
+CACHE_VERSION = 1
+
+LLMResponse = tuple[str, int, int, int]
+
+
+def llm_cache_key(
+    provider: str,
+    model: str,
+    messages: list[dict],
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+) -> str:
+    if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        schema: Any = {"pydantic": json_schema.__name__, "schema": json_schema.model_json_schema()}
+    else:
+        schema = json_schema
+    payload = json.dumps(
+        [CACHE_VERSION, provider, model, messages, is_json, schema], ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLiteをバックエンドとした、LLMのレスポンスのキャッシュ"""
+
+    def __init__(self, path: str | Path | None = None, max_bytes: int | None = None, ttl_seconds: float | None = None):
+        if path is None:
+            cache_dir = Path(os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR))
+            path = cache_dir / "llm_responses.sqlite3"
+        if max_bytes is None:
+            max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("LLM_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS)) * 24 * 60 * 60
+
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                token_input INTEGER NOT NULL,
+                token_output INTEGER NOT NULL,
+                token_total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_accessed ON responses (last_accessed)")
+        self._conn.commit()
+
+    def get(self, key: str) -> LLMResponse | None:
+        """キャッシュ済みの (レスポンス, 入力トークン数, 出力トークン数, 合計トークン数) を返す。未キャッシュの場合はNone"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, token_input, token_output, token_total, created_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[4] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0], row[1], row[2], row[3]
+
+    def put(self, key: str, provider: str, model: str, response: LLMResponse) -> None:
+        text, token_input, token_output, token_total = response
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, provider, model, response, token_input, token_output, token_total, created_at, last_accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, text, token_input, token_output, token_total, now, now),
+            )
+            self._conn.commit()
+            self._evict(now)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(LENGTH(response)), 0) FROM responses").fetchone()
+        return int(total)
+
+    def _evict(self, now: float) -> None:
+        """期限切れのものを削除し、合計サイズが上限を超えている場合は参照が古いものから削除する"""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        excess = self._total_bytes() - self.max_bytes
+        if excess > 0:
+            removed = 0
+            keys_to_remove = []
+            cursor = self._conn.execute("SELECT key, LENGTH(response) FROM responses ORDER BY last_accessed ASC")
+            for key, size in cursor:
+                keys_to_remove.append((key,))
+                removed += size
+                if removed >= excess:
+                    break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", keys_to_remove)
+            logging.info(f"Evicted {len(keys_to_remove)} LLM responses ({removed} bytes) from cache")
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_enabled = True
+_cache: LLMResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def configure_llm_cache(enabled: bool) -> None:
+    """レポートごとにキャッシュを使うかどうかを設定する(パイプラインの開始時に呼ぶ)"""
+    global _enabled
+    _enabled = enabled
+
+
+def get_llm_cache() -> LLMResponseCache | None:
+    """プロセス共通のキャッシュを返す。キャッシュを使わない設定の場合はNone"""
+    global _cache
+    if not _enabled:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache()
+        return _cache
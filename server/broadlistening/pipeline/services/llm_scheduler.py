@@ -0,0 +1,379 @@
+"""LLMリクエストのスケジューラ
+
+パイプライン内のすべてのチャットリクエストを、1つのasyncioイベントループを通して発行する。
+プロバイダーごとに以下の予算をプロセス全体で共有するため、各ステップのworkers数に関わらず
+extraction / labelling / merge labelling / classification が同じ上限の中で動作する。
+
+- 1分あたりのリクエスト数(RPM)と1分あたりのトークン数(TPM)
+- 同時実行数(レート制限エラーを受けると半減し、成功が続くと1ずつ回復する)
+
+成功したレスポンスのレート制限ヘッダー(x-ratelimit-remaining-requests / -tokens 等)は
+observe_rate_limit_headers で受け取り、残りの予算をRPM/TPMのバケットに反映する。環境変数で上限を
+設定していない場合も、ヘッダーに上限(x-ratelimit-limit-*)があればその値でバケットを作るため、
+レート制限エラーを受ける前に発行ペースを落とせる。残りが0の場合はリセットまで新規リクエストを止める。
+
+レート制限エラーを受けた場合は、レスポンスヘッダー(retry-after 等)が示す時間だけ
+そのプロバイダーへの新規リクエストを止め、待機後にスケジューラが再試行する(回数は LLM_RATE_LIMIT_RETRIES)。
+request_to_* 関数側では再試行しないため、待機中に同時実行数の枠を占有せず、レート制限エラーは
+必ず同時実行数の調整に反映される。
+各リクエストの待ち時間・レイテンシ・試行回数は instrumentation のトレースに記録する。
+
+環境変数で上限を設定できる(プロバイダー別の値は末尾に _OPENAI などを付ける):
+    LLM_RPM_LIMIT, LLM_TPM_LIMIT, LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT_RETRIES
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+import openai
+
+from .instrumentation import bind_current_span, get_tracer
+
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_RATE_LIMIT_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 5.0
+MAX_BACKOFF_SECONDS = 60.0
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _env_number(name: str, provider: str, default: float | None) -> float | None:
+    value = os.getenv(f"{name}_{provider.upper()}") or os.getenv(name)
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+@dataclass
+class ProviderLimits:
+    """プロバイダーごとの予算(Noneは無制限)"""
+
+    requests_per_minute: float | None = None
+    tokens_per_minute: float | None = None
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+
+    @classmethod
+    def from_env(cls, provider: str) -> "ProviderLimits":
+        return cls(
+            requests_per_minute=_env_number("LLM_RPM_LIMIT", provider, None),
+            tokens_per_minute=_env_number("LLM_TPM_LIMIT", provider, None),
+            max_concurrency=int(_env_number("LLM_MAX_CONCURRENCY", provider, DEFAULT_MAX_CONCURRENCY)),
+        )
+
+
+def _max_concurrency_limit() -> int:
+    """プロバイダー別の設定(LLM_MAX_CONCURRENCY_<PROVIDER>)を含めた、同時実行数の上限の最大値"""
+    limits = [
+        int(float(value))
+        for name, value in os.environ.items()
+        if (name == "LLM_MAX_CONCURRENCY" or name.startswith("LLM_MAX_CONCURRENCY_")) and value
+    ]
+    if not os.getenv("LLM_MAX_CONCURRENCY"):
+        # プロバイダー別の設定がないプロバイダーはデフォルトの上限を使う
+        limits.append(DEFAULT_MAX_CONCURRENCY)
+    return max(limits)
+
+
+def _header(headers: Any, name: str) -> str | None:
+    try:
+        value = headers.get(name)
+    except Exception:
+        return None
+    return value if isinstance(value, str) else None
+
+
+def _header_number(headers: Any, name: str) -> float | None:
+    value = _header(headers, name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _header_duration(headers: Any, name: str) -> float | None:
+    """OpenAI形式の期間(例: "1s", "6m0s", "20ms")を秒数にする"""
+    value = _header(headers, name)
+    matches = _DURATION_PATTERN.findall(value) if value is not None else []
+    if not matches:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in matches)
+
+
+def parse_retry_after(error: Exception) -> float | None:
+    """レート制限エラーのレスポンスヘッダーから待機秒数を取り出す"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+
+    if (value := _header_number(headers, "retry-after-ms")) is not None:
+        return value / 1000
+    if (value := _header_number(headers, "retry-after")) is not None:
+        return value
+    waits = [
+        wait
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if (wait := _header_duration(headers, name)) is not None
+    ]
+    return max(waits) if waits else None
+
+
+@dataclass
+class RateLimitBudget:
+    """レスポンスヘッダーが示す1種類(リクエスト数またはトークン数)の上限と残り"""
+
+    remaining: float
+    limit: float | None = None
+    reset: float | None = None
+
+
+def parse_rate_limit_headers(headers: Any) -> dict[str, RateLimitBudget]:
+    """レスポンスヘッダーから {"requests": ..., "tokens": ...} の残りの予算を取り出す(ヘッダーがない種類は含めない)"""
+    budgets = {}
+    for kind in ("requests", "tokens"):
+        remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+        if remaining is None:
+            continue
+        budgets[kind] = RateLimitBudget(
+            remaining=remaining,
+            limit=_header_number(headers, f"x-ratelimit-limit-{kind}"),
+            reset=_header_duration(headers, f"x-ratelimit-reset-{kind}"),
+        )
+    return budgets
+
+
+def _is_insufficient_quota(error: Exception) -> bool:
+    # 残高不足は待っても解消しないので再試行しない
+    message = str(error).lower()
+    return "insufficient_quota" in message or "quota exceeded" in message
+
+
+class _TokenBucket:
+    """1分あたりの上限を連続的に補充するトークンバケット。借り越し(負の残高)を許容する"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.available -= amount
+
+    def observe(self, remaining: float) -> None:
+        """プロバイダーが示す残りの予算が手元の見積もりより少なければ、そちらに合わせる"""
+        self._refill()
+        self.available = min(self.available, remaining)
+
+
+class _ProviderLane:
+    """1つのプロバイダーに対する予算と同時実行数の管理(イベントループ内からのみ操作する)"""
+
+    def __init__(self, provider: str, limits: ProviderLimits):
+        self.provider = provider
+        self.limits = limits
+        self.requests = _TokenBucket(limits.requests_per_minute) if limits.requests_per_minute else None
+        self.tokens = _TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        self.concurrency = limits.max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._successes = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        async with self._changed:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if self.requests:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens:
+                    wait = max(wait, self.tokens.wait_time(estimated_tokens))
+                if self.in_flight < self.concurrency and wait <= 0:
+                    break
+                timeout = wait if wait > 0 else None
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+                except TimeoutError:
+                    pass
+            self.in_flight += 1
+            if self.requests:
+                self.requests.consume(1)
+            if self.tokens:
+                self.tokens.consume(estimated_tokens)
+
+    def observe(self, budgets: dict[str, RateLimitBudget]) -> None:
+        """レスポンスヘッダーが示す残りの予算をバケットに反映する"""
+        for kind, budget in budgets.items():
+            bucket = getattr(self, kind)
+            if bucket is None and budget.limit:
+                # 環境変数で上限を設定していない場合は、プロバイダーが示す上限を使う
+                bucket = _TokenBucket(budget.limit)
+                setattr(self, kind, bucket)
+            if bucket is not None:
+                bucket.observe(budget.remaining)
+            if budget.remaining <= 0 and budget.reset:
+                self.paused_until = max(self.paused_until, time.monotonic() + budget.reset)
+
+    async def release(self, estimated_tokens: int, used_tokens: int | None, retry_after: float | None = None) -> None:
+        async with self._changed:
+            self.in_flight -= 1
+            if self.tokens and used_tokens is not None:
+                # 見積もりと実際の使用量の差を精算する
+                self.tokens.consume(used_tokens - estimated_tokens)
+            if retry_after is not None:
+                # 加算増加・乗算減少(AIMD)で同時実行数を調整する
+                self.concurrency = max(1, self.concurrency // 2)
+                self._successes = 0
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                logging.warning(
+                    f"LLM rate limit hit ({self.provider}): concurrency -> {self.concurrency}, pause {retry_after:.1f}s"
+                )
+            elif used_tokens is not None:
+                self._successes += 1
+                if self.concurrency < self.limits.max_concurrency and self._successes >= self.concurrency:
+                    self.concurrency += 1
+                    self._successes = 0
+            self._changed.notify_all()
+
+
+class LLMScheduler:
+    """プロセス内で共有するLLMリクエストスケジューラ
+
+    各ステップのスレッドからは submit() を同期的に呼び出す。実際のHTTPリクエストは
+    スケジューラが持つスレッドプールで実行し、発行タイミングだけをイベントループで制御する。
+    """
+
+    def __init__(self, max_retries: int | None = None):
+        if max_retries is None:
+            max_retries = int(os.getenv("LLM_RATE_LIMIT_RETRIES", DEFAULT_RATE_LIMIT_RETRIES))
+        self.max_retries = max_retries
+        self._lanes: dict[str, _ProviderLane] = {}
+        self._loop = asyncio.new_event_loop()
+        # 同時実行数はレーン側で制御するため、スレッド数はどのレーンの上限も妨げない大きさにしておく
+        max_workers = 2 * _max_concurrency_limit()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-request")
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-scheduler", daemon=True)
+        self._thread.start()
+
+    def shutdown(self) -> None:
+        """イベントループとスレッドプールを停止する"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def observe_rate_limit_headers(self, provider: str, headers: Any) -> None:
+        """レスポンスのレート制限ヘッダーをプロバイダーの予算に反映する(任意のスレッドから呼び出せる)"""
+        budgets = parse_rate_limit_headers(headers)
+        if budgets:
+            self._loop.call_soon_threadsafe(lambda: self._lane(provider).observe(budgets))
+
+    def _lane(self, provider: str) -> _ProviderLane:
+        if provider not in self._lanes:
+            self._lanes[provider] = _ProviderLane(provider, ProviderLimits.from_env(provider))
+        return self._lanes[provider]
+
+    def submit(self, provider: str, func: Callable[[], Any], estimated_tokens: int = 0) -> Any:
+        """予算の範囲内でfuncを実行し、その戻り値を返す(呼び出し元スレッドはブロックされる)
+
+        コルーチンは呼び出し元のコンテキストを複製して実行され(run_coroutine_threadsafe の動作)、
+        funcも呼び出し元のコンテキストで実行するため、計測は呼び出し元のステップのスパンに記録される。
+        """
+        func = bind_current_span(func)
+        future = asyncio.run_coroutine_threadsafe(self._run(provider, func, estimated_tokens), self._loop)
+        return future.result()
+
+    async def _run(self, provider: str, func: Callable[[], Any], estimated_tokens: int) -> Any:
+        lane = self._lane(provider)
+        loop = asyncio.get_running_loop()
+        tracer = get_tracer()
+        queue_wait = 0.0
+        for attempt in range(self.max_retries + 1):
+            wait_start = time.perf_counter()
+            await lane.acquire(estimated_tokens)
+            queue_wait += time.perf_counter() - wait_start
+            request_start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor, func)
+            except openai.RateLimitError as e:
+                retry_after = parse_retry_after(e)
+                if retry_after is None:
+                    retry_after = min(DEFAULT_BACKOFF_SECONDS * 2**attempt, MAX_BACKOFF_SECONDS)
+                await lane.release(estimated_tokens, None, retry_after=retry_after)
+                if _is_insufficient_quota(e) or attempt == self.max_retries:
+                    tracer.record_llm_call(
+                        provider, time.perf_counter() - request_start, queue_wait, attempt + 1, error=True
+                    )
+                    raise
+                continue
+            except BaseException:
+                await lane.release(estimated_tokens, None)
+                tracer.record_llm_call(
+                    provider, time.perf_counter() - request_start, queue_wait, attempt + 1, error=True
+                )
+                raise
+            used_tokens = _used_tokens(result)
+            await lane.release(estimated_tokens, used_tokens)
+            tracer.record_llm_call(provider, time.perf_counter() - request_start, queue_wait, attempt + 1, used_tokens)
+            return result
+
+
+def _used_tokens(result: Any) -> int | None:
+    # request_to_* は (response, input, output, total) のタプルを返す
+    if isinstance(result, tuple) and len(result) == 4 and isinstance(result[3], int):
+        return result[3]
+    return None
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """リクエストのトークン数を大まかに見積もる
+
+    日本語は概ね1文字1トークン以下になるため、文字数をそのまま上限側の見積もりとして使う。
+    実際の使用量はレスポンス受信後に精算する。
+    """
+    return sum(len(str(message.get("content", ""))) for message in messages)
+
+
+_scheduler: LLMScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+def reset_scheduler() -> None:
+    """スケジューラを停止して破棄する(次に get_scheduler を呼んだときに環境変数から作り直す)"""
+    global _scheduler
+    with _scheduler_lock:
+        scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.shutdown()
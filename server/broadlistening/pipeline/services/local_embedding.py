@@ -0,0 +1,140 @@
+"""CPU上で埋め込みを計算するローカル埋め込みエンジン
+
+sentence-transformers のモデルはプロセスごとに1回だけ読み込み、レポートをまたいで使い回す。
+入力は文字数順に並べてからバッチに分けることでパディングを減らし、結果は元の順序に戻した
+float32 の行列として返す(Pythonのリストには変換しない)。
+
+環境変数で設定できる:
+    LOCAL_EMBEDDING_BATCH_SIZE: encode のバッチサイズ(デフォルト 32)
+    LOCAL_EMBEDDING_THREADS: torch の計算スレッド数(未指定の場合は torch のデフォルト)
+    LOCAL_EMBEDDING_BACKEND: torch / onnx / onnx-int8(デフォルト torch)
+        onnx, onnx-int8 には optimum[onnxruntime] が必要。onnx-int8 は動的量子化したモデルを
+        初回に書き出し、以降はそれを読み込む
+    LOCAL_EMBEDDING_QUANTIZATION: onnx-int8 の量子化設定(arm64 / avx2 / avx512 / avx512_vnni、デフォルト avx2)
+"""
+
+import logging
+import os
+import threading
+from collections.abc import Sequence
+from importlib.util import find_spec
+from pathlib import Path
+
+import numpy as np
+
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_QUANTIZATION = "avx2"
+# 文字数順に並べる範囲。大きいほどパディングが減るが、1回のencodeで保持する行列が大きくなる
+CHUNK_SIZE = 10000
+QUANTIZED_MODEL_DIR = Path(__file__).parent.parent / "cache" / "local_models"
+
+
+class LocalEmbeddingEngine:
+    """sentence-transformers のモデルで埋め込みを計算する"""
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_EMBEDDING_MODEL,
+        batch_size: int | None = None,
+        threads: int | None = None,
+        backend: str | None = None,
+        quantization: str | None = None,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size or int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        threads = threads or os.getenv("LOCAL_EMBEDDING_THREADS")
+        self.threads = int(threads) if threads else None
+        self.backend = (backend or os.getenv("LOCAL_EMBEDDING_BACKEND", "torch")).lower()
+        self.quantization = quantization or os.getenv("LOCAL_EMBEDDING_QUANTIZATION", DEFAULT_QUANTIZATION)
+        self._model = None
+        self._lock = threading.Lock()
+
+    def cache_namespace(self) -> str:
+        """埋め込みキャッシュのキーに使うモデル名
+
+        バックエンドや量子化によって埋め込みの値が変わるため、torch 以外ではそれらを含める。
+        ONNX が使えず torch で計算する場合は torch と同じ名前を返す。
+        """
+        if self.backend not in ("onnx", "onnx-int8") or find_spec("optimum") is None:
+            return self.model_name
+        if self.backend == "onnx-int8":
+            return f"{self.model_name}:onnx-int8:{self.quantization}"
+        return f"{self.model_name}:onnx"
+
+    def load(self):
+        """モデルを読み込んで返す(読み込み済みの場合はそれを返す)"""
+        with self._lock:
+            if self._model is None:
+                self._model = self._load_model()
+            return self._model
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+
+        if self.threads:
+            import torch
+
+            torch.set_num_threads(self.threads)
+        if self.backend == "torch":
+            return SentenceTransformer(self.model_name)
+        try:
+            if self.backend == "onnx":
+                return SentenceTransformer(self.model_name, backend="onnx")
+            if self.backend == "onnx-int8":
+                return self._load_quantized_model()
+        except ImportError as e:
+            logging.warning(f"ONNX backend is not available ({e}); falling back to torch")
+            return SentenceTransformer(self.model_name)
+        raise ValueError(f"Unknown LOCAL_EMBEDDING_BACKEND: {self.backend}")
+
+    def _load_quantized_model(self):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        model_dir = QUANTIZED_MODEL_DIR / self.model_name.replace("/", "__")
+        file_name = f"onnx/model_qint8_{self.quantization}.onnx"
+        if not (model_dir / file_name).exists():
+            logging.info(f"Exporting int8 quantized ONNX model to {model_dir}")
+            model = SentenceTransformer(self.model_name, backend="onnx")
+            model.save(str(model_dir))
+            export_dynamic_quantized_onnx_model(model, self.quantization, str(model_dir))
+        return SentenceTransformer(str(model_dir), backend="onnx", model_kwargs={"file_name": file_name})
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """テキストの埋め込みを入力と同じ順序の float32 行列として返す"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # 長さの近いテキストを同じバッチにまとめ、パディングを減らす
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        result: np.ndarray | None = None
+        for start in range(0, len(order), CHUNK_SIZE):
+            rows = order[start : start + CHUNK_SIZE]
+            embeddings = self.load().encode(
+                [texts[i] for i in rows],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            if result is None:
+                result = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+            result[rows] = embeddings
+        return result
+
+
+_engine: LocalEmbeddingEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_local_embedding_engine() -> LocalEmbeddingEngine:
+    """プロセス内で共有するローカル埋め込みエンジンを返す"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = LocalEmbeddingEngine()
+        return _engine
+
+
+def warm_up() -> None:
+    """モデルを読み込んでおく(常駐するワーカーの起動時に呼ぶ)"""
+    get_local_embedding_engine().load()
@@ -0,0 +1,149 @@
+"""レポートの結果ファイル(hierarchical_result.json)のフォーマット
+
+従来の結果ファイルは意見を1件ずつのオブジェクトのリストとして持ち、設定(config)には各ステップのプロンプト・
+ソースコードやパイプラインの実行記録がすべて含まれていた。コンパクト形式(format_version 2)では
+
+- 意見と propertyMap を列ごとの配列(arguments の各キーが同じ長さの配列)として持つ
+- プロンプト・ソースコード・実行記録は hierarchical_provenance.json に分けて保存する
+
+サーバーやクライアントは従来の形式を前提にしているため、読み込む側は expand_result で従来の形式に戻して使う。
+従来の形式のファイルはそのまま読み込める。
+"""
+
+from typing import Any
+
+COMPACT_FORMAT_VERSION = 2
+PROVENANCE_FILENAME = "hierarchical_provenance.json"
+
+# hierarchical_provenance.json に移す設定の項目
+PROVENANCE_CONFIG_KEYS = ("plan", "completed_jobs", "previously_completed_jobs", "previous")
+PROVENANCE_STEP_KEYS = ("prompt", "source_code")
+# 列として持つ意見の項目(cluster_ids は階層ごとの列 cluster_levels として持つ)
+ARGUMENT_COLUMNS = ("arg_id", "argument", "x", "y", "p", "attributes", "url")
+
+
+def is_compact(result: dict[str, Any]) -> bool:
+    return result.get("format_version") == COMPACT_FORMAT_VERSION
+
+
+def split_provenance(config: dict[str, Any]) -> tuple[dict[str, Any], dict[str, Any]]:
+    """設定を、結果ファイルに残す部分と hierarchical_provenance.json に移す部分に分ける"""
+    compact_config: dict[str, Any] = {}
+    provenance: dict[str, Any] = {}
+    for key, value in config.items():
+        if key in PROVENANCE_CONFIG_KEYS:
+            provenance[key] = value
+        elif isinstance(value, dict) and any(step_key in value for step_key in PROVENANCE_STEP_KEYS):
+            compact_config[key] = {k: v for k, v in value.items() if k not in PROVENANCE_STEP_KEYS}
+            provenance[key] = {k: v for k, v in value.items() if k in PROVENANCE_STEP_KEYS}
+        else:
+            compact_config[key] = value
+    return compact_config, provenance
+
+
+def merge_provenance(config: dict[str, Any], provenance: dict[str, Any]) -> dict[str, Any]:
+    """split_provenance で分けた設定を元に戻す"""
+    merged = dict(config)
+    for key, value in provenance.items():
+        if key in PROVENANCE_CONFIG_KEYS:
+            merged[key] = value
+        else:
+            merged[key] = {**merged.get(key, {}), **value}
+    return merged
+
+
+def compact_result(result: dict[str, Any]) -> tuple[dict[str, Any], dict[str, Any]]:
+    """従来の形式の結果を (コンパクト形式の結果, hierarchical_provenance.json の内容) に変換する"""
+    arguments = result.get("arguments", [])
+    arg_ids = [argument["arg_id"] for argument in arguments]
+    columns: dict[str, Any] = {column: [argument.get(column) for argument in arguments] for column in ARGUMENT_COLUMNS}
+    # cluster_ids の先頭は常に全体のクラスタ "0" なので、それ以降を階層ごとの列にする
+    depth = max((len(argument["cluster_ids"]) - 1 for argument in arguments), default=0)
+    columns["cluster_levels"] = [
+        [argument["cluster_ids"][level] for argument in arguments] for level in range(1, depth + 1)
+    ]
+
+    config, provenance = split_provenance(result.get("config", {}))
+    compact = {key: value for key, value in result.items() if key not in ("arguments", "propertyMap", "config")}
+    compact["format_version"] = COMPACT_FORMAT_VERSION
+    compact["config"] = config
+    compact["arguments"] = columns
+    compact["propertyMap"] = {
+        name: [values.get(arg_id) for arg_id in arg_ids] for name, values in result.get("propertyMap", {}).items()
+    }
+    return compact, provenance
+
+
+def expand_result(result: dict[str, Any], provenance: dict[str, Any] | None = None) -> dict[str, Any]:
+    """結果を従来の形式に戻す。provenance を渡した場合は設定に戻す。従来の形式の結果はそのまま返す"""
+    if not is_compact(result):
+        return result
+
+    columns = result["arguments"]
+    arg_ids = columns["arg_id"]
+    cluster_levels = columns.get("cluster_levels", [])
+    arguments = [
+        {
+            "arg_id": arg_id,
+            "argument": columns["argument"][i],
+            "x": columns["x"][i],
+            "y": columns["y"][i],
+            "p": columns["p"][i],
+            "cluster_ids": ["0"] + [level[i] for level in cluster_levels],
+            "attributes": columns["attributes"][i],
+            "url": columns["url"][i],
+        }
+        for i, arg_id in enumerate(arg_ids)
+    ]
+
+    expanded = {key: value for key, value in result.items() if key != "format_version"}
+    expanded["arguments"] = arguments
+    expanded["propertyMap"] = {
+        name: dict(zip(arg_ids, values, strict=True)) for name, values in result.get("propertyMap", {}).items()
+    }
+    if provenance:
+        expanded["config"] = merge_provenance(result.get("config", {}), provenance)
+    return expanded
+
+
+def argument_count(result: dict[str, Any]) -> int:
+    """結果に含まれる意見の件数(どちらの形式でも)"""
+    arguments = result.get("arguments", [])
+    if is_compact(result):
+        return len(arguments.get("arg_id", []))
+    return len(arguments)
+
+
+def build_custom_intro(config: dict, processed_num: int, args_count: int) -> str:
+    """レポートの調査概要に、分析件数と使用したLLMの説明を付け加えた文章を返す
+
+    管理画面から調査概要を編集した場合にも、サーバー側でこの関数を使って同じ文章を組み立てる。
+    """
+
+    # LLMプロバイダーとモデル名の判定
+    def get_llm_provider_display():
+        # configからプロバイダー情報を取得（優先）
+        provider = config.get("provider", "openai")
+        model = config.get("model", "unknown")
+
+        # プロバイダー名をマッピング
+        provider_names = {
+            "openai": "OpenAI API",
+            "azure": "Azure OpenAI API",
+            "openrouter": "OpenRouter API",
+            "local": "Local LLM",
+        }
+
+        provider_name = provider_names.get(provider, f"{provider} API")
+        return f"{provider_name} ({model})"
+
+    llm_provider = get_llm_provider_display()
+
+    base_custom_intro = """{intro}
+分析対象となったデータの件数は{processed_num}件で、これらのデータに対して{llm_provider}を用いて{args_count}件の意見（議論）を抽出し、クラスタリングを行った。
+"""
+
+    intro = config["intro"]
+    return base_custom_intro.format(
+        intro=intro, processed_num=processed_num, args_count=args_count, llm_provider=llm_provider
+    )
@@ -1,23 +1,51 @@
-import pandas as pd
+import numpy as np
 from tqdm import tqdm
 
-from services.llm import request_to_embed
+from services.artifacts import EmbeddingWriter, read_table
+from services.embedding_cache import EmbeddingCache
+from services.embedding_engine import EmbeddingEngine
+from services.embedding_prefetch import embedding_cache_namespace
+
+CACHE_LOOKUP_CHUNK_SIZE = 10000
 
 
 def embedding(config):
-    model = config["embedding"]["model"]
-    is_embedded_at_local = config["is_embedded_at_local"]
+    use_cache = config["embedding"].get("use_cache", True)
     # print("start embedding")
-    # print(f"embedding model: {model}, is_embedded_at_local: {is_embedded_at_local}")
 
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/embeddings.pkl"
-    arguments = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings = []
-    batch_size = 1000
-    for i in tqdm(range(0, len(arguments), batch_size)):
-        args = arguments["argument"].tolist()[i : i + batch_size]
-        embeds = request_to_embed(args, model, is_embedded_at_local, config["provider"])
-        embeddings.extend(embeds)
-    df = pd.DataFrame([{"arg-id": arguments.iloc[i]["arg-id"], "embedding": e} for i, e in enumerate(embeddings)])
-    df.to_pickle(path)
+    arguments = read_table(dataset, "args", columns=["arg-id", "argument"])
+    texts = arguments["argument"].tolist()
+
+    cache = EmbeddingCache() if use_cache else None
+    cache_provider, cache_model = embedding_cache_namespace(config)
+
+    # 埋め込みはバッチごとに float32 の行列の該当行へ書き込み、全件をPythonのリストとして保持しない
+    # (途中で失敗した場合は書き込み途中の一時ファイルを削除する)
+    with EmbeddingWriter(dataset, arguments["arg-id"].tolist()) as writer:
+        # キャッシュに存在しないテキストと、そのテキストが現れる行(同一テキストは1回だけ埋め込みAPIに送る)
+        missing_rows: dict[str, list[int]] = {}
+        for start in range(0, len(texts), CACHE_LOOKUP_CHUNK_SIZE):
+            chunk = texts[start : start + CACHE_LOOKUP_CHUNK_SIZE]
+            cached = cache.get_many(cache_provider, cache_model, chunk) if cache else [None] * len(chunk)
+            writer.write(
+                [start + i for i, e in enumerate(cached) if e is not None], [e for e in cached if e is not None]
+            )
+            for i, (text, e) in enumerate(zip(chunk, cached, strict=True)):
+                if e is None:
+                    missing_rows.setdefault(text, []).append(start + i)
+
+        missing_texts = list(missing_rows)
+        missing_count = sum(len(rows) for rows in missing_rows.values())
+        print(f"embedding: {len(texts) - missing_count} cached, {len(missing_texts)} to request")
+
+        # 推定トークン数でバッチに分け、複数のバッチを並行して送る(完了したバッチから書き込む)
+        engine = EmbeddingEngine.from_config(config)
+        with tqdm(total=len(missing_texts)) as progress:
+            for indices, embeds in engine.iter_embeddings(missing_texts):
+                args = [missing_texts[i] for i in indices]
+                if cache:
+                    cache.put_many(cache_provider, cache_model, args, embeds)
+                counts = [len(missing_rows[text]) for text in args]
+                writer.write([row for text in args for row in missing_rows[text]], np.repeat(embeds, counts, axis=0))
+                progress.update(len(indices))
@@ -1,18 +1,36 @@
 import concurrent.futures
+import csv
+import hashlib
 import json
 import logging
+import os
 import re
+import sqlite3
+import time
+from collections import deque
 
 import pandas as pd
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
-from services.category_classification import classify_args
+from hierarchical_utils import update_progress, update_status
+from services.dedup import group_duplicates
+from services.embedding_prefetch import EmbeddingPrefetcher
+from services.extraction_packing import (
+    DEFAULT_MAX_COMMENTS,
+    DEFAULT_TOKEN_BUDGET,
+    PackedExtractionResponse,
+    build_packed_messages,
+    pack_comments,
+    parse_packed_response,
+)
+from services.instrumentation import bind_current_span, latency_summary
 from services.llm import request_to_chat_ai
 from services.parse_json_list import parse_extraction_response
-from utils import update_progress
 
 COMMA_AND_SPACE_AND_RIGHT_BRACKET = re.compile(r",\s*(\])")
+JOURNAL_FILENAME = "extraction_journal.jsonl"
+ARGUMENT_INDEX_FILENAME = "extraction_arguments.sqlite3"
 
 
 class ExtractionResponse(BaseModel):
@@ -46,102 +64,368 @@ def extraction(config):
     )
     comment_ids = (comments["comment-id"].values)[:limit]
     comments.set_index("comment-id", inplace=True)
-    results = pd.DataFrame()
     update_progress(config, total=len(comment_ids))
 
-    argument_map = {}
-    relation_rows = []
+    # 抽出結果はバッチごとにジャーナルへ追記し、途中で失敗した場合は次回の実行で続きから再開する
+    journal = ExtractionJournal(
+        f"outputs/{dataset}/{JOURNAL_FILENAME}",
+        params={"prompt": prompt, "model": model, "provider": provider},
+        resume=not config.get("force", False),
+    )
+    pending_ids = [id for id in comment_ids if not journal.is_completed(id, comments.loc[id]["comment-body"])]
 
-    for i in tqdm(range(0, len(comment_ids), workers)):
-        batch = comment_ids[i : i + workers]
-        batch_inputs = [comments.loc[id]["comment-body"] for id in batch]
-        batch_results = extract_batch(
-            batch_inputs, prompt, model, workers, provider, config.get("local_llm_address"), config
-        )
+    # 抽出した意見はembeddingステップを待たずに埋め込みを計算し、埋め込みキャッシュに保存しておく
+    prefetcher = EmbeddingPrefetcher.from_config(
+        config, on_progress=lambda stats: update_status(config, {"embedding_prefetch": stats})
+    )
+    if len(pending_ids) < len(comment_ids):
+        print(f"Resuming extraction: {len(comment_ids) - len(pending_ids)} comments already extracted")
+        update_progress(config, incr=len(comment_ids) - len(pending_ids))
+        if prefetcher is not None:
+            pending_set = set(pending_ids)
+            completed_ids = [id for id in comment_ids if id not in pending_set]
+            prefetcher.submit(arg for _, args in journal.iter_results(completed_ids) for arg in args)
 
-        for comment_id, extracted_args in zip(batch, batch_results, strict=False):
-            for j, arg in enumerate(extracted_args):
-                if arg not in argument_map:
-                    # argumentテーブルに追加
-                    arg_id = f"A{comment_id}_{j}"
-                    argument = arg
-                    argument_map[arg] = {
-                        "arg-id": arg_id,
-                        "argument": argument,
-                    }
-                else:
-                    arg_id = argument_map[arg]["arg-id"]
+    def flush(results):
+        journal.append(results)
+        if prefetcher is not None:
+            prefetcher.submit(arg for _, _, args in results for arg in args)
 
-                # relationテーブルにcommentとargの関係を追加
-                relation_row = {
-                    "arg-id": arg_id,
-                    "comment-id": comment_id,
-                }
-                relation_rows.append(relation_row)
+    # 本文が同じ(正規化して一致する)コメントは代表の1件だけを抽出し、結果をグループのすべてのコメントに割り当てる
+    groups = group_duplicates(
+        [(id, comments.loc[id]["comment-body"]) for id in pending_ids],
+        mode=config["extraction"].get("dedup", "normalized"),
+        threshold=config["extraction"].get("dedup_threshold", 0.9),
+    )
+    if len(groups) < len(pending_ids):
+        print(f"Extraction dedup: {len(pending_ids)} comments -> {len(groups)} unique comments")
+    config["extraction_dedup"] = {"comments": len(pending_ids), "unique": len(groups)}
 
-        update_progress(config, incr=len(batch))
+    if config["extraction"].get("packing", False):
+        # 短いコメントは複数件を1リクエストにまとめて抽出する
+        stream = extract_packed_stream(
+            [(id, comments.loc[id]["comment-body"]) for id in groups],
+            prompt,
+            model,
+            workers,
+            provider,
+            config.get("local_llm_address"),
+            config,
+            token_budget=config["extraction"].get("pack_token_budget", DEFAULT_TOKEN_BUDGET),
+            max_comments=config["extraction"].get("pack_max_comments", DEFAULT_MAX_COMMENTS),
+        )
+    else:
+        stream = extract_stream(
+            [(id, comments.loc[id]["comment-body"]) for id in groups],
+            prompt,
+            model,
+            workers,
+            provider,
+            config.get("local_llm_address"),
+            config,
+        )
 
-    # DataFrame化
-    results = pd.DataFrame(argument_map.values())
-    relation_df = pd.DataFrame(relation_rows)
+    # 常にworkers件のリクエストを実行中に保ち、完了したものから順にジャーナルへ追記する
+    # 失敗したコメントはジャーナルに記録せず、次回の実行で再度抽出する
+    pending_results = []
+    processed = 0
+    try:
+        with tqdm(total=len(pending_ids)) as progress:
+            for comment_id, _, extracted_args in stream:
+                members = groups[comment_id]
+                if extracted_args is not None:
+                    # ジャーナルにはコメントごとの本文で記録し、再開時の判定はコメント単位で行う
+                    pending_results.extend((id, comments.loc[id]["comment-body"], extracted_args) for id in members)
+                processed += len(members)
+                progress.update(len(members))
+                if processed >= workers:
+                    flush(pending_results)
+                    update_progress(config, incr=processed)
+                    pending_results = []
+                    processed = 0
+            flush(pending_results)
+            update_progress(config, incr=processed)
+        # 埋め込みのプリフェッチの残りと並行して書き出す
+        arg_count = _write_arguments_and_relations(journal, comment_ids, path, f"outputs/{dataset}/relations.csv")
+    finally:
+        # 失敗した場合も投入済みの意見は計算しておき、再実行時に再利用する
+        prefetch_stats = prefetcher.close() if prefetcher is not None else None
 
-    if results.empty:
+    if prefetch_stats is not None:
+        print(
+            f"Embedding prefetch: {prefetch_stats['embedded']} embedded, "
+            f"{prefetch_stats['cached']} cached, {prefetch_stats['failed']} failed"
+        )
+    if arg_count == 0:
         raise RuntimeError("result is empty, maybe bad prompt")
 
-    classification_categories = config["extraction"]["categories"]
-    if classification_categories:
-        results = classify_args(results, config, workers)
 
-    results.to_csv(path, index=False)
-    # comment-idとarg-idの関係を保存
-    relation_df.to_csv(f"outputs/{dataset}/relations.csv", index=False)
+def _write_arguments_and_relations(
+    journal: "ExtractionJournal", comment_ids, args_path: str, relations_path: str
+) -> int:
+    """ジャーナルから args.csv と relations.csv を逐次書き出し、意見の件数を返す
+
+    同じ意見が複数のコメントから抽出された場合は、最初に抽出したコメントのarg-idを使う。
+    意見 -> arg-id の対応は意見の件数に比例して大きくなるため、メモリには持たず、ジャーナルと同じディレクトリの
+    一時的なSQLiteファイルに意見のハッシュをキーとして保持し、書き出し後に削除する。
+    """
+    index_path = os.path.join(os.path.dirname(journal.path), ARGUMENT_INDEX_FILENAME)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    index = sqlite3.connect(index_path)
+    try:
+        index.execute("PRAGMA journal_mode=OFF")
+        index.execute("PRAGMA synchronous=OFF")
+        index.execute("CREATE TABLE arguments (hash BLOB PRIMARY KEY, arg_id TEXT NOT NULL) WITHOUT ROWID")
+        arg_count = 0
+        with (
+            open(args_path, "w", newline="") as args_file,
+            open(relations_path, "w", newline="") as relations_file,
+        ):
+            args_writer = csv.writer(args_file, lineterminator="\n")
+            relations_writer = csv.writer(relations_file, lineterminator="\n")
+            args_writer.writerow(["arg-id", "argument"])
+            relations_writer.writerow(["arg-id", "comment-id"])
+
+            for comment_id, extracted_args in journal.iter_results(comment_ids):
+                for j, arg in enumerate(extracted_args):
+                    arg_hash = hashlib.sha256(str(arg).encode("utf-8")).digest()
+                    row = index.execute("SELECT arg_id FROM arguments WHERE hash = ?", (arg_hash,)).fetchone()
+                    if row is None:
+                        # argumentテーブルに追加
+                        arg_id = f"A{comment_id}_{j}"
+                        index.execute("INSERT INTO arguments VALUES (?, ?)", (arg_hash, arg_id))
+                        args_writer.writerow([arg_id, arg])
+                        arg_count += 1
+                    else:
+                        arg_id = row[0]
+                    # relationテーブルにcommentとargの関係を追加
+                    relations_writer.writerow([arg_id, comment_id])
+        return arg_count
+    finally:
+        index.close()
+        os.remove(index_path)
+
+
+class ExtractionJournal:
+    """コメントごとの抽出結果を追記していくJSONLファイル
+
+    1行目にプロンプトやモデルなどのパラメータを記録し、2行目以降に
+    {"comment-id": ..., "body-hash": ..., "arguments": [...]} を1コメント1行で追記する。
+    パラメータが一致し、コメント本文のハッシュも一致する行だけを再開時に再利用する。
+    """
+
+    def __init__(self, path: str, params: dict, resume: bool = True):
+        self.path = path
+        self.params = params
+        # comment-id -> 有効な最新の行の本文ハッシュ
+        self._completed: dict[str, str] = {}
+
+        if resume and os.path.exists(path) and self._read_header() == params:
+            self._truncate_partial_line()
+            for _, entry in self._iter_entries():
+                self._completed[entry["comment-id"]] = entry["body-hash"]
+        else:
+            with open(path, "w") as f:
+                f.write(json.dumps({"params": params}, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _body_hash(body) -> str:
+        return hashlib.sha256(str(body).encode("utf-8")).hexdigest()
+
+    def _read_header(self) -> dict | None:
+        try:
+            with open(self.path) as f:
+                return json.loads(f.readline()).get("params")
+        except (json.JSONDecodeError, AttributeError):
+            return None
+
+    def _truncate_partial_line(self) -> None:
+        # 書き込み途中で中断された最終行があれば、続けて追記する前に取り除く
+        with open(self.path, "rb+") as f:
+            content = f.read()
+            if content and not content.endswith(b"\n"):
+                f.truncate(content.rfind(b"\n") + 1)
+
+    def _iter_entries(self):
+        """(ファイル内の位置, 行の内容) を順に返す"""
+        with open(self.path, "rb") as f:
+            f.readline()  # header
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    yield offset, json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def is_completed(self, comment_id, body) -> bool:
+        return self._completed.get(str(comment_id)) == self._body_hash(body)
+
+    def append(self, results: list[tuple]) -> None:
+        """(comment-id, コメント本文, 抽出した意見のリスト) を追記し、ディスクに書き出す"""
+        if not results:
+            return
+        lines = []
+        for comment_id, body, arguments in results:
+            body_hash = self._body_hash(body)
+            self._completed[str(comment_id)] = body_hash
+            entry = {"comment-id": str(comment_id), "body-hash": body_hash, "arguments": arguments}
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        with open(self.path, "a") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def iter_results(self, comment_ids):
+        """指定したコメントの有効な抽出結果を、comment_idsの順に返す
+
+        全件をメモリに載せないよう、先に各コメントの有効な行の位置だけを集めてから読み出す。
+        """
+        offsets: dict[str, int] = {}
+        for offset, entry in self._iter_entries():
+            if self._completed.get(entry["comment-id"]) == entry["body-hash"]:
+                offsets[entry["comment-id"]] = offset
+        with open(self.path, "rb") as f:
+            for comment_id in comment_ids:
+                offset = offsets.get(str(comment_id))
+                if offset is None:
+                    continue
+                f.seek(offset)
+                yield str(comment_id), json.loads(f.readline())["arguments"]
 
 
 logging.basicConfig(level=logging.ERROR)
 
 
-def extract_batch(batch, prompt, model, workers, provider="openai", local_llm_address=None, config=None):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        futures_with_index = [
-            (i, executor.submit(extract_arguments, input, prompt, model, provider, local_llm_address))
-            for i, input in enumerate(batch)
-        ]
+def extract_stream(
+    items,
+    prompt,
+    model,
+    workers,
+    provider="openai",
+    local_llm_address=None,
+    config=None,
+    max_attempts=3,
+    extract_fn=None,
+    latency_key="extraction_latency",
+):
+    """(comment-id, コメント本文) を受け取り、抽出が終わったものから (comment-id, コメント本文, 意見のリスト) を返す
+
+    バッチ単位で待ち合わせず、1件完了するたびに次のコメントを投入して常にworkers件を実行中に保つ。
+    失敗したリクエストはmax_attempts回まで投入し直し、それでも抽出できなかったコメントは意見のリストをNoneとして返す。
+    リクエストのタイムアウトはHTTPクライアント側(services/llm.py)に任せ、タイムアウトした場合も失敗として扱う。
+    スケジューラの待ち行列で待っている時間はタイムアウトに含めず、同じコメントのリクエストを重複して送ることもない。
+    extract_fn を指定した場合は extract_arguments の代わりに使う(複数のコメントをまとめたリクエストなど)。
+    """
+    extract_fn = bind_current_span(extract_fn or extract_arguments)
+    queue = deque(items)
+    attempts: dict = {}
+    latencies: list[float] = []
+    total_token_input = 0
+    total_token_output = 0
+    total_token_usage = 0
 
-        done, not_done = concurrent.futures.wait([f for _, f in futures_with_index], timeout=30)
-        results = [[] for _ in range(len(batch))]
-        total_token_input = 0
-        total_token_output = 0
-        total_token_usage = 0
+    # future -> (comment-id, コメント本文, 開始時刻)
+    in_flight: dict[concurrent.futures.Future, tuple] = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
 
-        for _, future in futures_with_index:
-            if future in not_done and not future.cancelled():
-                future.cancel()
+    try:
+        while queue or in_flight:
+            while queue and len(in_flight) < workers:
+                comment_id, body = queue.popleft()
+                attempts[comment_id] = attempts.get(comment_id, 0) + 1
+                future = executor.submit(extract_fn, body, prompt, model, provider, local_llm_address)
+                in_flight[future] = (comment_id, body, time.monotonic())
 
-        for i, future in futures_with_index:
-            if future in done:
+            done, _ = concurrent.futures.wait(in_flight, return_when="FIRST_COMPLETED")
+            for future in done:
+                comment_id, body, started = in_flight.pop(future)
                 try:
                     result = future.result()
-                    if isinstance(result, tuple) and len(result) == 4:
-                        items, token_input, token_output, token_total = result
-                        results[i] = items
-                        total_token_input += token_input
-                        total_token_output += token_output
-                        total_token_usage += token_total
-                    else:
-                        results[i] = result
                 except Exception as e:
-                    logging.error(f"Task {future} failed with error: {e}")
-                    results[i] = []
+                    logging.error(f"Extraction for comment {comment_id} failed with error: {e}")
+                    if attempts[comment_id] < max_attempts:
+                        queue.append((comment_id, body))
+                    else:
+                        yield comment_id, body, None
+                    continue
 
+                latencies.append(time.monotonic() - started)
+                if isinstance(result, tuple) and len(result) == 4:
+                    extracted_args, token_input, token_output, token_total = result
+                    total_token_input += token_input
+                    total_token_output += token_output
+                    total_token_usage += token_total
+                else:
+                    extracted_args = result
+                yield comment_id, body, extracted_args
+    finally:
+        # 途中で打ち切られた場合は、まだ開始していないリクエストを取り消す
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if config is not None:
+        config["total_token_usage"] = config.get("total_token_usage", 0) + total_token_usage
+        config["token_usage_input"] = config.get("token_usage_input", 0) + total_token_input
+        config["token_usage_output"] = config.get("token_usage_output", 0) + total_token_output
+        print(f"Extraction: input={total_token_input}, output={total_token_output}, total={total_token_usage} tokens")
+    if latencies:
+        percentiles = latency_summary(latencies)
+        print(
+            f"Extraction latency ({percentiles['count']} requests): "
+            f"p50={percentiles['p50']:.2f}s, p90={percentiles['p90']:.2f}s, "
+            f"p99={percentiles['p99']:.2f}s, max={percentiles['max']:.2f}s"
+        )
         if config is not None:
-            config["total_token_usage"] = config.get("total_token_usage", 0) + total_token_usage
-            config["token_usage_input"] = config.get("token_usage_input", 0) + total_token_input
-            config["token_usage_output"] = config.get("token_usage_output", 0) + total_token_output
-            print(
-                f"Extraction batch: input={total_token_input}, output={total_token_output}, total={total_token_usage} tokens"
-            )
+            config[latency_key] = percentiles
+
+
+def extract_packed_stream(
+    items,
+    prompt,
+    model,
+    workers,
+    provider="openai",
+    local_llm_address=None,
+    config=None,
+    token_budget=DEFAULT_TOKEN_BUDGET,
+    max_comments=DEFAULT_MAX_COMMENTS,
+):
+    """extract_stream と同じ形式で結果を返すが、短いコメントは複数件を1リクエストにまとめて抽出する
 
-        return results
+    長いコメントと、まとめたリクエストで結果が得られなかったコメントは、最後に1件ずつ抽出する。
+    """
+    packs, singles = pack_comments(items, token_budget, max_comments)
+    fallback = list(singles)
+    stats = {"packs": len(packs), "packed_comments": sum(len(pack) for pack in packs), "long_comments": len(singles)}
+    if packs:
+        print(f"Extraction packing: {stats['packed_comments']} comments in {len(packs)} requests")
+        for _, pack, extracted in extract_stream(
+            [(f"pack-{i}", pack) for i, pack in enumerate(packs)],
+            prompt,
+            model,
+            workers,
+            provider,
+            local_llm_address,
+            config,
+            max_attempts=2,
+            extract_fn=extract_packed_arguments,
+            latency_key="extraction_packed_latency",
+        ):
+            for comment_id, body in pack:
+                if extracted is not None and comment_id in extracted:
+                    yield comment_id, body, extracted[comment_id]
+                else:
+                    fallback.append((comment_id, body))
+
+    stats["fallback_comments"] = len(fallback) - len(singles)
+    if config is not None:
+        config["extraction_packing"] = stats
+    if fallback:
+        print(f"Extraction packing: extracting {len(fallback)} comments individually")
+        yield from extract_stream(fallback, prompt, model, workers, provider, local_llm_address, config)
 
 
 def extract_arguments(input, prompt, model, provider="openai", local_llm_address=None):
@@ -167,3 +451,18 @@ def extract_arguments(input, prompt, model, provider="openai", local_llm_address
         print("Response was:", response)
         print("Silently giving up on trying to generate valid list.")
         return []
+
+
+def extract_packed_arguments(pack, prompt, model, provider="openai", local_llm_address=None):
+    """複数のコメントをまとめて抽出し、(comment-id -> 意見のリスト, トークン使用量...) を返す"""
+    response, token_input, token_output, token_total = request_to_chat_ai(
+        messages=build_packed_messages(prompt, pack),
+        model=model,
+        is_json=False,
+        json_schema=PackedExtractionResponse,
+        provider=provider,
+        local_llm_address=local_llm_address,
+        # どのコメントの結果も取り出せないレスポンスはキャッシュしない
+        validate=lambda response: parse_packed_response(response, pack),
+    )
+    return parse_packed_response(response, pack), token_input, token_output, token_total
@@ -0,0 +1,16 @@
+from services.artifacts import read_table, write_table
+from services.category_classification import classify_args
+
+
+def extraction_classification(config):
+    """抽出した意見を config["extraction"]["categories"] のカテゴリに分類し、args.csv にカラムとして追加する
+
+    後続のステップのうち分類結果を使うのは hierarchical_aggregation だけなので、
+    embedding 以降のステップと並行して実行される。
+    """
+    dataset = config["output_dir"]
+    if not config["extraction"]["categories"]:
+        return
+    results = read_table(dataset, "args")
+    results = classify_args(results, config, config["extraction"]["workers"])
+    write_table(dataset, "args", results)
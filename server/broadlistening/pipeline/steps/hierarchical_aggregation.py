@@ -1,6 +1,7 @@
 """Generate a convenient JSON output file."""
 
 import json
+import os
 from collections import defaultdict
 from pathlib import Path
 from typing import Any, TypedDict
@@ -8,6 +9,8 @@ from typing import Any, TypedDict
 import numpy as np
 import pandas as pd
 
+from services.result_format import PROVENANCE_FILENAME, build_custom_intro, compact_result
+
 ROOT_DIR = Path(__file__).parent.parent.parent.parent
 CONFIG_DIR = ROOT_DIR / "scatter" / "pipeline" / "configs"
 PIPELINE_DIR = ROOT_DIR / "broadlistening" / "pipeline"
@@ -63,7 +66,6 @@ class Cluster(TypedDict):
 
 def hierarchical_aggregation(config) -> bool:
     try:
-        path = f"outputs/{config['output_dir']}/hierarchical_result.json"
         results = {
             "arguments": [],
             "clusters": [],
@@ -101,13 +103,18 @@ def hierarchical_aggregation(config) -> bool:
         print(overview)
         results["overview"] = overview
 
+        # TODO: サンプリングロジックを実装したいが、現状は全件抽出
+        processed_num = min(len(comments), config["extraction"]["limit"])
+        print(f"Input count: {len(comments)}")
+        print(f"Args count: {arg_num}")
+        results["config"] = {
+            **config,
+            "intro": build_custom_intro(config, processed_num=processed_num, args_count=arg_num),
+        }
+
         # Convert non-serializable NumPy types to native Python types
         results = json_serialize_numpy(results)
-
-        with open(path, "w") as file:
-            json.dump(results, file, indent=2, ensure_ascii=False)
-        # TODO: サンプリングロジックを実装したいが、現状は全件抽出
-        create_custom_intro(config)
+        write_result(config["output_dir"], results)
         if config["is_pubcom"]:
             add_original_comments(labels, arguments, relation_df, clusters, config)
         return True
@@ -117,52 +124,24 @@ def hierarchical_aggregation(config) -> bool:
         return False
 
 
-def create_custom_intro(config):
-    dataset = config["output_dir"]
-    args_path = PIPELINE_DIR / f"outputs/{dataset}/args.csv"
-    comments = pd.read_csv(PIPELINE_DIR / f"inputs/{config['input']}.csv")
-    result_path = PIPELINE_DIR / f"outputs/{dataset}/hierarchical_result.json"
-
-    input_count = len(comments)
-    args_count = len(pd.read_csv(args_path))
-    processed_num = min(input_count, config["extraction"]["limit"])
-
-    print(f"Input count: {input_count}")
-    print(f"Args count: {args_count}")
-
-    # LLMプロバイダーとモデル名の判定
-    def get_llm_provider_display():
-        # configからプロバイダー情報を取得（優先）
-        provider = config.get("provider", "openai")
-        model = config.get("model", "unknown")
-
-        # プロバイダー名をマッピング
-        provider_names = {
-            "openai": "OpenAI API",
-            "azure": "Azure OpenAI API",
-            "openrouter": "OpenRouter API",
-            "local": "Local LLM",
-        }
-
-        provider_name = provider_names.get(provider, f"{provider} API")
-        return f"{provider_name} ({model})"
+def write_result(dataset: str, results: dict) -> None:
+    """結果ファイルを書き出す
 
-    llm_provider = get_llm_provider_display()
-
-    base_custom_intro = """{intro}
-分析対象となったデータの件数は{processed_num}件で、これらのデータに対して{llm_provider}を用いて{args_count}件の意見（議論）を抽出し、クラスタリングを行った。
-"""
-
-    intro = config["intro"]
-    custom_intro = base_custom_intro.format(
-        intro=intro, processed_num=processed_num, args_count=args_count, llm_provider=llm_provider
-    )
+    PIPELINE_RESULT_FORMAT=legacy の場合は従来の形式(意見のオブジェクトのリスト、設定をすべて含む)で書き出す。
+    それ以外の場合はコンパクト形式(services/result_format.py)で書き出し、プロンプト・ソースコード・実行記録は
+    hierarchical_provenance.json に分ける。
+    """
+    output_dir = PIPELINE_DIR / "outputs" / dataset
+    if os.getenv("PIPELINE_RESULT_FORMAT", "compact").lower() == "legacy":
+        with open(output_dir / "hierarchical_result.json", "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        return
 
-    with open(result_path) as f:
-        result = json.load(f)
-    result["config"]["intro"] = custom_intro
-    with open(result_path, "w") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
+    compact, provenance = compact_result(results)
+    with open(output_dir / PROVENANCE_FILENAME, "w") as f:
+        json.dump(provenance, f, ensure_ascii=False, separators=(",", ":"))
+    with open(output_dir / "hierarchical_result.json", "w") as f:
+        json.dump(compact, f, ensure_ascii=False, separators=(",", ":"))
 
 
 def add_original_comments(labels, arguments, relation_df, clusters, config):
@@ -235,11 +214,7 @@ def _build_arguments(
     """
     cluster_columns = [col for col in clusters.columns if col.startswith("cluster-level-") and "id" in col]
 
-    # Prepare for merging with original comments to get attributes
-    comments_copy = comments.copy()
-    comments_copy["comment-id"] = comments_copy["comment-id"].astype(str)
-
-    # Get argument to comment mapping
+    # Get argument to comment mapping (同じarg-idが複数のコメントに対応する場合は最後の行を使う)
     arg_comment_map = {}
     if "comment-id" in relation_df.columns:
         relation_df["comment-id"] = relation_df["comment-id"].astype(str)
@@ -249,56 +224,51 @@ def _build_arguments(
     attribute_columns = [col for col in comments.columns if col.startswith("attribute_")]
     print(f"属性カラム検出: {attribute_columns}")
 
-    arguments: list[Argument] = []
-    for _, row in clusters.iterrows():
-        cluster_ids = ["0"]
-        for cluster_column in cluster_columns:
-            cluster_ids.append(str(row[cluster_column]))  # Convert to string to ensure serializable
+    # comment-idごとに最初の行の位置を引けるようにしておく(引数ごとに全コメントを走査しない)
+    comment_ids = comments["comment-id"].astype(str).tolist()
+    comment_positions: dict[str, int] = {}
+    for position, comment_id in enumerate(comment_ids):
+        comment_positions.setdefault(comment_id, position)
 
+    include_url = config.get("enable_source_link", False) and "url" in comments.columns
+    urls = comments["url"].tolist() if include_url else []
+    # Remove "attribute_" prefix for cleaner attribute names
+    attribute_values = [(col[len("attribute_") :], comments[col].tolist()) for col in attribute_columns]
+
+    arguments: list[Argument] = []
+    cluster_id_columns = [clusters[col].tolist() for col in cluster_columns]
+    for i, (arg_id, argument_text, x, y) in enumerate(
+        zip(
+            clusters["arg-id"].tolist(),
+            clusters["argument"].tolist(),
+            clusters["x"].tolist(),
+            clusters["y"].tolist(),
+            strict=True,
+        )
+    ):
         # Create base argument
         argument: Argument = {
-            "arg_id": str(row["arg-id"]),  # Convert to string to ensure serializable
-            "argument": str(row["argument"]),
-            "x": float(row["x"]),  # Convert to native float
-            "y": float(row["y"]),  # Convert to native float
+            "arg_id": str(arg_id),
+            "argument": str(argument_text),
+            "x": float(x),
+            "y": float(y),
             "p": 0,  # NOTE: 一旦全部0でいれる
-            "cluster_ids": cluster_ids,
+            "cluster_ids": ["0"] + [str(values[i]) for values in cluster_id_columns],
             "attributes": None,
             "url": None,
         }
 
         # Add attributes and URL if available
-        if row["arg-id"] in arg_comment_map:
-            comment_id = arg_comment_map[row["arg-id"]]
-            comment_rows = comments_copy[comments_copy["comment-id"] == comment_id]
-
-            if not comment_rows.empty:
-                comment_row = comment_rows.iloc[0]
-
-                # Add URL if available and enabled
-                if config.get("enable_source_link", False) and "url" in comment_row and comment_row["url"] is not None:
-                    argument["url"] = str(comment_row["url"])
-
-                # Add attributes if available
-                if attribute_columns:
-                    attributes = {}
-                    for attr_col in attribute_columns:
-                        # Remove "attribute_" prefix for cleaner attribute names
-                        attr_name = attr_col[len("attribute_") :]
-                        # Convert potential numpy types to Python native types
-                        attr_value = comment_row.get(attr_col, None)
-                        if attr_value is not None:
-                            if isinstance(attr_value, np.integer):
-                                attr_value = int(attr_value)
-                            elif isinstance(attr_value, np.floating):
-                                attr_value = float(attr_value)
-                            elif isinstance(attr_value, np.ndarray):
-                                attr_value = attr_value.tolist()
-                        attributes[attr_name] = attr_value
-
-                    # Only add non-empty attributes
-                    if any(v is not None for v in attributes.values()):
-                        argument["attributes"] = attributes
+        position = comment_positions.get(arg_comment_map.get(arg_id))
+        if position is not None:
+            if include_url and urls[position] is not None:
+                argument["url"] = str(urls[position])
+
+            if attribute_values:
+                attributes = {attr_name: values[position] for attr_name, values in attribute_values}
+                # Only add non-empty attributes
+                if any(v is not None for v in attributes.values()):
+                    argument["attributes"] = attributes
 
         arguments.append(argument)
     return arguments
@@ -393,29 +363,22 @@ def _build_property_map(
             "設定ファイルaggregation / hidden_propertiesから該当カラムを取り除いてください。"
         )
 
+    # Make sure arg_id is string
+    arg_ids = [str(arg_id) for arg_id in arguments.index]
     for prop in property_columns:
-        for arg_id, row in arguments.iterrows():
-            # LLMによるcategory classificationがうまく行かず、NaNの場合はNoneにする
-            value = row[prop] if not pd.isna(row[prop]) else None
-
-            # Convert NumPy types to Python native types
-            if value is not None:
-                if isinstance(value, np.integer):
-                    value = int(value)
-                elif isinstance(value, np.floating):
-                    value = float(value)
-                elif isinstance(value, np.ndarray):
-                    value = value.tolist()
-                else:
-                    # Convert any other types to string to ensure serialization
-                    try:
-                        value = str(value)
-                    except Exception as e:
-                        print(f"Error converting value to string: {e}")
-                        value = None
-
-            # Make sure arg_id is string
-            str_arg_id = str(arg_id)
-            property_map[prop][str_arg_id] = value
+        property_map[prop] = dict(zip(arg_ids, map(_property_value, arguments[prop].tolist()), strict=True))
 
     return property_map
+
+
+def _property_value(value: Any) -> Any:
+    # LLMによるcategory classificationがうまく行かず、NaNの場合はNoneにする
+    if value is None or pd.isna(value):
+        return None
+    # iterrowsで1行ずつ取り出していた頃と同じく、数値も含めて文字列にする
+    # (args.csvには文字列のargumentカラムがあるため、行はobject型になり値はPythonの型で取り出されていた)
+    try:
+        return str(value)
+    except Exception as e:
+        print(f"Error converting value to string: {e}")
+        return None
@@ -7,17 +7,27 @@ import pandas as pd
 import scipy.cluster.hierarchy as sch
 from sklearn.cluster import KMeans
 
+from services.artifacts import load_embeddings, read_table, write_table
+from services.dedup import find_argument_representatives
+
 
 def hierarchical_clustering(config):
     UMAP = import_module("umap").UMAP
 
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/hierarchical_clusters.csv"
-    arguments_df = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings_df = pd.read_pickle(f"outputs/{dataset}/embeddings.pkl")
-    embeddings_array = np.asarray(embeddings_df["embedding"].values.tolist())
+    arguments_df = read_table(dataset, "args", columns=["arg-id", "argument"])
+    # float32の行列をメモリマップで開く(Pythonのリストを経由しない)
+    _, embeddings_array = load_embeddings(dataset)
     cluster_nums = config["hierarchical_clustering"]["cluster_nums"]
 
+    # ほぼ同じ意見をまとめ、代表の意見だけを UMAP/KMeans に渡す(まとめた件数は KMeans の重みにする)
+    representatives = _find_representatives(arguments_df, embeddings_array, config, max(cluster_nums))
+    representative_rows = np.flatnonzero(representatives == np.arange(len(representatives)))
+    multiplicity = np.bincount(representatives, minlength=len(representatives))
+    if len(representative_rows) < len(representatives):
+        print(f"clustering {len(representative_rows)} representatives of {len(representatives)} arguments")
+        embeddings_array = embeddings_array[representative_rows]
+
     n_samples = embeddings_array.shape[0]
     # デフォルト設定は15
     default_n_neighbors = 15
@@ -37,20 +47,47 @@ def hierarchical_clustering(config):
     cluster_results = hierarchical_clustering_embeddings(
         umap_embeds=umap_embeds,
         cluster_nums=cluster_nums,
+        sample_weight=multiplicity[representative_rows],
     )
+    # 代表以外の意見には、代表の座標とクラスタを割り当てる
+    positions = np.searchsorted(representative_rows, representatives)
+    umap_embeds = umap_embeds[positions]
     result_df = pd.DataFrame(
         {
             "arg-id": arguments_df["arg-id"],
             "argument": arguments_df["argument"],
             "x": umap_embeds[:, 0],
             "y": umap_embeds[:, 1],
+            "multiplicity": multiplicity[representatives],
         }
     )
 
     for cluster_level, final_labels in enumerate(cluster_results.values(), start=1):
-        result_df[f"cluster-level-{cluster_level}-id"] = [f"{cluster_level}_{label}" for label in final_labels]
+        result_df[f"cluster-level-{cluster_level}-id"] = [
+            f"{cluster_level}_{label}" for label in final_labels[positions]
+        ]
+
+    write_table(dataset, "hierarchical_clusters", result_df)
 
-    result_df.to_csv(path, index=False)
+
+def _find_representatives(arguments_df: pd.DataFrame, embeddings_array, config, min_representatives: int) -> np.ndarray:
+    """設定(hierarchical_clustering.dedup)に従って、各意見の代表の行番号を返す"""
+    mode = config["hierarchical_clustering"]["dedup"]
+    threshold = config["hierarchical_clustering"]["dedup_threshold"]
+    representatives = find_argument_representatives(
+        arguments_df["argument"].astype(str).tolist(), embeddings_array, mode=mode, threshold=threshold
+    )
+    n_representatives = int((representatives == np.arange(len(representatives))).sum())
+    config["hierarchical_clustering_dedup"] = {
+        "mode": mode,
+        "arguments": len(representatives),
+        "representatives": n_representatives,
+    }
+    if n_representatives < min_representatives:
+        # まとめた結果がクラスタ数より少なくなった場合は、まとめずにクラスタリングする
+        print(f"only {n_representatives} representatives for {min_representatives} clusters, skipping dedup")
+        return np.arange(len(representatives), dtype=np.int64)
+    return representatives
 
 
 def generate_cluster_count_list(min_clusters: int, max_clusters: int):
@@ -104,12 +141,13 @@ def merge_clusters_with_hierarchy(
 def hierarchical_clustering_embeddings(
     umap_embeds,
     cluster_nums,
+    sample_weight=None,
 ):
     # 最大分割数でクラスタリングを実施
     print("start initial clustering")
     initial_cluster_num = cluster_nums[-1]
     kmeans_model = KMeans(n_clusters=initial_cluster_num, random_state=42)
-    kmeans_model.fit(umap_embeds)
+    kmeans_model.fit(umap_embeds, sample_weight=sample_weight)
     print("end initial clustering")
 
     results = {}
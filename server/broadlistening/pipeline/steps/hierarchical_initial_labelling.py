@@ -6,6 +6,8 @@ from typing import TypedDict
 import pandas as pd
 from pydantic import BaseModel, Field
 
+from services.artifacts import read_table, write_table
+from services.instrumentation import bind_current_span
 from services.llm import request_to_chat_ai
 
 
@@ -31,8 +33,7 @@ def hierarchical_initial_labelling(config: dict) -> None:
             - provider: LLMプロバイダー
     """
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/hierarchical_initial_labels.csv"
-    clusters_argument_df = pd.read_csv(f"outputs/{dataset}/hierarchical_clusters.csv")
+    clusters_argument_df = read_table(dataset, "hierarchical_clusters")
 
     cluster_id_columns = [col for col in clusters_argument_df.columns if col.startswith("cluster-level-")]
     initial_cluster_id_column = cluster_id_columns[-1]
@@ -67,7 +68,7 @@ def hierarchical_initial_labelling(config: dict) -> None:
         }
     )
     print("end initial labelling")
-    initial_clusters_argument_df.to_csv(path, index=False)
+    write_table(dataset, "hierarchical_initial_labels", initial_clusters_argument_df)
 
 
 def initial_labelling(
@@ -110,7 +111,7 @@ def initial_labelling(
         config=config,  # configを渡す
     )
     with ThreadPoolExecutor(max_workers=workers) as executor:
-        results = list(executor.map(process_func, cluster_ids))
+        results = list(executor.map(bind_current_span(process_func), cluster_ids))
     return pd.DataFrame(results)
 
 
@@ -8,6 +8,8 @@ import pandas as pd
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
+from services.artifacts import read_table, write_table
+from services.instrumentation import bind_current_span
 from services.llm import request_to_chat_ai
 
 
@@ -54,8 +56,7 @@ def hierarchical_merge_labelling(config: dict) -> None:
             - provider: LLMプロバイダー
     """
     dataset = config["output_dir"]
-    merge_path = f"outputs/{dataset}/hierarchical_merge_labels.csv"
-    clusters_df = pd.read_csv(f"outputs/{dataset}/hierarchical_initial_labels.csv")
+    clusters_df = read_table(dataset, "hierarchical_initial_labels")
 
     cluster_id_columns: list[str] = _filter_id_columns(clusters_df.columns)
     # ボトムクラスタのラベル・説明とクラスタid付きの各argumentを入力し、各階層のクラスタラベル・説明を生成し、argumentに付けたdfを作成
@@ -70,7 +71,7 @@ def hierarchical_merge_labelling(config: dict) -> None:
     parent_child_df = _build_parent_child_mapping(merge_result_df, cluster_id_columns)
     melted_df = melted_df.merge(parent_child_df, on=["level", "id"], how="left")
     density_df = calculate_cluster_density(melted_df, config)
-    density_df.to_csv(merge_path, index=False)
+    write_table(dataset, "hierarchical_merge_labels", density_df)
 
 
 def _build_parent_child_mapping(df: pd.DataFrame, cluster_id_columns: list[str]):
@@ -193,7 +194,7 @@ def merge_labelling(clusters_df: pd.DataFrame, cluster_id_columns: list[str], co
         with ThreadPoolExecutor(max_workers=config["hierarchical_merge_labelling"]["workers"]) as executor:
             responses = list(
                 tqdm(
-                    executor.map(process_fn, current_cluster_ids),
+                    executor.map(bind_current_span(process_fn), current_cluster_ids),
                     total=len(current_cluster_ids),
                 )
             )
@@ -300,7 +301,11 @@ def process_merge_labelling(
 
 def calculate_cluster_density(melted_df: pd.DataFrame, config: dict):
     """クラスタ内の密度計算"""
-    hierarchical_cluster_df = pd.read_csv(f"outputs/{config['output_dir']}/hierarchical_clusters.csv")
+    hierarchical_cluster_df = read_table(
+        config["output_dir"],
+        "hierarchical_clusters",
+        columns=lambda column: column in ("x", "y") or (column.startswith("cluster-level-") and column.endswith("-id")),
+    )
 
     densities = []
     for level, c_id in zip(melted_df["level"], melted_df["id"], strict=False):
@@ -3,9 +3,9 @@
 import json
 import re
 
-import pandas as pd
 from pydantic import BaseModel, Field
 
+from services.artifacts import read_table
 from services.llm import request_to_chat_ai
 
 
@@ -17,7 +17,9 @@ def hierarchical_overview(config):
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/hierarchical_overview.txt"
 
-    hierarchical_label_df = pd.read_csv(f"outputs/{dataset}/hierarchical_merge_labels.csv")
+    hierarchical_label_df = read_table(
+        dataset, "hierarchical_merge_labels", columns=["level", "id", "label", "description"]
+    )
 
     prompt = config["hierarchical_overview"]["prompt"]
     model = config["hierarchical_overview"]["model"]
@@ -26,6 +26,19 @@ class Settings(BaseSettings):
     INPUT_DIR: Path = TOOL_DIR / "pipeline" / "inputs"
     DATA_DIR: Path = BASE_DIR / "data"
 
+    # レポート生成を実行する常駐ワーカープロセスの数(同時に実行するジョブ数の上限)。
+    # 0 の場合は従来通りレポートごとに hierarchical_main.py のサブプロセスを起動する
+    PIPELINE_WORKERS: int = Field(env="PIPELINE_WORKERS", default=2)
+    # 集約の再実行など優先度の高いジョブだけが使える予備のワーカーの数
+    PIPELINE_PRIORITY_WORKERS: int = Field(env="PIPELINE_PRIORITY_WORKERS", default=1)
+    # LLMプロバイダーごとの同時実行数の上限(JSON。例: {"openai": 2, "openrouter": 1})
+    PIPELINE_PROVIDER_CONCURRENCY: dict[str, int] = Field(env="PIPELINE_PROVIDER_CONCURRENCY", default={})
+    # ワーカーの起動時にローカル埋め込みモデルを読み込んでおくかどうか
+    PIPELINE_WARM_LOCAL_EMBEDDING: bool = Field(env="PIPELINE_WARM_LOCAL_EMBEDDING", default=False)
+
+    # 公開レポートAPIで結果ファイルをキャッシュするメモリの上限(バイト数)
+    REPORT_CACHE_MAX_BYTES: int = Field(env="REPORT_CACHE_MAX_BYTES", default=256 * 1024**2)
+
     # ストレージ設定
     STORAGE_TYPE: StorageType = Field(env="STORAGE_TYPE", default="local")
     AZURE_BLOB_STORAGE_ACCOUNT_NAME: str | None = Field(env="AZURE_BLOB_STORAGE_ACCOUNT_NAME", default=None)
@@ -20,3 +20,19 @@ class ConfigFileNotFound(ConfigRepoError):
 
 class ConfigJSONParseError(ConfigRepoError):
     """設定ファイルのパースに失敗したケース"""
+
+
+class ResultRepoError(Exception):
+    """ResultRepository の基底例外"""
+
+
+class ResultFileNotFound(ResultRepoError):
+    """レポートの結果ファイルが存在しないケース"""
+
+
+class ResultJSONParseError(ResultRepoError):
+    """レポートの結果ファイルのパースに失敗したケース"""
+
+
+class ResultClusterNotFound(ResultRepoError):
+    """結果ファイルに指定したクラスタが存在しないケース"""
@@ -7,7 +7,8 @@ from fastapi.responses import ORJSONResponse
 from src.config import settings
 from src.middleware.security_middleware import register_security_middleware
 from src.routers import router
-from src.services.report_status import load_status
+from src.services.report_launcher import shutdown_job_scheduler, start_job_scheduler
+from src.services.report_status import flush_status, load_status
 from src.services.report_sync import initialize_from_storage
 from src.utils.logger import setup_logger
 
@@ -45,7 +46,12 @@ async def lifespan(app: FastAPI):
 
     # ステータスファイルをロード
     load_status()
+
+    # レポート生成を実行するワーカーを起動し、前回の終了時に実行中だったジョブを再開する
+    start_job_scheduler()
     yield
+    shutdown_job_scheduler()
+    flush_status()
 
 
 app = get_app()
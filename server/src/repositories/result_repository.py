@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from broadlistening.pipeline.services.result_format import argument_count, build_custom_intro, is_compact
+from src.config import settings
+from src.core.exceptions import ResultClusterNotFound, ResultFileNotFound, ResultJSONParseError
+from src.schemas.cluster import ClusterUpdate
+from src.schemas.report_config import ReportConfigUpdate
+from src.utils.logger import setup_logger
+
+slogger = setup_logger()
+
+# 結果ファイルの読み込みから書き込みまでを、同じプロセス内の他の更新と重ならないようにする
+_lock = threading.Lock()
+
+
+class ResultRepository:
+    """レポートの結果ファイル（hierarchical_result.json）の一部だけを書き換えるrepository
+
+    クラスタのラベルやレポートのタイトル・調査概要の編集は、集約処理(hierarchical_aggregation)を
+    再実行せずに、結果ファイルの該当箇所だけを更新する。
+    """
+
+    def __init__(self, slug: str):
+        self.slug = slug
+        self.result_path = settings.REPORT_DIR / slug / "hierarchical_result.json"
+        self.comments_path = settings.REPORT_DIR / slug / "final_result_with_comments.csv"
+
+    def update_cluster(self, updated_cluster: ClusterUpdate) -> None:
+        """クラスタのラベル・説明を更新する"""
+        with _lock:
+            result = self._read()
+            target = next((c for c in result.get("clusters", []) if c.get("id") == updated_cluster.id), None)
+            if target is None:
+                raise ResultClusterNotFound(f"Cluster {updated_cluster.id} not found in {self.result_path}")
+
+            target["label"] = updated_cluster.label
+            target["takeaway"] = updated_cluster.description
+            self._write(result)
+
+            # パブコメモードでは、元コメント付きのCSVにも大カテゴリのラベルが含まれている
+            if target.get("level") == 1 and self.comments_path.exists():
+                self._update_comments_category(updated_cluster)
+
+    def update_config(self, updated_config: ReportConfigUpdate) -> None:
+        """レポートのタイトル・調査概要を更新する"""
+        with _lock:
+            result = self._read()
+            config = result["config"]
+            if updated_config.question is not None:
+                config["question"] = updated_config.question
+            if updated_config.intro is not None:
+                # 集約処理と同じく、分析件数と使用したLLMの説明を付け加える
+                processed_num = min(result.get("comment_num", 0), config["extraction"]["limit"])
+                config["intro"] = build_custom_intro(
+                    {**config, "intro": updated_config.intro},
+                    processed_num=processed_num,
+                    args_count=argument_count(result),
+                )
+            self._write(result)
+
+    def _read(self) -> dict[str, Any]:
+        if not self.result_path.exists():
+            raise ResultFileNotFound(f"File not found: {self.result_path}")
+        try:
+            with open(self.result_path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            slogger.error(f"Error reading JSON file: {e}")
+            raise ResultJSONParseError(f"Error reading JSON file: {e}") from e
+
+    def _write(self, result: dict[str, Any]) -> None:
+        with _atomic_writer(self.result_path) as f:
+            # 読み込んだときと同じ形式で書き出す(コンパクト形式は整形しない)
+            if is_compact(result):
+                json.dump(result, f, ensure_ascii=False, separators=(",", ":"))
+            else:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+
+    def _update_comments_category(self, updated_cluster: ClusterUpdate) -> None:
+        with open(self.comments_path, encoding="utf-8", newline="") as src:
+            reader = csv.DictReader(src)
+            fieldnames = reader.fieldnames or []
+            if "category_id" not in fieldnames or "category" not in fieldnames:
+                return
+            with _atomic_writer(self.comments_path, newline="") as dst:
+                writer = csv.DictWriter(dst, fieldnames=fieldnames)
+                writer.writeheader()
+                for row in reader:
+                    if row["category_id"] == updated_cluster.id:
+                        row["category"] = updated_cluster.label
+                    writer.writerow(row)
+
+
+@contextmanager
+def _atomic_writer(path: Path, newline: str | None = None):
+    """同じディレクトリの一時ファイルに書き込み、書き込みが完了したら置き換える"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline=newline) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
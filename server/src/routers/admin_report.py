@@ -1,29 +1,40 @@
 import json
 import os
+from datetime import datetime
+from typing import Annotated
 
 import openai
-from fastapi import APIRouter, Depends, HTTPException, Query, Security
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Security
 from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.security.api_key import APIKeyHeader
 
 from src.config import settings
-from src.core.exceptions import ClusterCSVParseError, ClusterFileNotFound
+from src.core.exceptions import ClusterCSVParseError, ClusterFileNotFound, ResultRepoError
 from src.repositories.cluster_repository import ClusterRepository
 from src.repositories.config_repository import ConfigRepository
+from src.repositories.result_repository import ResultRepository
 from src.schemas.admin_report import ReportInput, ReportVisibilityUpdate
 from src.schemas.cluster import ClusterResponse, ClusterUpdate
-from src.schemas.report import Report, ReportStatus
+from src.schemas.report import Report, ReportStatus, ReportVisibility
 from src.schemas.report_config import ReportConfigUpdate
 from src.services.llm_models import get_models_by_provider
 from src.services.llm_pricing import LLMPricing
-from src.services.report_launcher import execute_aggregation, launch_report_generation
+from src.services.report_launcher import (
+    execute_aggregation,
+    get_job_state,
+    launch_report_generation,
+    list_active_jobs,
+)
 from src.services.report_status import (
     invalidate_report_cache,
     load_status_as_reports,
+    query_reports,
+    serialize_reports,
     set_status,
     update_report_config,
     update_report_visibility_state,
 )
+from src.services.report_sync import ReportSyncService
 from src.utils.logger import setup_logger
 
 slogger = setup_logger()
@@ -38,9 +49,37 @@ async def verify_admin_api_key(api_key: str = Security(api_key_header)):
     return api_key
 
 
-@router.get("/admin/reports")
-async def get_reports(api_key: str = Depends(verify_admin_api_key)) -> list[Report]:
-    return load_status_as_reports()
+@router.get("/admin/reports", response_model=list[Report])
+async def get_reports(
+    status: Annotated[list[ReportStatus] | None, Query(description="ステータスで絞り込む(複数指定可)")] = None,
+    visibility: Annotated[list[ReportVisibility] | None, Query(description="公開設定で絞り込む(複数指定可)")] = None,
+    created_after: Annotated[datetime | None, Query(description="作成日時がこの日時以降のレポートに絞り込む")] = None,
+    created_before: Annotated[datetime | None, Query(description="作成日時がこの日時以前のレポートに絞り込む")] = None,
+    sort: Annotated[str | None, Query(description="並べ替えるフィールド(例: created_at, -created_at, title)")] = None,
+    fields: Annotated[str | None, Query(description="レスポンスに含めるフィールド(カンマ区切り)")] = None,
+    limit: Annotated[int | None, Query(ge=1, le=1000, description="1ページの件数")] = None,
+    cursor: Annotated[str | None, Query(description="前のページのレスポンスの X-Next-Cursor ヘッダーの値")] = None,
+    api_key: str = Depends(verify_admin_api_key),
+):
+    params = (status, visibility, created_after, created_before, sort, fields, limit, cursor)
+    if all(param is None for param in params):
+        return load_status_as_reports()
+
+    try:
+        page, next_cursor = query_reports(
+            statuses=status,
+            visibilities=visibility,
+            created_after=created_after,
+            created_before=created_before,
+            sort=sort or "created_at",
+            limit=limit,
+            cursor=cursor,
+        )
+        content = serialize_reports(page, fields.split(",") if fields else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(content=content, headers=headers)
 
 
 @router.post("/admin/reports", status_code=202)
@@ -74,6 +113,10 @@ async def download_comments_csv(slug: str, api_key: str = Depends(verify_admin_a
 async def get_current_step(slug: str) -> dict:
     status_file = settings.REPORT_DIR / slug / "hierarchical_status.json"
     try:
+        # ワーカーの空きを待っている場合は job_state: "queued" を返す(current_step は "loading" のまま)
+        if get_job_state(slug) == "queued":
+            return {"current_step": "loading", "job_state": "queued"}
+
         # ステータスファイルが存在しない場合は "loading" を返す
         if not status_file.exists():
             return {"current_step": "loading"}
@@ -86,6 +129,7 @@ async def get_current_step(slug: str) -> dict:
             "token_usage": status.get("total_token_usage", 0),
             "token_usage_input": status.get("token_usage_input", 0),
             "token_usage_output": status.get("token_usage_output", 0),
+            "token_usage_cached_input": status.get("token_usage_cached_input", 0),
             "estimated_cost": status.get("estimated_cost", 0.0),
             "provider": status.get("provider"),
             "model": status.get("model"),
@@ -119,12 +163,33 @@ async def get_current_step(slug: str) -> dict:
             "token_usage": 0,
             "token_usage_input": 0,
             "token_usage_output": 0,
+            "token_usage_cached_input": 0,
             "estimated_cost": 0.0,
             "provider": None,
             "model": None,
         }
 
 
+@router.get("/admin/jobs", dependencies=[Depends(verify_admin_api_key)])
+async def get_jobs() -> list[dict]:
+    """待機中・実行中のレポート生成ジョブを実行する順に返す"""
+    return list_active_jobs()
+
+
+@router.get("/admin/reports/{slug}/trace", dependencies=[Depends(verify_admin_api_key)])
+async def get_report_trace(slug: str) -> dict:
+    """パイプラインの計測結果(ステップごとの実行時間・メモリ・LLMリクエストの統計)を返す"""
+    trace_file = settings.REPORT_DIR / slug / "hierarchical_trace.json"
+    if not trace_file.exists():
+        raise HTTPException(status_code=404, detail="Trace file not found")
+    try:
+        with open(trace_file) as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        slogger.error(f"Error reading trace file for {slug}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to parse trace file") from e
+
+
 @router.delete("/admin/reports/{slug}")
 async def delete_report(slug: str, api_key: str = Depends(verify_admin_api_key)) -> ORJSONResponse:
     try:
@@ -160,9 +225,19 @@ async def update_report_visibility(
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
+def _sync_edited_report_to_storage(slug: str) -> None:
+    """結果ファイルと設定ファイルを直接書き換えた後、ストレージ上のファイルも更新する"""
+    report_sync_service = ReportSyncService()
+    report_sync_service.sync_report_files_to_storage(slug)
+    report_sync_service.sync_config_file_to_storage(slug)
+
+
 @router.patch("/admin/reports/{slug}/config")
 async def update_report_config_endpoint(
-    slug: str, config: ReportConfigUpdate, api_key: str = Depends(verify_admin_api_key)
+    slug: str,
+    config: ReportConfigUpdate,
+    background_tasks: BackgroundTasks,
+    api_key: str = Depends(verify_admin_api_key),
 ) -> dict:
     """レポートのメタデータ（タイトル、説明）を更新するエンドポイント
 
@@ -181,9 +256,15 @@ async def update_report_config_endpoint(
         if not is_updated:
             raise Exception(f"Failed to update config json for {slug}")
 
-        is_aggregation_executed = execute_aggregation(slug)
-        if not is_aggregation_executed:
-            raise Exception(f"Failed to execute aggregation for {slug}")
+        # 結果ファイルのタイトル・調査概要だけを書き換える。書き換えられない場合は集約処理を再実行する
+        try:
+            ResultRepository(slug).update_config(config)
+            background_tasks.add_task(_sync_edited_report_to_storage, slug)
+        except ResultRepoError as e:
+            slogger.warning(f"Falling back to aggregation for {slug}: {e}")
+            is_aggregation_executed = execute_aggregation(slug)
+            if not is_aggregation_executed:
+                raise Exception(f"Failed to execute aggregation for {slug}") from e
 
         # report_status.json を更新
         updated_report = update_report_config(
@@ -220,7 +301,10 @@ async def get_clusters(slug: str, api_key: str = Depends(verify_admin_api_key))
 
 @router.patch("/admin/reports/{slug}/cluster-label")
 async def update_cluster_label(
-    slug: str, updated_cluster: ClusterUpdate, api_key: str = Depends(verify_admin_api_key)
+    slug: str,
+    updated_cluster: ClusterUpdate,
+    background_tasks: BackgroundTasks,
+    api_key: str = Depends(verify_admin_api_key),
 ) -> dict[str, bool]:
     # FIXME: error handlingを共通化するタイミングで、error handlingを切り出す
     # issue: https://github.com/digitaldemocracy2030/kouchou-ai/issues/546
@@ -229,10 +313,15 @@ async def update_cluster_label(
     if not is_csv_updated:
         raise HTTPException(status_code=500, detail="意見グループの更新に失敗しました")
 
-    # aggregation を実行
-    is_aggregation_executed = execute_aggregation(slug)
-    if not is_aggregation_executed:
-        raise HTTPException(status_code=500, detail="意見グループ更新の集計に失敗しました")
+    # 結果ファイルの該当クラスタだけを書き換える。書き換えられない場合は aggregation を実行する
+    try:
+        ResultRepository(slug).update_cluster(updated_cluster)
+        background_tasks.add_task(_sync_edited_report_to_storage, slug)
+    except ResultRepoError as e:
+        slogger.warning(f"Falling back to aggregation for {slug}: {e}")
+        is_aggregation_executed = execute_aggregation(slug)
+        if not is_aggregation_executed:
+            raise HTTPException(status_code=500, detail="意見グループ更新の集計に失敗しました") from e
 
     invalidate_report_cache(slug)
 
@@ -1,12 +1,18 @@
-import json
 import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Security
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, Security
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from fastapi.security.api_key import APIKeyHeader
 
 from src.config import settings
 from src.schemas.report import Report, ReportStatus, ReportVisibility
-from src.services.report_status import load_status_as_reports
+from src.services.report_status import get_report, list_reports_by_status, query_reports, serialize_reports
+from src.services.report_slices import ReportSlices, get_report_slice_index
+from src.services.result_cache import get_result_cache
 
 logger = logging.getLogger("uvicorn")
 
@@ -21,20 +27,40 @@ async def verify_public_api_key(api_key: str = Security(api_key_header)):
     return api_key
 
 
-@router.get("/reports", dependencies=[Depends(verify_public_api_key)])
-async def reports() -> list[Report]:
-    all_reports = load_status_as_reports()
-    ready_reports = [
-        report for report in all_reports if report.status == ReportStatus.READY and report.is_publicly_visible
-    ]
-    return ready_reports
-
-
-@router.get("/reports/{slug}")
-async def report(slug: str, api_key: str = Depends(verify_public_api_key)) -> dict:
+@router.get("/reports", dependencies=[Depends(verify_public_api_key)], response_model=list[Report])
+async def reports(
+    created_after: Annotated[datetime | None, Query(description="作成日時がこの日時以降のレポートに絞り込む")] = None,
+    created_before: Annotated[datetime | None, Query(description="作成日時がこの日時以前のレポートに絞り込む")] = None,
+    sort: Annotated[str | None, Query(description="並べ替えるフィールド(例: created_at, -created_at, title)")] = None,
+    fields: Annotated[str | None, Query(description="レスポンスに含めるフィールド(カンマ区切り)")] = None,
+    limit: Annotated[int | None, Query(ge=1, le=1000, description="1ページの件数")] = None,
+    cursor: Annotated[str | None, Query(description="前のページのレスポンスの X-Next-Cursor ヘッダーの値")] = None,
+):
+    if all(param is None for param in (created_after, created_before, sort, fields, limit, cursor)):
+        ready_reports = list_reports_by_status([ReportStatus.READY])
+        return [report for report in ready_reports if report.is_publicly_visible]
+
+    try:
+        page, next_cursor = query_reports(
+            statuses=[ReportStatus.READY],
+            visibilities=[ReportVisibility.PUBLIC],
+            created_after=created_after,
+            created_before=created_before,
+            sort=sort or "created_at",
+            limit=limit,
+            cursor=cursor,
+        )
+        content = serialize_reports(page, fields.split(",") if fields else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(content=content, headers=headers)
+
+
+def _public_result_path(slug: str) -> tuple[Path, Report]:
+    """公開APIで返してよいレポートの結果ファイルのパスとステータスを返す。返せない場合は404エラーにする"""
     report_path = settings.REPORT_DIR / slug / "hierarchical_result.json"
-    all_reports = load_status_as_reports()
-    target_report_status = next((report for report in all_reports if report.slug == slug), None)
+    target_report_status = get_report(slug)
 
     if target_report_status is None:
         raise HTTPException(status_code=404, detail="Report not found")
@@ -44,14 +70,86 @@ async def report(slug: str, api_key: str = Depends(verify_public_api_key)) -> di
         raise HTTPException(status_code=404, detail="Report is private")
     if not report_path.exists():
         raise HTTPException(status_code=404, detail="Report not found")
+    return report_path, target_report_status
+
 
-    with open(report_path) as f:
-        report_result = json.load(f)
+def _is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
 
-    # レポートにvisibilityを追加
-    report_result["visibility"] = target_report_status.visibility.value
 
-    return report_result
+async def _get_slices(slug: str) -> tuple[ReportSlices, Report, dict[str, str]]:
+    report_path, target_report_status = _public_result_path(slug)
+    slices = await run_in_threadpool(get_report_slice_index().get, report_path)
+    # 公開設定が変わった場合もレスポンスが変わるため、ETagに含める
+    etag = f'{slices.etag[:-1]}-{target_report_status.visibility.value}"'
+    return slices, target_report_status, {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+@router.get("/reports/{slug}")
+async def report(slug: str, request: Request, api_key: str = Depends(verify_public_api_key)) -> Response:
+    report_path, target_report_status = _public_result_path(slug)
+
+    # 結果ファイルが変わっていなければ、シリアライズ・圧縮済みのキャッシュを返す
+    cached = await run_in_threadpool(get_result_cache().get, report_path, target_report_status.visibility.value)
+    headers = {"ETag": cached.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if _is_not_modified(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = cached.encoded(request.headers.get("accept-encoding", ""))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/reports/{slug}/overview")
+async def report_overview(slug: str, request: Request, api_key: str = Depends(verify_public_api_key)) -> Response:
+    """レポートの概要・設定(ソースコードを除く)・件数を返す"""
+    slices, target_report_status, headers = await _get_slices(slug)
+    if _is_not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(
+        content={**slices.overview, "visibility": target_report_status.visibility.value}, headers=headers
+    )
+
+
+@router.get("/reports/{slug}/clusters")
+async def report_clusters(
+    slug: str,
+    request: Request,
+    level: Annotated[int | None, Query(description="クラスタの階層で絞り込む(1が最上位)")] = None,
+    parent: Annotated[str | None, Query(description="親クラスタのIDで絞り込む")] = None,
+    api_key: str = Depends(verify_public_api_key),
+) -> Response:
+    """レポートのクラスタを返す"""
+    slices, _, headers = await _get_slices(slug)
+    if _is_not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content=slices.list_clusters(level=level, parent=parent), headers=headers)
+
+
+@router.get("/reports/{slug}/arguments")
+async def report_arguments(
+    slug: str,
+    request: Request,
+    cluster_id: Annotated[str | None, Query(description="クラスタのIDで絞り込む")] = None,
+    limit: Annotated[int, Query(ge=1, le=1000, description="1ページの件数")] = 100,
+    cursor: Annotated[str | None, Query(description="前のページのレスポンスの X-Next-Cursor ヘッダーの値")] = None,
+    api_key: str = Depends(verify_public_api_key),
+) -> Response:
+    """レポートの意見を1ページ分返す。各意見には属性(propertyMap の該当する値)を properties として付加する"""
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    slices, _, headers = await _get_slices(slug)
+    if _is_not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        page, next_offset = slices.list_arguments(cluster_id=cluster_id, offset=int(cursor or 0), limit=limit)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail="Cluster not found") from e
+    if next_offset is not None:
+        headers["X-Next-Cursor"] = str(next_offset)
+    return ORJSONResponse(content=page, headers=headers)
 
 
 @router.get("/test-error")
@@ -27,6 +27,7 @@ class Report(SchemaBaseModel):
     token_usage: int | None = None  # トークン使用量（合計）
     token_usage_input: int | None = None  # 入力トークン使用量
     token_usage_output: int | None = None  # 出力トークン使用量
+    token_usage_cached_input: int | None = None  # 入力トークンのうちプロンプトキャッシュから読み込まれたもの
     estimated_cost: float | None = None  # 推定コスト（USD）
     provider: str | None = None  # LLMプロバイダー
     model: str | None = None  # LLMモデル
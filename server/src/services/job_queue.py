@@ -0,0 +1,288 @@
+"""レポート生成ジョブの永続キュー
+
+レポート作成や集約の再実行のジョブを SQLite(data/job_queue.sqlite3)に記録し、同時実行数の上限の範囲で
+常駐ワーカー(src/services/pipeline_worker.py)に割り当てる。
+
+- 同時に実行するジョブ数は settings.PIPELINE_WORKERS まで。ただし優先度の高いジョブ(集約の再実行)は
+  settings.PIPELINE_PRIORITY_WORKERS 個の予備のワーカーも使えるため、レポート作成の完了を待たずに実行される
+- settings.PIPELINE_PROVIDER_CONCURRENCY でLLMプロバイダーごとの同時実行数の上限を設定できる
+  (例: {"openai": 2, "openrouter": 1})
+- 待機中のジョブは優先度の高い順、同じ優先度の中では投入順に実行する。上限に達したプロバイダーのジョブは
+  飛ばして、次のジョブを実行する
+- 同じレポートのジョブは同時に実行しない
+- サーバーの再起動時には、実行中だったジョブを待機中に戻して再実行する(パイプラインは完了済みのステップと
+  抽出済みのコメントを再利用して途中から再開する)
+"""
+
+import json
+import sqlite3
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from src.config import settings
+from src.services.pipeline_worker import PipelineWorkerPool
+from src.utils.logger import setup_logger
+
+logger = setup_logger()
+
+PRIORITY_REPORT = 0
+PRIORITY_AGGREGATION = 10
+# 予備のワーカーを使える優先度
+HIGH_PRIORITY = PRIORITY_AGGREGATION
+# サーバーの再起動をまたいで実行し直す回数の上限(ジョブがサーバーごと落としている場合に繰り返さないため)
+MAX_ATTEMPTS = 3
+# 終了したジョブの記録を残す期間
+RETENTION = timedelta(days=7)
+
+
+@dataclass
+class Job:
+    id: int
+    slug: str
+    kind: str
+    argv: list[str]
+    priority: int
+    provider: str | None
+    state: str
+    attempts: int
+    created_at: str
+    started_at: str | None = None
+    finished_at: str | None = None
+    error: str | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "slug": self.slug,
+            "kind": self.kind,
+            "priority": self.priority,
+            "provider": self.provider,
+            "state": self.state,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+def _now() -> str:
+    return datetime.now(UTC).isoformat()
+
+
+class JobQueue:
+    """ジョブの状態(queued / running / succeeded / failed)を SQLite に記録する"""
+
+    _COLUMNS = "id, slug, kind, argv, priority, provider, state, attempts, created_at, started_at, finished_at, error"
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                slug TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                argv TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                provider TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, priority, id)")
+        self._conn.commit()
+
+    def enqueue(self, slug: str, kind: str, argv: list[str], priority: int, provider: str | None) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (slug, kind, argv, priority, provider, state, created_at)"
+                " VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (slug, kind, json.dumps(argv), priority, provider, _now()),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def jobs(self, states: tuple[str, ...] = ("queued", "running")) -> list[Job]:
+        """指定した状態のジョブを実行する順(優先度の高い順、同じ優先度では投入順)に返す"""
+        placeholders = ",".join("?" * len(states))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE state IN ({placeholders}) ORDER BY priority DESC, id",
+                states,
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def mark_running(self, job_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (_now(), job_id),
+            )
+            self._conn.commit()
+
+    def mark_finished(self, job_id: int, error: str | None = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE id = ?",
+                ("failed" if error else "succeeded", _now(), error, job_id),
+            )
+            self._conn.commit()
+
+    def requeue_running(self) -> list[Job]:
+        """実行中のまま残っているジョブを待機中に戻し、戻したジョブを返す(サーバーの起動時に呼ぶ)"""
+        jobs = self.jobs(("running",))
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+            self._conn.commit()
+        return jobs
+
+    def prune(self, older_than: timedelta = RETENTION) -> None:
+        """終了してから一定期間が過ぎたジョブの記録を削除する"""
+        threshold = (datetime.now(UTC) - older_than).isoformat()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE state IN ('succeeded', 'failed') AND finished_at < ?", (threshold,)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_job(row) -> Job:
+        values = list(row)
+        values[3] = json.loads(values[3])
+        return Job(*values)
+
+
+class JobScheduler:
+    """待機中のジョブを同時実行数の上限の範囲でワーカーに割り当てる"""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        pool: PipelineWorkerPool,
+        on_done: Callable[[str, BaseException | None], None],
+        max_jobs: int,
+        priority_slots: int = 0,
+        provider_limits: dict[str, int] | None = None,
+    ):
+        self.queue = queue
+        self.pool = pool
+        self.on_done = on_done
+        self.max_jobs = max_jobs
+        self.priority_slots = priority_slots
+        self.provider_limits = provider_limits or {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, slug: str, kind: str, argv: list[str], priority: int = PRIORITY_REPORT, provider: str | None = None
+    ) -> int:
+        """ジョブをキューに記録し、上限に空きがあればすぐに実行を開始する"""
+        job_id = self.queue.enqueue(slug, kind, argv, priority, provider)
+        logger.info(f"Queued {kind} job {job_id} for {slug} (priority={priority}, provider={provider})")
+        self.dispatch()
+        return job_id
+
+    def recover(self) -> None:
+        """前回のサーバーの終了時に実行中だったジョブを再実行する"""
+        self.queue.prune()
+        for job in self.queue.requeue_running():
+            if job.attempts >= MAX_ATTEMPTS:
+                logger.error(f"Giving up {job.kind} job {job.id} for {job.slug} after {job.attempts} attempts")
+                error = RuntimeError(f"job was interrupted {job.attempts} times")
+                self.queue.mark_finished(job.id, str(error))
+                self.on_done(job.slug, error)
+                continue
+            logger.warning(f"Recovering {job.kind} job {job.id} for {job.slug} interrupted by server restart")
+            _release_pipeline_lock(job.slug)
+        self.dispatch()
+
+    def job_state(self, slug: str) -> str | None:
+        """レポートの最新のジョブの状態(queued / running)を返す。待機中・実行中のジョブがない場合は None"""
+        states = [job.state for job in self.queue.jobs() if job.slug == slug]
+        if "running" in states:
+            return "running"
+        return "queued" if states else None
+
+    def dispatch(self) -> None:
+        """上限に空きがある限り、待機中のジョブを実行順にワーカーへ割り当てる
+
+        ワーカーに投入できなかったジョブは失敗として記録する(実行中のまま残さない)。
+        """
+        failed: list[tuple[str, BaseException]] = []
+        with self._lock:
+            jobs = self.queue.jobs()
+            running = [job for job in jobs if job.state == "running"]
+            for job in jobs:
+                if job.state != "queued" or not self._can_start(job, running):
+                    continue
+                self.queue.mark_running(job.id)
+                logger.info(f"Starting {job.kind} job {job.id} for {job.slug}")
+                try:
+                    self.pool.submit(
+                        job.slug, job.argv, lambda slug, error, job_id=job.id: self._finish(job_id, slug, error)
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to start {job.kind} job {job.id} for {job.slug}: {type(e).__name__}: {e}")
+                    self.queue.mark_finished(job.id, f"{type(e).__name__}: {e}")
+                    failed.append((job.slug, e))
+                    continue
+                running.append(job)
+        # on_done からジョブが投入されることがあるため、ロックを解放してから呼ぶ
+        for slug, error in failed:
+            self.on_done(slug, error)
+
+    def _can_start(self, job: Job, running: list[Job]) -> bool:
+        # 同じレポートのジョブを同時に実行すると、パイプラインのロックで失敗する
+        if any(other.slug == job.slug for other in running):
+            return False
+        limit = self.max_jobs + (self.priority_slots if job.priority >= HIGH_PRIORITY else 0)
+        if len(running) >= limit:
+            return False
+        provider_limit = self.provider_limits.get(job.provider) if job.provider else None
+        if provider_limit is not None:
+            return sum(other.provider == job.provider for other in running) < provider_limit
+        return True
+
+    def _finish(self, job_id: int, slug: str, error: BaseException | None) -> None:
+        self.queue.mark_finished(job_id, f"{type(error).__name__}: {error}" if error is not None else None)
+        try:
+            self.on_done(slug, error)
+        finally:
+            self.dispatch()
+
+
+def _release_pipeline_lock(slug: str) -> None:
+    """中断されたパイプラインのステータスファイルのロックを解除する
+
+    hierarchical_status.json は実行中のステータスで5分間ロックされるため、再起動直後に再実行すると
+    「Job already running」で失敗する。サーバーの再起動でワーカーは終了しているため、ロックを解除してよい。
+    """
+    status_file = settings.REPORT_DIR / slug / "hierarchical_status.json"
+    try:
+        with open(status_file) as f:
+            status = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if status.get("status") != "running":
+        return
+    status["lock_until"] = datetime.now().isoformat()
+    tmp_path = status_file.with_name(status_file.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=2)
+    tmp_path.replace(status_file)
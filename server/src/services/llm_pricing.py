@@ -8,61 +8,72 @@ class LLMPricing:
 
     PRICING: dict[str, dict[str, dict[str, float]]] = {
         "openai": {
-            "gpt-4o-mini": {"input": 0.15, "output": 0.60},
-            "gpt-4o": {"input": 2.50, "output": 10.00},
-            "o3-mini": {"input": 1.10, "output": 4.40},
+            "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+            "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+            "o3-mini": {"input": 1.10, "cached_input": 0.55, "output": 4.40},
         },
         "azure": {
-            "gpt-4o-mini": {"input": 0.15, "output": 0.60},
-            "gpt-4o": {"input": 2.50, "output": 10.00},
-            "o3-mini": {"input": 1.10, "output": 4.40},
+            "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+            "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+            "o3-mini": {"input": 1.10, "cached_input": 0.55, "output": 4.40},
         },
         "openrouter": {
-            "openai/gpt-4o-mini-2024-07-18": {"input": 0.15, "output": 0.60},
-            "openai/gpt-4o-2024-08-06": {"input": 2.50, "output": 10.00},
-            "google/gemini-2.5-pro-preview": {"input": 1.25, "output": 10.00},
+            "openai/gpt-4o-mini-2024-07-18": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+            "openai/gpt-4o-2024-08-06": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+            "google/gemini-2.5-pro-preview": {"input": 1.25, "cached_input": 0.31, "output": 10.00},
         },
     }
 
     DEFAULT_PRICE = {"input": 0, "output": 0}  # 不明なモデルは 0 = 情報なし
 
     @classmethod
-    def calculate_cost(cls, provider: str, model: str, token_usage_input: int, token_usage_output: int) -> float:
+    def calculate_cost(
+        cls,
+        provider: str,
+        model: str,
+        token_usage_input: int,
+        token_usage_output: int,
+        token_usage_cached_input: int = 0,
+    ) -> float:
         """
         トークン使用量から推定コストを計算する
 
         Args:
             provider: LLMプロバイダー名
             model: モデル名
-            token_usage_input: 入力トークン使用量
+            token_usage_input: 入力トークン使用量（プロンプトキャッシュから読み込まれたものを含む）
             token_usage_output: 出力トークン使用量
+            token_usage_cached_input: 入力トークンのうちプロンプトキャッシュから読み込まれたもの
 
         Returns:
             float: 推定コスト（USD）
         """
-        if provider not in cls.PRICING:
-            return cls._calculate_with_price(cls.DEFAULT_PRICE, token_usage_input, token_usage_output)
-
-        if model not in cls.PRICING[provider]:
-            return cls._calculate_with_price(cls.DEFAULT_PRICE, token_usage_input, token_usage_output)
-
-        price = cls.PRICING[provider][model]
-        return cls._calculate_with_price(price, token_usage_input, token_usage_output)
+        if provider not in cls.PRICING or model not in cls.PRICING[provider]:
+            price = cls.DEFAULT_PRICE
+        else:
+            price = cls.PRICING[provider][model]
+        return cls._calculate_with_price(price, token_usage_input, token_usage_output, token_usage_cached_input)
 
     @staticmethod
-    def _calculate_with_price(price: dict[str, float], token_usage_input: int, token_usage_output: int) -> float:
+    def _calculate_with_price(
+        price: dict[str, float], token_usage_input: int, token_usage_output: int, token_usage_cached_input: int = 0
+    ) -> float:
         """
         価格情報とトークン使用量から推定コストを計算する
 
         Args:
-            price: 価格情報（inputとoutputの価格）
+            price: 価格情報（input・outputの価格と、キャッシュされた入力の価格 cached_input）
             token_usage_input: 入力トークン使用量
             token_usage_output: 出力トークン使用量
+            token_usage_cached_input: 入力トークンのうちプロンプトキャッシュから読み込まれたもの
 
         Returns:
             float: 推定コスト（USD）
         """
-        input_cost = (token_usage_input / 1_000_000) * price["input"]
+        # キャッシュされた入力の価格が不明な場合は、通常の入力の価格で計算する
+        cached_input = min(max(token_usage_cached_input, 0), token_usage_input)
+        input_cost = ((token_usage_input - cached_input) / 1_000_000) * price["input"]
+        input_cost += (cached_input / 1_000_000) * price.get("cached_input", price["input"])
         output_cost = (token_usage_output / 1_000_000) * price["output"]
         total_cost = input_cost + output_cost
         return total_cost
@@ -0,0 +1,127 @@
+"""レポート生成パイプラインを実行する常駐ワーカープール
+
+レポートごとに `python hierarchical_main.py` を起動すると、ジョブのたびにインタプリタの起動、
+pandas / scikit-learn / UMAP などの読み込み、ローカル埋め込みモデルの読み込み、LLMクライアントの作成を
+やり直すことになる。ここでは起動済みのワーカープロセスにパイプラインのモジュールを読み込んでおき、
+ジョブ(hierarchical_main.py に渡す引数)をキューで受け渡して実行する。
+
+- ワーカーは spawn で起動する(サーバーのスレッドやソケットを引き継がないようにするため)
+- ジョブの順番や同時実行数の制御は src/services/job_queue.py が行う
+- ワーカープロセス内の埋め込みモデルやLLMクライアントはジョブをまたいで使い回される
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+from collections.abc import Callable
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.config import settings
+from src.utils.logger import setup_logger
+
+logger = setup_logger()
+
+PIPELINE_DIR = settings.TOOL_DIR / "pipeline"
+
+
+def _initialize_worker(pipeline_dir: str, warm_local_embedding: bool) -> None:
+    """ワーカープロセスの起動時に1回だけ実行し、パイプラインのモジュールを読み込んでおく"""
+    # パイプラインの各ステップはカレントディレクトリからの相対パスで入出力するため、サブプロセスと同じ状態にする
+    os.chdir(pipeline_dir)
+    if pipeline_dir not in sys.path:
+        sys.path.insert(0, pipeline_dir)
+    import hierarchical_main  # noqa: F401
+
+    if warm_local_embedding:
+        from services.local_embedding import warm_up
+
+        warm_up()
+
+
+def _run_job(argv: list[str]) -> None:
+    """ワーカープロセスでパイプラインを1回実行する(失敗した場合は例外が呼び出し元に伝わる)"""
+    import hierarchical_main
+
+    hierarchical_main.main(argv)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class PipelineWorkerPool:
+    """パイプラインのジョブを常駐ワーカープロセスで実行する"""
+
+    def __init__(self, max_workers: int, warm_local_embedding: bool = False):
+        self.max_workers = max_workers
+        self.warm_local_embedding = warm_local_embedding
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """ワーカープロセスを起動し、モジュールの読み込みを済ませておく"""
+        with self._lock:
+            executor = self._ensure_executor()
+        # ProcessPoolExecutor はジョブが来るまでプロセスを起動しないため、空のジョブを投入して起動させる
+        for _ in range(self.max_workers):
+            executor.submit(_ping)
+
+    def submit(self, slug: str, argv: list[str], on_done: Callable[[str, BaseException | None], None]) -> Future:
+        """ジョブをワーカーに渡す
+
+        Args:
+            slug: レポートのスラッグ
+            argv: hierarchical_main.py に渡す引数
+            on_done: ジョブの終了後に (slug, 例外 または None) を引数に呼び出す関数
+
+        Raises:
+            プールを作り直してもジョブを投入できなかった場合は、その例外(on_done は呼ばれない)
+        """
+        with self._lock:
+            executor = self._ensure_executor()
+            try:
+                future = executor.submit(_run_job, argv)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # ワーカーが異常終了(メモリ不足など)したり、プールが停止されたりすると投入できなくなるため作り直す。
+                # 作り直したプールにも投入できない場合は例外を呼び出し元に送出する
+                logger.warning(f"Pipeline worker pool is unusable ({type(e).__name__}: {e}); restarting workers")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                executor = self._ensure_executor()
+                future = executor.submit(_run_job, argv)
+        future.add_done_callback(lambda f: self._on_done(slug, f, executor, on_done))
+        return future
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize_worker,
+                initargs=(str(PIPELINE_DIR), self.warm_local_embedding),
+            )
+        return self._executor
+
+    def _on_done(
+        self,
+        slug: str,
+        future: Future,
+        executor: ProcessPoolExecutor,
+        on_done: Callable[[str, BaseException | None], None],
+    ) -> None:
+        error = CancelledError() if future.cancelled() else future.exception()
+        if isinstance(error, BrokenProcessPool):
+            logger.error(f"Pipeline worker terminated abruptly while running {slug}")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+        # 終了後の処理(ストレージへの同期など)でプールの管理スレッドを塞がないよう、別のスレッドで実行する
+        threading.Thread(target=on_done, args=(slug, error), daemon=True).start()
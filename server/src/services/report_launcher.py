@@ -8,6 +8,8 @@ import pandas as pd
 
 from src.config import settings
 from src.schemas.admin_report import ReportInput
+from src.services.job_queue import PRIORITY_AGGREGATION, PRIORITY_REPORT, JobQueue, JobScheduler
+from src.services.pipeline_worker import PipelineWorkerPool
 from src.services.report_status import add_new_report_to_status, set_status, update_token_usage
 from src.services.report_sync import ReportSyncService
 from src.utils.logger import setup_logger
@@ -28,10 +30,12 @@ def _build_config(report_input: ReportInput) -> dict[str, Any]:
         "is_pubcom": report_input.is_pubcom,
         "is_embedded_at_local": report_input.is_embedded_at_local,
         "local_llm_address": report_input.local_llm_address,
+        "use_llm_cache": report_input.use_llm_cache,
         "extraction": {
             "prompt": report_input.prompt.extraction,
             "workers": report_input.workers,
             "limit": comment_num,
+            "packing": report_input.pack_extraction,
         },
         "hierarchical_clustering": {
             "cluster_nums": report_input.cluster,
@@ -97,16 +101,15 @@ def save_input_file(report_input: ReportInput) -> Path:
     return input_path
 
 
-def _monitor_process(process: subprocess.Popen, slug: str) -> None:
+def _finalize_report(slug: str, succeeded: bool) -> None:
     """
-    サブプロセスの実行を監視し、完了時にステータスを更新する
+    パイプラインの終了後にステータスを更新し、成功した場合はファイルをストレージに同期する
 
     Args:
-        process: 監視対象のサブプロセス
         slug: レポートのスラッグ
+        succeeded: パイプラインが成功したかどうか
     """
-    retcode = process.wait()
-    if retcode == 0:
+    if succeeded:
         # レポート生成成功時、ステータスを更新
         try:
             status_file = settings.REPORT_DIR / slug / "hierarchical_status.json"
@@ -116,6 +119,7 @@ def _monitor_process(process: subprocess.Popen, slug: str) -> None:
                     total_token_usage = status_data.get("total_token_usage", 0)
                     token_usage_input = status_data.get("token_usage_input", 0)
                     token_usage_output = status_data.get("token_usage_output", 0)
+                    token_usage_cached_input = status_data.get("token_usage_cached_input", 0)
 
                     config_file = settings.CONFIG_DIR / f"{slug}.json"
                     provider = None
@@ -130,7 +134,13 @@ def _monitor_process(process: subprocess.Popen, slug: str) -> None:
                         f"Found token usage in status file for {slug}: total={total_token_usage}, input={token_usage_input}, output={token_usage_output}, provider={provider}, model={model}"
                     )
                     update_token_usage(
-                        slug, total_token_usage, token_usage_input, token_usage_output, provider or None, model or None
+                        slug,
+                        total_token_usage,
+                        token_usage_input,
+                        token_usage_output,
+                        provider or None,
+                        model or None,
+                        token_usage_cached_input,
                     )
         except Exception as e:
             logger.error(f"Error updating token usage for {slug}: {e}")
@@ -152,18 +162,119 @@ def _monitor_process(process: subprocess.Popen, slug: str) -> None:
         set_status(slug, "error")
 
 
+def _monitor_process(process: subprocess.Popen, slug: str) -> None:
+    """
+    サブプロセスの実行を監視し、完了時にステータスを更新する
+
+    Args:
+        process: 監視対象のサブプロセス
+        slug: レポートのスラッグ
+    """
+    retcode = process.wait()
+    _finalize_report(slug, retcode == 0)
+
+
+def _on_job_done(slug: str, error: BaseException | None) -> None:
+    """常駐ワーカーでのジョブの終了時にステータスを更新する"""
+    if error is not None:
+        logger.error(f"Pipeline failed for {slug}: {type(error).__name__}: {error}")
+    _finalize_report(slug, error is None)
+
+
+_scheduler: JobScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler() -> JobScheduler | None:
+    """レポート生成ジョブのスケジューラを返す(PIPELINE_WORKERS が 0 の場合は None)"""
+    global _scheduler
+    if settings.PIPELINE_WORKERS <= 0:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            pool = PipelineWorkerPool(
+                settings.PIPELINE_WORKERS + settings.PIPELINE_PRIORITY_WORKERS,
+                settings.PIPELINE_WARM_LOCAL_EMBEDDING,
+            )
+            _scheduler = JobScheduler(
+                JobQueue(settings.DATA_DIR / "job_queue.sqlite3"),
+                pool,
+                _on_job_done,
+                max_jobs=settings.PIPELINE_WORKERS,
+                priority_slots=settings.PIPELINE_PRIORITY_WORKERS,
+                provider_limits=settings.PIPELINE_PROVIDER_CONCURRENCY,
+            )
+        return _scheduler
+
+
+def start_job_scheduler() -> None:
+    """サーバーの起動時にワーカーを起動し、前回の終了時に実行中だったジョブを再開する"""
+    scheduler = get_job_scheduler()
+    if scheduler is not None:
+        logger.info(f"Starting {scheduler.pool.max_workers} pipeline workers")
+        scheduler.pool.start()
+        scheduler.recover()
+
+
+def shutdown_job_scheduler() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.pool.shutdown()
+            _scheduler.queue.close()
+            _scheduler = None
+
+
+def _start_pipeline(
+    slug: str, kind: str, args: list[str], priority: int = PRIORITY_REPORT, provider: str | None = None
+) -> None:
+    """
+    パイプラインのジョブをキューに投入する。ワーカーを使わない設定(PIPELINE_WORKERS=0)の場合は
+    hierarchical_main.py をサブプロセスとしてすぐに起動する
+
+    Args:
+        slug: レポートのスラッグ
+        kind: ジョブの種類(report / aggregation)
+        args: hierarchical_main.py に渡す引数
+        priority: 優先度(大きいほど先に実行する)
+        provider: ジョブが使うLLMプロバイダー(プロバイダーごとの同時実行数の上限に使う)
+    """
+    scheduler = get_job_scheduler()
+    if scheduler is not None:
+        scheduler.submit(slug, kind, args, priority=priority, provider=provider)
+        return
+    cmd = ["python", "hierarchical_main.py", *args]
+    execution_dir = settings.TOOL_DIR / "pipeline"
+    process = subprocess.Popen(cmd, cwd=execution_dir)
+    threading.Thread(target=_monitor_process, args=(process, slug), daemon=True).start()
+
+
+def get_job_state(slug: str) -> str | None:
+    """レポートのジョブの状態(queued / running)を返す。待機中・実行中のジョブがない場合は None"""
+    scheduler = get_job_scheduler()
+    return scheduler.job_state(slug) if scheduler is not None else None
+
+
+def list_active_jobs() -> list[dict]:
+    """待機中・実行中のジョブを実行する順に返す"""
+    scheduler = get_job_scheduler()
+    return [job.to_dict() for job in scheduler.queue.jobs()] if scheduler is not None else []
+
+
 def launch_report_generation(report_input: ReportInput) -> None:
     """
-    外部ツールの main.py を subprocess で呼び出してレポート生成処理を開始する関数。
+    レポート生成処理(hierarchical_main.py)をジョブキューに投入する関数。
     """
     try:
         add_new_report_to_status(report_input)
         config_path = save_config_file(report_input)
         save_input_file(report_input)
-        cmd = ["python", "hierarchical_main.py", config_path, "--skip-interaction", "--without-html"]
-        execution_dir = settings.TOOL_DIR / "pipeline"
-        process = subprocess.Popen(cmd, cwd=execution_dir)
-        threading.Thread(target=_monitor_process, args=(process, report_input.input), daemon=True).start()
+        _start_pipeline(
+            report_input.input,
+            "report",
+            [str(config_path), "--skip-interaction", "--without-html"],
+            provider=report_input.provider,
+        )
     except Exception as e:
         set_status(report_input.input, "error")
         logger.error(f"Error launching report generation: {e}")
@@ -176,18 +287,13 @@ def execute_aggregation(slug: str) -> bool:
     """
     try:
         config_path = settings.CONFIG_DIR / f"{slug}.json"
-        cmd = [
-            "python",
-            "hierarchical_main.py",
-            config_path,
-            "--skip-interaction",
-            "--without-html",
-            "-o",
-            "hierarchical_aggregation",
-        ]
-        execution_dir = settings.TOOL_DIR / "pipeline"
-        process = subprocess.Popen(cmd, cwd=execution_dir)
-        threading.Thread(target=_monitor_process, args=(process, slug), daemon=True).start()
+        # 集約のみの再実行は短時間で終わるため、待機中のレポート作成より先に実行する
+        _start_pipeline(
+            slug,
+            "aggregation",
+            [str(config_path), "--skip-interaction", "--without-html", "-o", "hierarchical_aggregation"],
+            priority=PRIORITY_AGGREGATION,
+        )
         return True
     except Exception as e:
         logger.error(f"Error executing aggregation: {e}")
@@ -0,0 +1,174 @@
+"""公開レポートAPI向けの結果ファイルの部分取得
+
+hierarchical_result.json にはすべての意見(座標・属性・URL)、propertyMap、設定(各ステップの source_code を含む)が
+含まれており、レポートの概要や上位のクラスタを表示するだけでも全体をダウンロードする必要があった。
+結果ファイルを一度読み込んで、概要・クラスタ・クラスタごとの意見の索引を作っておき、必要な部分だけを返す。
+
+- 索引はファイルの更新日時・サイズが変わったときだけ作り直す
+- 索引はレポート MAX_ENTRIES 件分までメモリに保持し、古いものから破棄する
+"""
+
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from broadlistening.pipeline.services.result_format import expand_result
+
+# メモリに保持する索引の数
+MAX_ENTRIES = 16
+# 概要のレスポンスに含めない設定の項目(ステップのソースコードやパイプラインの実行記録)
+_OMITTED_CONFIG_KEYS = {"source_code", "plan", "completed_jobs", "previously_completed_jobs"}
+
+
+@dataclass
+class ReportSlices:
+    # 索引が有効かどうかの判定に使う (更新日時, サイズ)
+    version: tuple[int, int]
+    overview: dict[str, Any]
+    clusters: list[dict[str, Any]]
+    arguments: list[dict[str, Any]]
+    property_map: dict[str, dict[str, Any]]
+    # クラスタのIDから、そのクラスタに属する意見の arguments 内の位置
+    arguments_by_cluster: dict[str, list[int]] = field(default_factory=dict)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version[0]:x}-{self.version[1]:x}"'
+
+    def list_clusters(self, level: int | None = None, parent: str | None = None) -> list[dict[str, Any]]:
+        return [
+            cluster
+            for cluster in self.clusters
+            if (level is None or cluster.get("level") == level) and (parent is None or cluster.get("parent") == parent)
+        ]
+
+    def list_arguments(
+        self, cluster_id: str | None = None, offset: int = 0, limit: int = 100
+    ) -> tuple[list[dict[str, Any]], int | None]:
+        """意見を1ページ分返す。各意見には propertyMap のうちその意見の属性を properties として付加する
+
+        Returns:
+            (意見のリスト, 次のページの開始位置。次のページがない場合は None)
+
+        Raises:
+            KeyError: 存在しないクラスタを指定した場合
+        """
+        if cluster_id is None:
+            positions: range | list[int] = range(len(self.arguments))
+        elif cluster_id in self.arguments_by_cluster:
+            positions = self.arguments_by_cluster[cluster_id]
+        else:
+            raise KeyError(cluster_id)
+
+        page = []
+        for position in positions[offset : offset + limit]:
+            argument = self.arguments[position]
+            properties = {name: values.get(argument.get("arg_id")) for name, values in self.property_map.items()}
+            page.append({**argument, "properties": properties})
+        next_offset = offset + limit
+        return page, next_offset if next_offset < len(positions) else None
+
+
+def build_slices(result: dict[str, Any], version: tuple[int, int] = (0, 0)) -> ReportSlices:
+    """結果ファイルの内容から索引を作る(コンパクト形式の場合は従来の形式に戻してから作る)"""
+    result = expand_result(result)
+    arguments = result.get("arguments", [])
+    clusters = result.get("clusters", [])
+    arguments_by_cluster: dict[str, list[int]] = defaultdict(list)
+    for position, argument in enumerate(arguments):
+        for cluster_id in argument.get("cluster_ids", []):
+            arguments_by_cluster[cluster_id].append(position)
+
+    overview = {
+        "overview": result.get("overview", ""),
+        "config": _strip_config(result.get("config", {})),
+        "comment_num": result.get("comment_num"),
+        "argument_num": len(arguments),
+        "cluster_num": {str(level): count for level, count in _count_levels(clusters).items()},
+        "translations": result.get("translations", {}),
+        "properties": list(result.get("propertyMap", {}).keys()),
+    }
+    return ReportSlices(
+        version=version,
+        overview=overview,
+        clusters=clusters,
+        arguments=arguments,
+        property_map=result.get("propertyMap", {}),
+        arguments_by_cluster=dict(arguments_by_cluster),
+    )
+
+
+def _strip_config(config: dict[str, Any]) -> dict[str, Any]:
+    return {
+        key: _strip_config(value) if isinstance(value, dict) else value
+        for key, value in config.items()
+        if key not in _OMITTED_CONFIG_KEYS
+    }
+
+
+def _count_levels(clusters: list[dict[str, Any]]) -> dict[int, int]:
+    counts: dict[int, int] = defaultdict(int)
+    for cluster in clusters:
+        counts[cluster.get("level", 0)] += 1
+    return dict(sorted(counts.items()))
+
+
+class ReportSliceIndex:
+    """結果ファイルのパスをキーとした索引のLRUキャッシュ"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, ReportSlices] = OrderedDict()
+        self._lock = threading.Lock()
+        # 同じファイルを複数のリクエストで同時に読み込まないよう、ファイルごとに読み込みを直列化する
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def get(self, path: Path) -> ReportSlices:
+        key = str(path)
+        stat = path.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self._lookup(key, version)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            entry = self._lookup(key, version)
+            if entry is not None:
+                return entry
+            entry = build_slices(orjson.loads(path.read_bytes()), version)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key: str, version: tuple[int, int]) -> ReportSlices | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+
+_index: ReportSliceIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_report_slice_index() -> ReportSliceIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ReportSliceIndex()
+        return _index
@@ -1,7 +1,21 @@
+"""レポートのステータス(report_status.json)の管理
+
+サーバーの起動後はメモリ上のステータスを正とし、スラッグとステータスの索引を使って参照する。
+変更はすぐにはファイルに書き出さず、短い間隔(FLUSH_DELAY_SECONDS)の変更をまとめてバックグラウンドで
+書き出す(一時ファイルに書き出してから置き換えるため、書き込み途中のファイルが読まれることはない)。
+ストレージへの同期などファイルの内容が必要な場合は flush_status() で書き出しを待つ。
+"""
+
+import atexit
+import base64
 import json
 import logging
+import os
 import threading
+import time
+from collections.abc import Iterable
 from datetime import UTC, datetime
+from typing import Any
 
 import requests
 
@@ -15,8 +29,17 @@ from src.services.llm_pricing import LLMPricing
 logger = logging.getLogger("uvicorn")
 
 STATE_FILE = settings.DATA_DIR / "report_status.json"
+# 変更をまとめてファイルに書き出すまでの待ち時間(秒)
+FLUSH_DELAY_SECONDS = 0.5
+# 一覧の並べ替えに使えるフィールド
+SORTABLE_FIELDS = ("created_at", "title", "slug", "status", "visibility", "token_usage", "estimated_cost")
+
 _lock = threading.RLock()
 _report_status = {}
+_loaded = False
+# _report_status から作る索引(_lock を持って更新する)
+_reports: dict[str, Report] = {}  # スラッグごとの Report モデル(変更されたレポートだけ作り直す)
+_slugs_by_status: dict[str, set[str]] = {}
 
 
 # FIXME: report_status.jsonのフォーマット変更に対応するためのコード。広聴AIをver3.0にした段階で削除する。
@@ -35,47 +58,236 @@ def convert_old_format_status(status: dict) -> dict:
     return status
 
 
+class _StatusWriter:
+    """ステータスの変更をまとめてファイルに書き出すバックグラウンドのスレッド"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._dirty = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+
+    def mark_dirty(self) -> None:
+        self._dirty.set()
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="report-status-writer", daemon=True)
+                self._thread.start()
+
+    def flush(self) -> None:
+        """書き出していない変更があれば、すぐに書き出す"""
+        with self._write_lock:
+            if self._dirty.is_set():
+                self._dirty.clear()
+                self._write()
+
+    def _run(self) -> None:
+        while True:
+            self._dirty.wait()
+            # 続けて行われる変更を1回の書き出しにまとめる
+            time.sleep(self.delay)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write report status: {e}")
+                self._dirty.set()
+
+    def _write(self) -> None:
+        with _lock:
+            content = json.dumps(_report_status, indent=4, ensure_ascii=False)
+        # ディレクトリが存在しない場合は作成
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, STATE_FILE)
+
+
+_writer = _StatusWriter(FLUSH_DELAY_SECONDS)
+atexit.register(lambda: _writer.flush())
+
+
+def _reindex(slug: str) -> None:
+    """レポートの索引を更新する(_lock を持って呼ぶ)"""
+    _reports.pop(slug, None)
+    for slugs in _slugs_by_status.values():
+        slugs.discard(slug)
+    if slug in _report_status:
+        _slugs_by_status.setdefault(_report_status[slug].get("status"), set()).add(slug)
+
+
+def _ensure_loaded() -> None:
+    if not _loaded:
+        load_status()
+
+
 def load_status() -> None:
-    global _report_status
-    try:
-        with open(STATE_FILE) as f:
-            _report_status = convert_old_format_status(json.load(f))
-    except FileNotFoundError:
-        _report_status = {}
-    except json.JSONDecodeError:
-        _report_status = {}
+    """ファイルからステータスを読み込み、索引を作り直す(サーバーの起動時に呼ぶ)"""
+    global _report_status, _loaded
+    with _lock:
+        try:
+            with open(STATE_FILE) as f:
+                _report_status = convert_old_format_status(json.load(f))
+        except FileNotFoundError:
+            _report_status = {}
+        except json.JSONDecodeError:
+            _report_status = {}
+        _reports.clear()
+        _slugs_by_status.clear()
+        for slug in _report_status:
+            _reindex(slug)
+        _loaded = True
+
+
+def get_report(slug: str) -> Report | None:
+    """スラッグに対応するレポートを返す。存在しない場合は None"""
+    with _lock:
+        _ensure_loaded()
+        if slug not in _report_status:
+            return None
+        if slug not in _reports:
+            _reports[slug] = Report(**_report_status[slug])
+        return _reports[slug]
+
+
+def list_reports_by_status(statuses: Iterable[ReportStatus]) -> list[Report]:
+    """指定したステータスのレポートを返す"""
+    with _lock:
+        _ensure_loaded()
+        slugs = set().union(*(_slugs_by_status.get(status.value, set()) for status in statuses))
+        return [get_report(slug) for slug in _report_status if slug in slugs]
 
 
 def load_status_as_reports(include_deleted: bool = False) -> list[Report]:
-    global _report_status
+    with _lock:
+        _ensure_loaded()
+        deleted = set() if include_deleted else _slugs_by_status.get(ReportStatus.DELETED.value, set())
+        return [get_report(slug) for slug in _report_status if slug not in deleted]
+
+
+def _sort_key(report: Report, field: str) -> tuple:
+    value = getattr(report, field)
+    if isinstance(value, ReportStatus | ReportVisibility):
+        value = value.value
+    # 値のないレポートは先頭に並べる
+    return (value is not None, value if value is not None else 0, report.slug)
+
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
     try:
-        with open(STATE_FILE) as f:
-            _report_status = convert_old_format_status(json.load(f))
-    except FileNotFoundError:
-        _report_status = {}
-    except json.JSONDecodeError:
-        _report_status = {}
+        has_value, value, slug = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return (has_value, value, slug)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # タイムゾーンのない日時はUTCとみなす
+    return value if value.tzinfo else value.replace(tzinfo=UTC)
 
-    reports = [Report(**report) for report in _report_status.values()]
 
-    if not include_deleted:
-        reports = [report for report in reports if report.status != ReportStatus.DELETED]
+def _created_at(report: Report) -> datetime | None:
+    if not report.created_at:
+        return None
+    return _as_utc(datetime.fromisoformat(report.created_at))
 
-    return reports
+
+def query_reports(
+    statuses: Iterable[ReportStatus] | None = None,
+    visibilities: Iterable[ReportVisibility] | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    sort: str = "created_at",
+    limit: int | None = None,
+    cursor: str | None = None,
+) -> tuple[list[Report], str | None]:
+    """条件に合うレポートを並べ替えて1ページ分返す
+
+    Args:
+        statuses: ステータスの絞り込み(省略した場合は削除済み以外)
+        visibilities: 公開設定の絞り込み
+        created_after: 作成日時の下限
+        created_before: 作成日時の上限
+        sort: 並べ替えるフィールド(先頭に "-" を付けると降順)
+        limit: 1ページの件数(省略した場合はすべて)
+        cursor: 前のページの最後のレポートを表すカーソル
+
+    Returns:
+        (レポートのリスト, 次のページのカーソル。次のページがない場合は None)
+
+    Raises:
+        ValueError: 並べ替えのフィールドやカーソルが不正な場合
+    """
+    descending = sort.startswith("-")
+    field = sort.removeprefix("-")
+    if field not in SORTABLE_FIELDS:
+        raise ValueError(f"Unknown sort field: {field}")
+    after_key = _decode_cursor(cursor) if cursor else None
+
+    if statuses is None:
+        statuses = [status for status in ReportStatus if status != ReportStatus.DELETED]
+    reports = list_reports_by_status(statuses)
+    if visibilities is not None:
+        visibilities = set(visibilities)
+        reports = [report for report in reports if report.visibility in visibilities]
+    if created_after is not None or created_before is not None:
+        created_after = _as_utc(created_after) if created_after is not None else None
+        created_before = _as_utc(created_before) if created_before is not None else None
+        reports = [
+            report
+            for report in reports
+            if (created_at := _created_at(report)) is not None
+            and (created_after is None or created_at >= created_after)
+            and (created_before is None or created_at <= created_before)
+        ]
+
+    keyed = [(_sort_key(report, field), report) for report in reports]
+    if after_key is not None:
+        keyed = [item for item in keyed if (item[0] < after_key if descending else item[0] > after_key)]
+    keyed.sort(key=lambda item: item[0], reverse=descending)
+
+    if limit is None or len(keyed) <= limit:
+        return [report for _, report in keyed], None
+    page = keyed[:limit]
+    return [report for _, report in page], _encode_cursor(page[-1][0])
+
+
+def serialize_reports(reports: Iterable[Report], fields: Iterable[str] | None = None) -> list[dict[str, Any]]:
+    """レポートをレスポンスの形式(キャメルケース)に変換する。fields を指定した場合はそのフィールドだけを含める
+
+    Raises:
+        ValueError: 存在しないフィールドを指定した場合
+    """
+    include = None
+    if fields is not None:
+        names = {name: name for name in Report.model_fields}
+        names.update({info.alias: name for name, info in Report.model_fields.items() if info.alias})
+        fields = [field.strip() for field in fields if field.strip()]
+        unknown = [field for field in fields if field not in names]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        include = {names[field] for field in fields}
+    return [report.model_dump(mode="json", by_alias=True, include=include) for report in reports]
 
 
 def save_status() -> None:
-    with _lock:
-        # ディレクトリが存在しない場合は作成
-        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    """ステータスの変更をファイルに書き出す(まとめてバックグラウンドで書き出す)"""
+    _writer.mark_dirty()
+
 
-        # ローカルに保存
-        with open(STATE_FILE, "w") as f:
-            json.dump(_report_status, f, indent=4, ensure_ascii=False)
+def flush_status() -> None:
+    """書き出していないステータスの変更をすぐにファイルに書き出す"""
+    _writer.flush()
 
 
 def add_new_report_to_status(report_input: ReportInput) -> None:
     with _lock:
+        _ensure_loaded()
         _report_status[report_input.input] = {
             "slug": report_input.input,
             "status": "processing",
@@ -87,23 +299,28 @@ def add_new_report_to_status(report_input: ReportInput) -> None:
             "token_usage": 0,  # トークン使用量を初期化
             "token_usage_input": 0,  # 入力トークン使用量を初期化
             "token_usage_output": 0,  # 出力トークン使用量を初期化
+            "token_usage_cached_input": 0,  # プロンプトキャッシュから読み込まれた入力トークン数を初期化
             "estimated_cost": 0.0,  # 推定コストを初期化
             "provider": None,  # LLMプロバイダーを初期化
             "model": None,  # LLMモデルを初期化
         }
+        _reindex(report_input.input)
         save_status()
 
 
 def set_status(slug: str, status: str) -> None:
     with _lock:
+        _ensure_loaded()
         if slug not in _report_status:
             raise ValueError(f"slug {slug} not found in report status")
         _report_status[slug]["status"] = status
+        _reindex(slug)
         save_status()
 
 
 def get_status(slug: str) -> str:
     with _lock:
+        _ensure_loaded()
         return _report_status.get(slug, {}).get("status", "undefined")
 
 
@@ -135,10 +352,12 @@ def invalidate_report_cache(slug: str) -> None:
 
 def update_report_visibility_state(slug: str, new_visibility: ReportVisibility) -> str:
     with _lock:
+        _ensure_loaded()
         if slug not in _report_status:
             raise ValueError(f"slug {slug} not found in report status")
         # enumの値を文字列に変換して保存
         _report_status[slug]["visibility"] = new_visibility.value
+        _reindex(slug)
 
         save_status()
     invalidate_report_cache(slug)
@@ -152,6 +371,7 @@ def update_token_usage(
     token_usage_output: int | None = None,
     provider: str | None = None,
     model: str | None = None,
+    token_usage_cached_input: int | None = None,
 ) -> None:
     """レポートのトークン使用量と推定コストを更新する
 
@@ -162,11 +382,13 @@ def update_token_usage(
         token_usage_output: 出力トークン使用量（オプション）
         provider: LLMプロバイダー名（オプション）
         model: モデル名（オプション）
+        token_usage_cached_input: 入力トークンのうちプロンプトキャッシュから読み込まれたもの（オプション）
 
     Raises:
         ValueError: 指定されたスラッグのレポートが存在しない場合
     """
     with _lock:
+        _ensure_loaded()
         if slug not in _report_status:
             logger.warning(f"slug {slug} not found in report status when updating token usage")
             return
@@ -179,6 +401,9 @@ def update_token_usage(
         if token_usage_output is not None:
             _report_status[slug]["token_usage_output"] = token_usage_output
 
+        if token_usage_cached_input is not None:
+            _report_status[slug]["token_usage_cached_input"] = token_usage_cached_input
+
         if provider is not None:
             _report_status[slug]["provider"] = provider
             logger.info(f"Updated provider for {slug}: {provider}")
@@ -193,13 +418,16 @@ def update_token_usage(
             and provider is not None
             and model is not None
         ):
-            estimated_cost = LLMPricing.calculate_cost(provider, model, token_usage_input, token_usage_output)
+            estimated_cost = LLMPricing.calculate_cost(
+                provider, model, token_usage_input, token_usage_output, token_usage_cached_input or 0
+            )
             _report_status[slug]["estimated_cost"] = estimated_cost
             logger.info(f"Updated estimated cost for {slug}: ${estimated_cost:.4f}")
 
         logger.info(
             f"Updated token usage for {slug} in report status: total={token_usage}, input={token_usage_input}, output={token_usage_output}"
         )
+        _reindex(slug)
         save_status()
 
 
@@ -218,6 +446,7 @@ def update_report_config(slug: str, updated_config: ReportConfigUpdate) -> dict:
         ValueError: 指定されたスラッグのレポートが存在しない場合
     """
     with _lock:
+        _ensure_loaded()
         if slug not in _report_status:
             raise ValueError(f"slug {slug} not found in report status")
 
@@ -228,6 +457,7 @@ def update_report_config(slug: str, updated_config: ReportConfigUpdate) -> dict:
         # 説明の更新（指定された場合のみ）
         if updated_config.intro is not None:
             _report_status[slug]["description"] = updated_config.intro
+        _reindex(slug)
 
         save_status()
 
@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 
 from src.config import settings
+from src.services.report_status import flush_status
 from src.services.storage import get_storage_service
 from src.utils.logger import setup_logger
 
@@ -31,6 +32,8 @@ class ReportSyncService:
 
     def sync_status_file_to_storage(self) -> None:
         """ステータスファイルをストレージにアップロードする"""
+        # 書き出していないステータスの変更を反映してからアップロードする
+        flush_status()
         if not self.LOCAL_STATUS_FILE_PATH.exists():
             logger.warning(f"Status file does not exist: {self.LOCAL_STATUS_FILE_PATH}")
             return
@@ -0,0 +1,140 @@
+"""公開レポートAPI向けの結果ファイルのキャッシュ
+
+hierarchical_result.json は数十MBになることがあり、レポートを再生成・編集したときにしか変わらない。
+読み込んで JSON として返すまでの結果(ORJSONでシリアライズしたバイト列と、その gzip / brotli 圧縮版)を
+プロセス内のLRUキャッシュに保持し、ファイルの更新日時・サイズが変わったときだけ読み込み直す。
+
+- キャッシュの合計サイズの上限は settings.REPORT_CACHE_MAX_BYTES(バイト数)
+- brotli 圧縮版は brotli パッケージがインストールされている場合のみ作成する
+- コンパクト形式の結果ファイルは、クライアントが前提にしている従来の形式に戻して返す
+- 公開APIのため、各ステップのプロンプト・ソースコードや実行記録(hierarchical_provenance.json に分けるもの)は
+  設定から除いて返す。従来の形式の結果ファイルも同じく除く
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import orjson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from broadlistening.pipeline.services.result_format import expand_result, split_provenance
+from src.config import settings
+
+
+@dataclass
+class CachedResult:
+    # キャッシュが有効かどうかの判定に使う (更新日時, サイズ, 付加した公開設定)
+    version: tuple[int, int, str]
+    body: bytes
+    gzip: bytes
+    brotli: bytes | None
+    etag: str
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body) + len(self.gzip) + len(self.brotli or b"")
+
+    def encoded(self, accept_encoding: str) -> tuple[bytes, str | None]:
+        """Accept-Encoding に応じて (本文, Content-Encoding) を返す"""
+        encodings = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        if self.brotli is not None and "br" in encodings:
+            return self.brotli, "br"
+        if "gzip" in encodings:
+            return self.gzip, "gzip"
+        return self.body, None
+
+
+class ResultCache:
+    """結果ファイルのパスをキーとしたLRUキャッシュ"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # 同じファイルを複数のリクエストで同時に読み込まないよう、ファイルごとに読み込みを直列化する
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def get(self, path: Path, visibility: str) -> CachedResult:
+        """結果ファイルに visibility を付加したレスポンスを返す(ファイルが変わっていなければキャッシュから返す)"""
+        key = str(path)
+        stat = path.stat()
+        version = (stat.st_mtime_ns, stat.st_size, visibility)
+        entry = self._lookup(key, version)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            # 待っている間に他のリクエストが読み込んでいればそれを使う
+            entry = self._lookup(key, version)
+            if entry is not None:
+                return entry
+            entry = self._load(path, version)
+            self._store(key, entry)
+            return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _lookup(self, key: str, version: tuple[int, int, str]) -> CachedResult | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def _load(self, path: Path, version: tuple[int, int, str]) -> CachedResult:
+        result = expand_result(orjson.loads(path.read_bytes()))
+        if "config" in result:
+            result["config"], _ = split_provenance(result["config"])
+        # レポートにvisibilityを追加
+        result["visibility"] = version[2]
+        body = orjson.dumps(result)
+        return CachedResult(
+            version=version,
+            body=body,
+            gzip=gzip.compress(body, compresslevel=6),
+            brotli=brotli.compress(body, quality=5) if brotli is not None else None,
+            etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+        )
+
+    def _store(self, key: str, entry: CachedResult) -> None:
+        with self._lock:
+            self.stats["misses"] += 1
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._total_bytes += entry.nbytes
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+
+
+_cache: ResultCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(settings.REPORT_CACHE_MAX_BYTES)
+        return _cache
@@ -32,6 +32,24 @@ def use_test_settings(test_settings):
             yield test_settings
 
 
+@pytest.fixture(autouse=True)
+def disable_llm_cache(monkeypatch):
+    """LLMのレスポンスのキャッシュ(pipeline/cache)をテストで読み書きしないようにするフィクスチャ"""
+    from broadlistening.pipeline.services import llm_cache
+
+    monkeypatch.setattr(llm_cache, "_enabled", False)
+
+
+@pytest.fixture(autouse=True)
+def reset_llm_scheduler():
+    """テストごとにLLMリクエストスケジューラを停止し、スレッドを残さないようにするフィクスチャ"""
+    from broadlistening.pipeline.services.llm_scheduler import reset_scheduler
+
+    reset_scheduler()
+    yield
+    reset_scheduler()
+
+
 @pytest.fixture
 def temp_report_dir():
     """テスト用の一時レポートディレクトリを提供するフィクスチャ"""
@@ -9,7 +9,7 @@ from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from src.routers.admin_report import router, verify_admin_api_key
-from src.schemas.report import ReportVisibility
+from src.schemas.report import Report, ReportStatus, ReportVisibility
 
 
 @pytest.fixture
@@ -66,6 +66,43 @@ def client(app):
     return TestClient(app)
 
 
+class TestGetReports:
+    """get_reportsエンドポイントのテスト"""
+
+    def test_get_reports_with_pagination_and_fields(self, client):
+        """クエリパラメータを指定すると、絞り込み・ページ分割・フィールドの選択をしたレスポンスを返す"""
+        report = Report(
+            slug="test-slug",
+            title="テストタイトル",
+            description="テスト説明",
+            status=ReportStatus.READY,
+            visibility=ReportVisibility.UNLISTED,
+        )
+        with patch("src.routers.admin_report.query_reports") as mock_query:
+            mock_query.return_value = ([report], "next-cursor")
+            response = client.get(
+                "/admin/reports",
+                params={"status": "ready", "sort": "-created_at", "fields": "slug,title", "limit": 1},
+                headers={"x-api-key": "test-api-key"},
+            )
+
+            assert response.status_code == 200
+            assert response.json() == [{"slug": "test-slug", "title": "テストタイトル"}]
+            assert response.headers["X-Next-Cursor"] == "next-cursor"
+            kwargs = mock_query.call_args.kwargs
+            assert kwargs["statuses"] == [ReportStatus.READY]
+            assert kwargs["sort"] == "-created_at"
+            assert kwargs["limit"] == 1
+
+    def test_get_reports_with_invalid_sort(self, client):
+        """不正な並べ替えのフィールドを指定すると400エラーを返す"""
+        with patch("src.routers.admin_report.query_reports") as mock_query:
+            mock_query.side_effect = ValueError("Unknown sort field: unknown")
+            response = client.get("/admin/reports", params={"sort": "unknown"}, headers={"x-api-key": "test-api-key"})
+
+            assert response.status_code == 400
+
+
 class TestUpdateReportVisibility:
     """update_report_visibilityエンドポイントのテスト"""
 
@@ -121,3 +158,26 @@ class TestUpdateReportVisibility:
         # レスポンスを検証
         assert response.status_code == 401
         assert response.json()["detail"] == "Invalid API key"
+
+
+class TestGetReportTrace:
+    """get_report_traceエンドポイントのテスト"""
+
+    def test_get_report_trace_success(self, client, tmp_path):
+        """トレースファイルの内容をそのまま返す"""
+        trace = {"version": 1, "spans": [{"name": "extraction", "duration": 1.5}]}
+        (tmp_path / "test-slug").mkdir()
+        (tmp_path / "test-slug" / "hierarchical_trace.json").write_text(json.dumps(trace))
+
+        with patch("src.routers.admin_report.settings.REPORT_DIR", tmp_path):
+            response = client.get("/admin/reports/test-slug/trace")
+
+        assert response.status_code == 200
+        assert response.json() == trace
+
+    def test_get_report_trace_not_found(self, client, tmp_path):
+        """トレースファイルが存在しない場合は404を返す"""
+        with patch("src.routers.admin_report.settings.REPORT_DIR", tmp_path):
+            response = client.get("/admin/reports/test-slug/trace")
+
+        assert response.status_code == 404
@@ -4,7 +4,7 @@ import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from src.core.exceptions import ClusterCSVParseError, ClusterFileNotFound
+from src.core.exceptions import ClusterCSVParseError, ClusterFileNotFound, ResultFileNotFound
 from src.routers.admin_report import router, verify_admin_api_key
 from src.schemas.cluster import ClusterResponse
 
@@ -140,7 +140,7 @@ class TestUpdateClusterLabel:
     """update_cluster_labelエンドポイントのテスト"""
 
     def test_update_cluster_label_success(self, client):
-        """正常系：クラスタラベルが正常に更新されるケース"""
+        """正常系：結果ファイルを書き換えられない場合は集計処理を実行して更新するケース"""
         # テスト用の更新データ
         update_data = {
             "id": "cluster-1",
@@ -152,11 +152,13 @@ class TestUpdateClusterLabel:
         with (
             patch("src.routers.admin_report.ClusterRepository") as mock_repo,
             patch("src.routers.admin_report.execute_aggregation") as mock_execute,
+            patch("src.routers.admin_report.ResultRepository") as mock_result_repo,
         ):
             # モックオブジェクトの設定
             mock_instance = mock_repo.return_value
             mock_instance.update_csv.return_value = True
             mock_execute.return_value = True
+            mock_result_repo.return_value.update_cluster.side_effect = ResultFileNotFound("結果ファイルがありません")
 
             # エンドポイントにリクエストを送信
             response = client.patch(
@@ -174,6 +176,35 @@ class TestUpdateClusterLabel:
             mock_instance.update_csv.assert_called_once()
             mock_execute.assert_called_once_with("test-slug")
 
+    def test_update_cluster_label_patches_result(self, client):
+        """正常系：結果ファイルを直接書き換えられる場合は集計処理を実行しないケース"""
+        update_data = {
+            "id": "cluster-1",
+            "label": "更新されたラベル",
+            "description": "更新された説明",
+        }
+
+        with (
+            patch("src.routers.admin_report.ClusterRepository") as mock_repo,
+            patch("src.routers.admin_report.execute_aggregation") as mock_execute,
+            patch("src.routers.admin_report.ResultRepository") as mock_result_repo,
+            patch("src.routers.admin_report._sync_edited_report_to_storage") as mock_sync,
+        ):
+            mock_repo.return_value.update_csv.return_value = True
+
+            response = client.patch(
+                "/admin/reports/test-slug/cluster-label",
+                json=update_data,
+                headers={"x-api-key": "test-api-key"},
+            )
+
+            assert response.status_code == 200
+            assert response.json() == {"success": True}
+            mock_result_repo.assert_called_once_with("test-slug")
+            mock_result_repo.return_value.update_cluster.assert_called_once()
+            mock_execute.assert_not_called()
+            mock_sync.assert_called_once_with("test-slug")
+
     def test_update_cluster_label_csv_update_failed(self, client):
         """異常系：CSVの更新に失敗するケース"""
         # テスト用の更新データ
@@ -212,11 +243,13 @@ class TestUpdateClusterLabel:
         with (
             patch("src.routers.admin_report.ClusterRepository") as mock_repo,
             patch("src.routers.admin_report.execute_aggregation") as mock_execute,
+            patch("src.routers.admin_report.ResultRepository") as mock_result_repo,
         ):
             # モックオブジェクトの設定
             mock_instance = mock_repo.return_value
             mock_instance.update_csv.return_value = True
             mock_execute.return_value = False
+            mock_result_repo.return_value.update_cluster.side_effect = ResultFileNotFound("結果ファイルがありません")
 
             # エンドポイントにリクエストを送信
             response = client.patch(
@@ -24,14 +24,14 @@ class TestReportEndpoint:
             json.dump(report_data, f)
 
         # モックレポートステータスを設定
-        mock_reports = [
-            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC})()
-        ]
+        mock_report = type(
+            "Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC}
+        )()
 
         # settings.REPORT_DIRをパッチして、report routerがテスト用ディレクトリを使用するようにする
         with (
             patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
-            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+            patch("src.routers.report.get_report", return_value=mock_report),
         ):
             # test_settingsからAPIキーを取得
             response = client.get(f"/reports/{slug}", headers={"x-api-key": test_settings.PUBLIC_API_KEY})
@@ -62,14 +62,14 @@ class TestReportEndpoint:
             json.dump(report_data, f)
 
         # モックレポートステータスを設定
-        mock_reports = [
-            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.UNLISTED})()
-        ]
+        mock_report = type(
+            "Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.UNLISTED}
+        )()
 
         # settings.REPORT_DIRをパッチして、report routerがテスト用ディレクトリを使用するようにする
         with (
             patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
-            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+            patch("src.routers.report.get_report", return_value=mock_report),
         ):
             # test_settingsからAPIキーを取得
             response = client.get(f"/reports/{slug}", headers={"x-api-key": test_settings.PUBLIC_API_KEY})
@@ -93,14 +93,14 @@ class TestReportEndpoint:
             json.dump(report_data, f)
 
         # モックレポートステータスを設定
-        mock_reports = [
-            type("Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PRIVATE})()
-        ]
+        mock_report = type(
+            "Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PRIVATE}
+        )()
 
         # settings.REPORT_DIRをパッチして、report routerがテスト用ディレクトリを使用するようにする
         with (
             patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
-            patch("src.routers.report.load_status_as_reports", return_value=mock_reports),
+            patch("src.routers.report.get_report", return_value=mock_report),
         ):
             # test_settingsからAPIキーを取得
             response = client.get(f"/reports/{slug}", headers={"x-api-key": test_settings.PUBLIC_API_KEY})
@@ -113,10 +113,91 @@ class TestReportEndpoint:
         # settings.REPORT_DIRをパッチして、report routerがテスト用ディレクトリを使用するようにする
         with (
             patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
-            patch("src.routers.report.load_status_as_reports", return_value=[]),
+            patch("src.routers.report.get_report", return_value=None),
         ):
             # test_settingsからAPIキーを取得
             response = client.get("/reports/nonexistent-slug", headers={"x-api-key": test_settings.PUBLIC_API_KEY})
 
         assert response.status_code == 404
         assert "Report not found" in response.json()["detail"]
+
+    def test_get_report_supports_etag_and_gzip(self, client: TestClient, temp_report_dir, test_settings):
+        """正常系：gzip圧縮したレスポンスとETagを返し、If-None-Matchが一致する場合は304を返す"""
+        slug = "test-cached-report"
+        report_dir = temp_report_dir / slug
+        report_dir.mkdir(parents=True, exist_ok=True)
+        with open(report_dir / "hierarchical_result.json", "w", encoding="utf-8") as f:
+            json.dump({"config": {"question": "キャッシュの質問"}, "arguments": []}, f)
+
+        mock_report = type(
+            "Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC}
+        )()
+        headers = {"x-api-key": test_settings.PUBLIC_API_KEY, "Accept-Encoding": "gzip"}
+        with (
+            patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
+            patch("src.routers.report.get_report", return_value=mock_report),
+        ):
+            response = client.get(f"/reports/{slug}", headers=headers)
+            etag = response.headers["etag"]
+            not_modified = client.get(f"/reports/{slug}", headers={**headers, "If-None-Match": etag})
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json()["config"]["question"] == "キャッシュの質問"
+        assert not_modified.status_code == 304
+        assert not_modified.headers["etag"] == etag
+
+    def test_get_report_slices(self, client: TestClient, temp_report_dir, test_settings):
+        """正常系：概要・クラスタ・意見をそれぞれ取得でき、意見はクラスタで絞り込んでページ分割できる"""
+        slug = "test-sliced-report"
+        report_dir = temp_report_dir / slug
+        report_dir.mkdir(parents=True, exist_ok=True)
+        result = {
+            "overview": "概要",
+            "config": {"question": "質問", "extraction": {"model": "gpt-4o-mini", "source_code": "def f(): ..."}},
+            "comment_num": 3,
+            "arguments": [
+                {"arg_id": f"A{i}_0", "argument": f"意見{i}", "cluster_ids": ["0", f"1_{i % 2}"]} for i in range(3)
+            ],
+            "clusters": [
+                {"level": 0, "id": "0", "label": "全体", "parent": ""},
+                {"level": 1, "id": "1_0", "label": "クラスタ0", "parent": "0"},
+                {"level": 1, "id": "1_1", "label": "クラスタ1", "parent": "0"},
+            ],
+            "propertyMap": {"age": {"A0_0": "20", "A2_0": "40"}},
+        }
+        with open(report_dir / "hierarchical_result.json", "w", encoding="utf-8") as f:
+            json.dump(result, f)
+
+        mock_report = type(
+            "Report", (), {"slug": slug, "status": ReportStatus.READY, "visibility": ReportVisibility.PUBLIC}
+        )()
+        headers = {"x-api-key": test_settings.PUBLIC_API_KEY}
+        with (
+            patch("src.routers.report.settings.REPORT_DIR", temp_report_dir),
+            patch("src.routers.report.get_report", return_value=mock_report),
+        ):
+            overview = client.get(f"/reports/{slug}/overview", headers=headers)
+            clusters = client.get(f"/reports/{slug}/clusters", params={"level": 1}, headers=headers)
+            first_page = client.get(
+                f"/reports/{slug}/arguments", params={"cluster_id": "1_0", "limit": 1}, headers=headers
+            )
+            second_page = client.get(
+                f"/reports/{slug}/arguments",
+                params={"cluster_id": "1_0", "limit": 1, "cursor": first_page.headers["x-next-cursor"]},
+                headers=headers,
+            )
+            missing_cluster = client.get(f"/reports/{slug}/arguments", params={"cluster_id": "9"}, headers=headers)
+
+        assert overview.status_code == 200
+        assert overview.json()["overview"] == "概要"
+        assert overview.json()["argument_num"] == 3
+        assert overview.json()["visibility"] == "public"
+        assert "source_code" not in overview.json()["config"]["extraction"]
+        assert [c["id"] for c in clusters.json()] == ["1_0", "1_1"]
+        assert first_page.json() == [
+            {"arg_id": "A0_0", "argument": "意見0", "cluster_ids": ["0", "1_0"], "properties": {"age": "20"}}
+        ]
+        assert [a["arg_id"] for a in second_page.json()] == ["A2_0"]
+        assert "x-next-cursor" not in second_page.headers
+        assert missing_cluster.status_code == 404
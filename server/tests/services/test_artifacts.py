@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from broadlistening.pipeline.services.artifacts import (
+    EMBEDDINGS_FILENAME,
+    EmbeddingWriter,
+    load_embeddings,
+    read_table,
+    save_embeddings,
+    write_table,
+)
+
+
+class TestArtifacts:
+    """パイプラインの中間ファイルの読み書きのテスト"""
+
+    @pytest.fixture(autouse=True)
+    def output_dir(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "outputs" / "test").mkdir(parents=True)
+        return tmp_path / "outputs" / "test"
+
+    def test_read_table_projects_columns(self):
+        """read_table: 指定したカラムだけを読み込む"""
+        write_table("test", "args", pd.DataFrame({"arg-id": ["A1_0"], "argument": ["意見"], "category": ["x"]}))
+
+        assert list(read_table("test", "args", columns=["arg-id", "argument"]).columns) == ["arg-id", "argument"]
+        assert list(read_table("test", "args", columns=lambda c: c.startswith("arg")).columns) == [
+            "arg-id",
+            "argument",
+        ]
+
+    def test_write_table_keeps_csv(self, output_dir):
+        """write_table: サーバーなどから読めるようにCSVを書き出す"""
+        write_table("test", "hierarchical_clusters", pd.DataFrame({"arg-id": ["A1_0"], "x": [0.5]}))
+
+        assert (output_dir / "hierarchical_clusters.csv").exists()
+
+    def test_parquet_mirror(self, output_dir, monkeypatch):
+        """write_table: Parquetを指定した場合は併せて書き出し、読み込み時はそちらを優先する"""
+        pytest.importorskip("pyarrow")
+        monkeypatch.setenv("PIPELINE_TABLE_FORMAT", "parquet")
+        write_table("test", "args", pd.DataFrame({"arg-id": ["A1_0"], "argument": ["001"]}))
+
+        assert (output_dir / "args.parquet").exists()
+        # CSVでは数値として読み込まれる値も、Parquetでは文字列のまま読み込める
+        assert read_table("test", "args")["argument"].tolist() == ["001"]
+
+    def test_parquet_round_trip_with_column_filter(self, output_dir, monkeypatch):
+        """read_table: Parquetからもカラムを絞って読み込め、型が保たれる"""
+        pytest.importorskip("pyarrow")
+        monkeypatch.setenv("PIPELINE_TABLE_FORMAT", "parquet")
+        df = pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "x": [0.5, 1.5], "cluster-level-1-id": ["1_0", "1_1"]})
+        write_table("test", "hierarchical_clusters", df)
+        (output_dir / "hierarchical_clusters.csv").unlink()
+
+        pd.testing.assert_frame_equal(read_table("test", "hierarchical_clusters"), df)
+        assert list(read_table("test", "hierarchical_clusters", columns=lambda c: c.startswith("cluster")).columns) == [
+            "cluster-level-1-id"
+        ]
+
+    def test_parquet_ignored_when_csv_is_newer(self, output_dir, monkeypatch):
+        """read_table: CSVの方が新しい場合(サーバー側で編集された場合)はCSVを読む"""
+        pytest.importorskip("pyarrow")
+        monkeypatch.setenv("PIPELINE_TABLE_FORMAT", "parquet")
+        write_table("test", "hierarchical_merge_labels", pd.DataFrame({"id": ["1_0"], "label": ["古いラベル"]}))
+        pd.DataFrame({"id": ["1_0"], "label": ["新しいラベル"]}).to_csv(
+            output_dir / "hierarchical_merge_labels.csv", index=False
+        )
+        os.utime(output_dir / "hierarchical_merge_labels.parquet", (0, 0))
+
+        assert read_table("test", "hierarchical_merge_labels")["label"].tolist() == ["新しいラベル"]
+
+    def test_save_and_load_embeddings(self, output_dir):
+        """save_embeddings: float32の行列として保存し、メモリマップで読み込める"""
+        save_embeddings("test", ["A1_0", "A2_0"], np.array([[0.1, 0.2], [0.3, 0.4]]))
+
+        arg_ids, embeddings = load_embeddings("test")
+
+        assert arg_ids == ["A1_0", "A2_0"]
+        assert embeddings.dtype == np.float32
+        assert isinstance(embeddings, np.memmap)
+        np.testing.assert_allclose(embeddings, [[0.1, 0.2], [0.3, 0.4]], rtol=1e-6)
+        assert (output_dir / EMBEDDINGS_FILENAME).exists()
+
+    def test_save_embeddings_rejects_mismatched_ids(self):
+        """save_embeddings: 行数とarg-idの数が一致しない場合はエラーになる"""
+        with pytest.raises(ValueError):
+            save_embeddings("test", ["A1_0"], np.zeros((2, 3)))
+
+    def test_embedding_writer_writes_rows_in_any_order(self, output_dir):
+        """EmbeddingWriter: バッチごとに任意の行へ書き込み、完了時に置き換える"""
+        writer = EmbeddingWriter("test", ["A1_0", "A2_0", "A3_0"])
+        writer.write([2], [[3.0, 3.0]])
+        writer.write([0, 1], np.array([[1.0, 1.0], [2.0, 2.0]]))
+        assert not (output_dir / EMBEDDINGS_FILENAME).exists()
+        writer.close()
+
+        arg_ids, embeddings = load_embeddings("test")
+        assert arg_ids == ["A1_0", "A2_0", "A3_0"]
+        np.testing.assert_array_equal(embeddings, [[1.0, 1.0], [2.0, 2.0], [3.0, 3.0]])
+        assert sorted(p.name for p in output_dir.iterdir()) == ["embeddings.npy", "embeddings_index.csv"]
+
+    def test_embedding_writer_rejects_missing_rows(self, output_dir):
+        """EmbeddingWriter: 書き込まれていない行がある場合はエラーになり、一時ファイルを削除する"""
+        writer = EmbeddingWriter("test", ["A1_0", "A2_0"])
+        writer.write([0], [[1.0, 1.0]])
+
+        with pytest.raises(RuntimeError):
+            writer.close()
+        assert list(output_dir.iterdir()) == []
+
+    def test_embedding_writer_discards_on_error(self, output_dir):
+        """EmbeddingWriter: with文の中で例外が発生した場合は一時ファイルを削除し、結果のファイルを作らない"""
+        with pytest.raises(ValueError):
+            with EmbeddingWriter("test", ["A1_0", "A2_0"]) as writer:
+                writer.write([0], [[1.0, 1.0]])
+                assert (output_dir / f"{EMBEDDINGS_FILENAME}.tmp").exists()
+                raise ValueError("embedding failed")
+
+        assert list(output_dir.iterdir()) == []
+        with pytest.raises(FileNotFoundError):
+            load_embeddings("test")
+
+    def test_load_legacy_pickle(self, output_dir):
+        """load_embeddings: 以前の形式のembeddings.pklも読み込める"""
+        pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "embedding": [[0.1, 0.2], [0.3, 0.4]]}).to_pickle(
+            output_dir / "embeddings.pkl"
+        )
+
+        arg_ids, embeddings = load_embeddings("test")
+
+        assert arg_ids == ["A1_0", "A2_0"]
+        assert embeddings.shape == (2, 2)
+        assert embeddings.dtype == np.float32
+
+    def test_load_embeddings_not_found(self):
+        """load_embeddings: 埋め込みファイルがない場合はFileNotFoundErrorになる"""
+        with pytest.raises(FileNotFoundError):
+            load_embeddings("test")
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from broadlistening.pipeline.services.dedup import (
+    find_argument_representatives,
+    group_duplicates,
+    group_near_duplicate_embeddings,
+    normalize_comment,
+)
+
+
+class TestDedup:
+    """抽出前のコメントの重複排除のテスト"""
+
+    def test_normalize_comment(self):
+        """normalize_comment: 全角・半角、空白、句読点・記号、大文字・小文字の違いを無視する"""
+        assert normalize_comment("ＡＢＣ　税金を、下げて！ ") == normalize_comment("abc税金を下げて")
+        assert normalize_comment("税金を下げて") != normalize_comment("税金を上げて")
+
+    @pytest.mark.parametrize(
+        ("mode", "expected"),
+        [
+            ("off", {1: [1], 2: [2], 3: [3], 4: [4], 5: [5]}),
+            ("exact", {1: [1, 2], 3: [3], 4: [4], 5: [5]}),
+            ("normalized", {1: [1, 2, 3], 4: [4], 5: [5]}),
+        ],
+    )
+    def test_group_duplicates(self, mode, expected):
+        """group_duplicates: 重複をまとめ、最初に現れたコメントを代表にする"""
+        items = [
+            (1, "税金を下げてほしい。"),
+            (2, "税金を下げてほしい。"),
+            (3, "税金を下げて ほしい"),
+            (4, "公園を増やしてほしい"),
+            (5, "！！"),
+        ]
+
+        assert group_duplicates(items, mode=mode) == expected
+
+    def test_symbol_only_comments_are_not_merged(self):
+        """group_duplicates: 正規化すると空になるコメントは、本文が一致する場合だけまとめる"""
+        items = [(1, "👍"), (2, "👎"), (3, "👍")]
+
+        assert group_duplicates(items) == {1: [1, 3], 2: [2]}
+
+    def test_group_near_duplicates(self):
+        """group_duplicates: near では一部だけ異なるテンプレートのコメントもまとめる"""
+        template = (
+            "私は{}に住んでいます。子育て支援の予算を増やし、保育園の待機児童をなくしてください。よろしくお願いします。"
+        )
+        items = [(i, template.format(city)) for i, city in enumerate(["東京都", "大阪府", "京都府"])]
+        items.append((3, "道路の舗装を直してください。"))
+
+        assert group_duplicates(items, mode="normalized") == {0: [0], 1: [1], 2: [2], 3: [3]}
+        assert group_duplicates(items, mode="near", threshold=0.8) == {0: [0, 1, 2], 3: [3]}
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            group_duplicates([(1, "a")], mode="fuzzy")
+
+
+class TestArgumentDedup:
+    """クラスタリング前の意見の重複排除のテスト"""
+
+    def test_off(self):
+        """find_argument_representatives: off では各意見が自身の代表になる"""
+        assert find_argument_representatives(["a", "a"], mode="off").tolist() == [0, 1]
+
+    def test_text(self):
+        """find_argument_representatives: text では本文がほぼ同じ意見を最初に現れた意見にまとめる"""
+        arguments = ["子育て支援の予算を増やしてほしい", "公園を増やしてほしい", "子育て支援の予算を増やしてほしい。"]
+
+        assert find_argument_representatives(arguments, mode="text").tolist() == [0, 1, 0]
+
+    def test_group_near_duplicate_embeddings(self):
+        """group_near_duplicate_embeddings: コサイン類似度が閾値以上の埋め込みをまとめる"""
+        rng = np.random.default_rng(1)
+        base = rng.standard_normal((50, 64)).astype(np.float32)
+        # 後半の50件は前半の各行にわずかなノイズを加えたもの
+        noisy = base + 0.05 * rng.standard_normal(base.shape).astype(np.float32)
+        embeddings = np.vstack([base, noisy])
+
+        representatives = group_near_duplicate_embeddings(embeddings, threshold=0.95)
+
+        assert representatives.tolist() == list(range(50)) * 2
+
+    def test_embedding_mode_requires_embeddings(self):
+        with pytest.raises(ValueError):
+            find_argument_representatives(["a", "b"], mode="embedding")
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            find_argument_representatives(["a"], mode="near")
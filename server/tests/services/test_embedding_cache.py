@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from broadlistening.pipeline.services.embedding_cache import EmbeddingCache, cache_key
+
+
+class TestEmbeddingCache:
+    """埋め込みキャッシュのテスト"""
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = EmbeddingCache(path=tmp_path / "embeddings.sqlite3")
+        yield cache
+        cache.close()
+
+    def test_get_many_returns_none_for_missing(self, cache):
+        """get_many: 未キャッシュのテキストはNoneを返す"""
+        assert cache.get_many("openai", "text-embedding-3-small", ["テスト1", "テスト2"]) == [None, None]
+
+    def test_put_and_get(self, cache):
+        """put_many: 保存したベクトルをfloat32で取り出せる"""
+        cache.put_many("openai", "text-embedding-3-small", ["テスト1", "テスト2"], [[0.1, 0.2], [0.3, 0.4]])
+
+        result = cache.get_many("openai", "text-embedding-3-small", ["テスト2", "未登録", "テスト1"])
+
+        assert result[1] is None
+        np.testing.assert_allclose(result[0], [0.3, 0.4], rtol=1e-6)
+        np.testing.assert_allclose(result[2], [0.1, 0.2], rtol=1e-6)
+        assert result[0].dtype == np.float32
+
+    def test_key_depends_on_provider_and_model(self, cache):
+        """get_many: プロバイダーやモデルが異なる場合はヒットしない"""
+        cache.put_many("openai", "text-embedding-3-small", ["テスト"], [[0.1, 0.2]])
+
+        assert cache.get_many("openai", "text-embedding-3-large", ["テスト"]) == [None]
+        assert cache.get_many("azure", "text-embedding-3-small", ["テスト"]) == [None]
+
+    def test_key_normalizes_text(self):
+        """cache_key: 全角・半角の揺れと前後の空白は同じキーになる"""
+        assert cache_key("openai", "m", "ＡＢＣ１２３ ") == cache_key("openai", "m", "ABC123")
+        assert cache_key("openai", "m", "ABC") != cache_key("openai", "m", "ABD")
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """put_many: 上限サイズを超えた場合は参照の古いものから削除する"""
+        # float32 x 2次元 = 8バイト/件。上限16バイトなら2件まで保持できる
+        cache = EmbeddingCache(path=tmp_path / "embeddings.sqlite3", max_bytes=16)
+        try:
+            cache.put_many("openai", "m", ["a"], [[0.1, 0.2]])
+            cache.put_many("openai", "m", ["b"], [[0.3, 0.4]])
+            cache.get_many("openai", "m", ["a"])  # aを参照してbより新しくする
+            cache.put_many("openai", "m", ["c"], [[0.5, 0.6]])
+
+            a, b, c = cache.get_many("openai", "m", ["a", "b", "c"])
+            assert a is not None
+            assert b is None
+            assert c is not None
+            assert cache.total_bytes() <= 16
+        finally:
+            cache.close()
@@ -0,0 +1,88 @@
+import threading
+from unittest.mock import MagicMock
+
+import numpy as np
+import openai
+import pytest
+from broadlistening.pipeline.services.embedding_engine import EmbeddingEngine, pack_batches
+
+
+def _api_error(error_class, status_code: int) -> openai.APIStatusError:
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {"retry-after": "0"}
+    return error_class(message="error", response=response, body=None)
+
+
+def _embed(texts):
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+class TestEmbeddingEngine:
+    """埋め込みリクエストの並列実行のテスト"""
+
+    def test_pack_batches(self):
+        """pack_batches: 件数と推定トークン数(文字数)の上限でバッチを分ける"""
+        texts = ["a" * 5, "b" * 5, "c" * 5, "d", "e", "f"]
+        assert pack_batches(texts, max_batch_size=10, max_batch_tokens=10) == [[0, 1], [2, 3, 4, 5]]
+        assert pack_batches(texts, max_batch_size=2, max_batch_tokens=100) == [[0, 1], [2, 3], [4, 5]]
+        # 1件で上限を超えるテキストも単独のバッチとして送る
+        assert pack_batches(["x" * 20], max_batch_size=10, max_batch_tokens=10) == [[0]]
+
+    def test_embed_texts_keeps_input_order(self):
+        """embed_texts: 並行して送ったバッチの結果を入力と同じ順序で返す"""
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+
+        def embed(texts):
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            threading.Event().wait(0.02)
+            with lock:
+                state["running"] -= 1
+            return _embed(texts)
+
+        engine = EmbeddingEngine(embed, concurrency=4, max_batch_size=2, max_batch_tokens=1000)
+        texts = ["x" * i for i in range(1, 17)]
+        result = engine.embed_texts(texts)
+
+        assert result.dtype == np.float32
+        np.testing.assert_array_equal(result[:, 0], np.arange(1, 17))
+        assert state["max"] > 1
+
+    def test_retries_only_failed_batch(self):
+        """5xxエラーになったバッチだけを再試行する"""
+        calls = []
+
+        def embed(texts):
+            calls.append(list(texts))
+            if texts == ["b"] and calls.count(["b"]) == 1:
+                raise _api_error(openai.InternalServerError, 500)
+            return _embed(texts)
+
+        engine = EmbeddingEngine(embed, concurrency=1, max_batch_size=1, max_batch_tokens=1000, max_retries=2)
+        result = engine.embed_texts(["a", "b", "c"])
+
+        assert result.shape == (3, 2)
+        assert calls.count(["a"]) == 1
+        assert calls.count(["b"]) == 2
+        assert calls.count(["c"]) == 1
+
+    def test_splits_rejected_batch(self):
+        """400エラーになったバッチは半分に分けて送り直し、1件でも失敗する場合は例外を送出する"""
+        embed = MagicMock(side_effect=_reject_more_than_two)
+        engine = EmbeddingEngine(embed, concurrency=1, max_batch_size=10, max_batch_tokens=1000)
+
+        result = engine.embed_texts(["a", "b", "c", "d"])
+        np.testing.assert_array_equal(result[:, 0], [1, 1, 1, 1])
+
+        embed.side_effect = _api_error(openai.BadRequestError, 400)
+        with pytest.raises(openai.BadRequestError):
+            engine.embed_texts(["a", "b"])
+
+
+def _reject_more_than_two(texts):
+    if len(texts) > 2:
+        raise _api_error(openai.BadRequestError, 400)
+    return _embed(texts)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from broadlistening.pipeline.services.embedding_cache import EmbeddingCache
+from broadlistening.pipeline.services.embedding_prefetch import EmbeddingPrefetcher
+
+
+class TestEmbeddingPrefetcher:
+    """抽出と並行して埋め込みを計算するプリフェッチャーのテスト"""
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = EmbeddingCache(path=tmp_path / "embeddings.sqlite3")
+        yield cache
+        cache.close()
+
+    def test_prefetched_embeddings_are_cached(self, cache):
+        """投入した意見をバッチごとに埋め込み、キャッシュに保存する。同じテキストは1回だけ計算する"""
+        batches = []
+
+        def embed(texts):
+            batches.append(list(texts))
+            return [[float(len(text)), 0.0] for text in texts]
+
+        progress = []
+        prefetcher = EmbeddingPrefetcher(embed, cache, "openai", "model", batch_size=2, on_progress=progress.append)
+        prefetcher.submit(["a", "bb", "a"])
+        prefetcher.submit(["ccc"])
+        stats = prefetcher.close()
+
+        assert sorted(text for batch in batches for text in batch) == ["a", "bb", "ccc"]
+        assert all(len(batch) <= 2 for batch in batches)
+        assert stats == {"submitted": 3, "cached": 0, "embedded": 3, "failed": 0}
+        assert progress[-1] == stats
+        np.testing.assert_allclose(cache.get_many("openai", "model", ["ccc"])[0], [3.0, 0.0])
+
+    def test_skips_cached_and_tolerates_failures(self, cache):
+        """キャッシュ済みの意見はAPIに送らず、失敗したバッチは警告に留める"""
+        cache.put_many("openai", "model", ["cached"], [[1.0, 1.0]])
+
+        def embed(texts):
+            raise RuntimeError("embedding API error")
+
+        prefetcher = EmbeddingPrefetcher(embed, cache, "openai", "model")
+        prefetcher.submit(["cached", "new"])
+        stats = prefetcher.close()
+
+        assert stats == {"submitted": 2, "cached": 1, "embedded": 0, "failed": 1}
+        assert cache.get_many("openai", "model", ["new"]) == [None]
+
+    def test_from_config_respects_plan_and_options(self):
+        """embeddingステップを実行しない場合やプリフェッチが無効な場合は作成しない"""
+        config = {
+            "embedding": {"model": "text-embedding-3-small", "use_cache": True, "prefetch": False},
+            "is_embedded_at_local": False,
+            "provider": "openai",
+            "plan": [{"step": "embedding", "run": True}],
+        }
+        assert EmbeddingPrefetcher.from_config(config) is None
+
+        config["embedding"]["prefetch"] = True
+        config["plan"] = [{"step": "embedding", "run": False}]
+        assert EmbeddingPrefetcher.from_config(config) is None
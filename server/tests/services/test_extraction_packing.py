@@ -0,0 +1,60 @@
+import json
+
+from broadlistening.pipeline.services.extraction_packing import (
+    PACKED_PROMPT_SUFFIX,
+    build_packed_messages,
+    pack_comments,
+    parse_packed_response,
+)
+
+
+class TestExtractionPacking:
+    """複数のコメントをまとめた抽出リクエストのテスト"""
+
+    def test_pack_comments(self):
+        """pack_comments: 件数とトークン数の上限でまとめ、長いコメントは1件ずつ送る"""
+        items = [(i, f"短いコメント{i}") for i in range(5)]
+        items.insert(2, ("long", "長" * 200))
+
+        packs, singles = pack_comments(items, token_budget=400, max_comments=2)
+
+        assert packs == [[(0, "短いコメント0"), (1, "短いコメント1")], [(2, "短いコメント2"), (3, "短いコメント3")]]
+        # 長いコメントと、1件しか入らなかったグループのコメント
+        assert singles == [("long", "長" * 200), (4, "短いコメント4")]
+
+    def test_pack_comments_token_budget(self):
+        """pack_comments: 推定トークン数の合計が上限を超えないようにまとめる"""
+        # JSONにしたときの推定トークン数が1件あたり85になるコメント
+        items = [(i, "あ" * 60) for i in range(6)]
+
+        packs, singles = pack_comments(items, token_budget=360, max_comments=20)
+
+        assert [[comment_id for comment_id, _ in pack] for pack in packs] == [[0, 1, 2, 3], [4, 5]]
+        assert singles == []
+
+    def test_build_packed_messages(self):
+        """build_packed_messages: comment-id の代わりにリクエスト内の連番をIDとして送る"""
+        messages = build_packed_messages("意見を抽出してください", [("c-10", "税金"), ("c-20", "公園")])
+
+        assert messages[0] == {"role": "system", "content": "意見を抽出してください" + PACKED_PROMPT_SUFFIX}
+        assert json.loads(messages[1]["content"]) == [{"id": "1", "comment": "税金"}, {"id": "2", "comment": "公園"}]
+
+    def test_parse_packed_response(self):
+        """parse_packed_response: 連番のIDを comment-id に戻し、不正な結果や欠けているコメントは含めない"""
+        pack = [("c-10", "税金"), ("c-20", "公園"), ("c-30", "道路")]
+        response = json.dumps(
+            {
+                "results": [
+                    {"id": "1", "extractedOpinionList": ["税金を下げてほしい", ""]},
+                    {"id": "2", "extractedOpinionList": "公園を増やしてほしい"},
+                    {"id": "9", "extractedOpinionList": ["存在しないコメント"]},
+                ]
+            },
+            ensure_ascii=False,
+        )
+
+        assert parse_packed_response(response, pack) == {"c-10": ["税金を下げてほしい"]}
+
+    def test_parse_invalid_packed_response(self):
+        """parse_packed_response: JSONとして読めない場合は空の辞書を返す"""
+        assert parse_packed_response("not json", [("c-10", "税金")]) == {}
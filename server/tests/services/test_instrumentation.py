@@ -0,0 +1,145 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from broadlistening.pipeline.services.instrumentation import Tracer, bind_current_span, latency_summary
+
+
+class TestTracer:
+    """パイプラインの計測のテスト"""
+
+    def test_latency_summary(self):
+        """latency_summary: 件数・合計・パーセンタイルを返す"""
+        summary = latency_summary([1.0, 2.0, 3.0, 4.0])
+        assert summary["count"] == 4
+        assert summary["total"] == 10.0
+        assert summary["p50"] == 2.5
+        assert summary["max"] == 4.0
+        assert latency_summary([])["count"] == 0
+
+    def test_span_records_step_metrics(self, tmp_path):
+        """span: 経過時間・CPU時間・読み書きしたファイルを記録する"""
+        (tmp_path / "input.csv").write_text("a,b\n1,2\n")
+        tracer = Tracer()
+
+        with tracer.span("step", output_dir=tmp_path) as span:
+            tracer.record_read(tmp_path / "input.csv")
+            (tmp_path / "output.csv").write_text("x" * 10)
+
+        assert span.duration >= 0
+        assert span.cpu_time >= 0
+        assert span.process_peak_rss_bytes > 0
+        assert 0 <= span.peak_rss_increase_bytes <= span.process_peak_rss_bytes
+        assert span.bytes_read == {"input.csv": 8}
+        assert span.bytes_written == {"output.csv": 10}
+
+    def test_llm_calls_are_attributed_to_active_span(self):
+        """record_llm_call: 実行中のステップのスパンに記録し、スパン外のものは unattributed に記録する"""
+        tracer = Tracer()
+        with tracer.span("extraction") as span:
+            tracer.record_llm_call("openai", latency=1.0, queue_wait=0.5, attempts=2, tokens=100)
+            tracer.record_llm_call("openai", latency=3.0, queue_wait=0.0, error=True)
+        tracer.record_llm_call("openai", latency=1.0, queue_wait=0.0)
+
+        stats = span.to_dict()["llm"]["openai"]
+        assert stats["calls"] == 2
+        assert stats["errors"] == 1
+        assert stats["retries"] == 1
+        assert stats["tokens"] == 100
+        assert stats["queue_wait"]["total"] == 0.5
+        assert tracer.unattributed.to_dict()["llm"]["openai"]["calls"] == 1
+
+    def test_concurrent_spans_are_attributed_separately(self):
+        """record_llm_call: 並行して実行中のスパンのうち、記録したスレッドが属するスパンに記録する"""
+        tracer = Tracer()
+        barrier = threading.Barrier(2)
+        spans = {}
+
+        def run_step(name, tokens):
+            with tracer.span(name) as span:
+                spans[name] = span
+                barrier.wait(timeout=5)
+                # ステップがスレッドプールで処理する場合も、投入元のステップに記録する
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    record = bind_current_span(tracer.record_llm_call)
+                    list(executor.map(lambda _: record("openai", 1.0, 0.0, tokens=tokens), range(3)))
+                barrier.wait(timeout=5)
+
+        threads = [threading.Thread(target=run_step, args=args) for args in [("first", 10), ("second", 100)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert spans["first"].llm_tokens() == 30
+        assert spans["second"].llm_tokens() == 300
+        assert tracer.unattributed.llm == {}
+
+    def test_prompt_cache_tokens(self):
+        """record_prompt_cache: プロンプトキャッシュから読み込まれた入力トークン数を記録し、全ステップの合計を返す"""
+        tracer = Tracer()
+        with tracer.span("extraction") as span:
+            tracer.record_prompt_cache("openai", 1024)
+            tracer.record_prompt_cache("openai", 512)
+        tracer.record_prompt_cache("azure", 100)
+
+        assert span.to_dict()["llm"]["openai"]["cached_input_tokens"] == 1536
+        assert tracer.cached_input_tokens() == 1636
+
+    def test_span_records_error_and_reraises(self):
+        """span: ステップの例外を記録して再送出する"""
+        tracer = Tracer()
+        with pytest.raises(ValueError):
+            with tracer.span("step") as span:
+                raise ValueError("boom")
+
+        assert span.error == "ValueError: boom"
+        assert span.duration is not None
+
+    def test_profile_and_export(self, tmp_path):
+        """profileを指定した場合はプロファイルを保存し、exportでトレースをJSONとして書き出す"""
+        tracer = Tracer()
+        with tracer.span("step", output_dir=tmp_path, profile="cprofile") as span:
+            sum(range(1000))
+
+        assert span.profile == "profile_step.prof"
+        assert (tmp_path / "profile_step.prof").exists()
+
+        tracer.export(tmp_path / "hierarchical_trace.json")
+        trace = json.loads((tmp_path / "hierarchical_trace.json").read_text())
+        assert [s["name"] for s in trace["spans"]] == ["step"]
+        assert trace["spans"][0]["profile"] == "profile_step.prof"
+
+    def test_concurrent_spans_with_profile(self, tmp_path):
+        """profileを指定したスパンが並行しても例外にならず、プロファイルは同時に1つだけ取る"""
+        tracer = Tracer()
+        barrier = threading.Barrier(2)
+        spans = {}
+        errors = []
+
+        def run(name):
+            try:
+                with tracer.span(name, output_dir=tmp_path, profile="cprofile") as span:
+                    spans[name] = span
+                    barrier.wait(timeout=5)
+                    sum(range(1000))
+                    barrier.wait(timeout=5)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ["first", "second"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        profiles = [span.profile for span in spans.values() if span.profile]
+        assert len(profiles) == 1
+        assert (tmp_path / profiles[0]).exists()
+
+        # 次のスパンでは再びプロファイルを取れる
+        with tracer.span("third", output_dir=tmp_path, profile="cprofile") as span:
+            pass
+        assert span.profile == "profile_third.prof"
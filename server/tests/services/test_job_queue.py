@@ -0,0 +1,115 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from src.services.job_queue import PRIORITY_AGGREGATION, JobQueue, JobScheduler
+
+
+class FakePool:
+    """ジョブを実行せずに記録し、テストから終了させるワーカープール"""
+
+    def __init__(self):
+        self.started = []
+        self._callbacks = {}
+
+    def submit(self, slug, argv, on_done):
+        self.started.append(slug)
+        self._callbacks[slug] = on_done
+
+    def finish(self, slug, error=None):
+        self._callbacks.pop(slug)(slug, error)
+
+
+class TestJobScheduler:
+    """レポート生成ジョブのキューとスケジューラのテスト"""
+
+    @pytest.fixture
+    def queue(self, tmp_path):
+        queue = JobQueue(tmp_path / "job_queue.sqlite3")
+        yield queue
+        queue.close()
+
+    def make_scheduler(self, queue, pool, done=None, **kwargs):
+        on_done = (lambda slug, error: done.append((slug, error))) if done is not None else (lambda slug, error: None)
+        return JobScheduler(queue, pool, on_done, **kwargs)
+
+    def test_aggregation_jumps_ahead_of_queued_reports(self, queue):
+        """上限に達している間は待機し、空いたら優先度の高いジョブから実行する"""
+        pool = FakePool()
+        done = []
+        scheduler = self.make_scheduler(queue, pool, done, max_jobs=1)
+        scheduler.submit("report-a", "report", ["a.json"])
+        scheduler.submit("report-b", "report", ["b.json"])
+        scheduler.submit("report-c", "aggregation", ["c.json"], priority=PRIORITY_AGGREGATION)
+
+        assert pool.started == ["report-a"]
+        assert scheduler.job_state("report-b") == "queued"
+
+        pool.finish("report-a")
+        assert pool.started == ["report-a", "report-c"]
+        pool.finish("report-c", RuntimeError("failed"))
+        assert pool.started == ["report-a", "report-c", "report-b"]
+
+        assert [slug for slug, _ in done] == ["report-a", "report-c"]
+        assert isinstance(done[1][1], RuntimeError)
+        failed = queue.jobs(("failed",))
+        assert [job.slug for job in failed] == ["report-c"]
+        assert failed[0].error == "RuntimeError: failed"
+
+    def test_priority_slots_and_provider_limits(self, queue):
+        """優先度の高いジョブは予備のワーカーを使い、プロバイダーの上限に達したジョブは後続に追い越される"""
+        pool = FakePool()
+        scheduler = self.make_scheduler(queue, pool, max_jobs=2, priority_slots=1, provider_limits={"openai": 1})
+        scheduler.submit("report-a", "report", ["a.json"], provider="openai")
+        scheduler.submit("report-b", "report", ["b.json"], provider="openai")
+        scheduler.submit("report-c", "report", ["c.json"], provider="openrouter")
+        scheduler.submit("report-d", "report", ["d.json"], provider="openrouter")
+        # 同じレポートのジョブは同時に実行しない
+        scheduler.submit("report-a", "aggregation", ["a.json"], priority=PRIORITY_AGGREGATION)
+        scheduler.submit("report-e", "aggregation", ["e.json"], priority=PRIORITY_AGGREGATION)
+
+        assert pool.started == ["report-a", "report-c", "report-e"]
+        assert [job.slug for job in queue.jobs(("queued",))] == ["report-a", "report-b", "report-d"]
+
+        pool.finish("report-a")
+        assert pool.started[3:] == ["report-a"]
+
+    def test_submit_failure_marks_job_failed(self, queue):
+        """ワーカーに投入できなかったジョブは実行中のまま残さず失敗として記録し、次のジョブを開始する"""
+        pool = FakePool()
+        original_submit = pool.submit
+
+        def submit(slug, argv, on_done):
+            if slug == "report-a":
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            original_submit(slug, argv, on_done)
+
+        pool.submit = submit
+        done = []
+        scheduler = self.make_scheduler(queue, pool, done, max_jobs=1)
+        scheduler.submit("report-a", "report", ["a.json"])
+        scheduler.submit("report-b", "report", ["b.json"])
+
+        assert [slug for slug, _ in done] == ["report-a"]
+        assert isinstance(done[0][1], RuntimeError)
+        assert [job.slug for job in queue.jobs(("failed",))] == ["report-a"]
+        assert scheduler.job_state("report-a") is None
+        assert pool.started == ["report-b"]
+
+    def test_recover_requeues_interrupted_jobs(self, queue, test_settings):
+        """サーバーの再起動時に実行中だったジョブを、パイプラインのロックを解除して再実行する"""
+        job_id = queue.enqueue("report-a", "report", ["a.json"], 0, "openai")
+        queue.mark_running(job_id)
+        status_dir = test_settings.REPORT_DIR / "report-a"
+        status_dir.mkdir(parents=True, exist_ok=True)
+        status_file = status_dir / "hierarchical_status.json"
+        status_file.write_text(json.dumps({"status": "running", "lock_until": "2999-01-01T00:00:00"}))
+
+        pool = FakePool()
+        scheduler = self.make_scheduler(queue, pool, max_jobs=1)
+        with patch("src.services.job_queue.settings", test_settings):
+            scheduler.recover()
+
+        assert pool.started == ["report-a"]
+        assert json.loads(status_file.read_text())["lock_until"] < "2999"
+        assert queue.jobs(("running",))[0].attempts == 2
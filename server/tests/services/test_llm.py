@@ -1,9 +1,12 @@
+import asyncio
 import os
 from unittest.mock import MagicMock, patch
 
 import openai
 import pytest
+from broadlistening.pipeline.services.instrumentation import Tracer
 from broadlistening.pipeline.services.llm import (
+    _get_client,
     _validate_model,
     request_to_azure_chatcompletion,
     request_to_azure_embed,  # noqa: F401
@@ -11,10 +14,19 @@ from broadlistening.pipeline.services.llm import (
     request_to_embed,  # noqa: F401
     request_to_openai,
 )
-from openai import AzureOpenAI  # noqa: F401
+from broadlistening.pipeline.services.llm_scheduler import get_scheduler
+from openai import AzureOpenAI, OpenAI  # noqa: F401
+from openai.resources.chat.completions import Completions
 from pydantic import BaseModel, Field
 
 
+def _rate_limit_error() -> openai.RateLimitError:
+    """待機時間0秒のレート制限エラー(スケジューラの再試行を待たずに済むようにする)"""
+    response = MagicMock()
+    response.headers = {"retry-after": "0"}
+    return openai.RateLimitError(message="Rate limit exceeded", response=response, body=MagicMock())
+
+
 class TestLLMService:
     """LLMサービスのテスト"""
 
@@ -59,8 +71,8 @@ class TestLLMService:
             **{"usage.prompt_tokens": 10, "usage.completion_tokens": 5, "usage.total_tokens": 15}
         )
 
-        # openai.chat.completions.createをモック化
-        with patch("openai.chat.completions.create", return_value=mock_openai_response):
+        # 共有のクライアントが使う Completions.create をモック化
+        with patch.object(Completions, "create", return_value=mock_openai_response):
             response, token_input, token_output, token_total = request_to_openai(messages, model="gpt-4")
 
         assert response == "This is a test response"
@@ -79,8 +91,8 @@ class TestLLMService:
             **{"usage.prompt_tokens": 10, "usage.completion_tokens": 5, "usage.total_tokens": 15}
         )
 
-        # openai.chat.completions.createをモック化
-        with patch("openai.chat.completions.create", return_value=mock_openai_response):
+        # 共有のクライアントが使う Completions.create をモック化
+        with patch.object(Completions, "create", return_value=mock_openai_response):
             response, token_input, token_output, token_total = request_to_openai(messages, model="gpt-4", is_json=True)
 
         assert response == "This is a test response"
@@ -89,7 +101,7 @@ class TestLLMService:
         assert token_total == 15
 
         # JSON形式のレスポンスを要求していることを確認
-        with patch("openai.chat.completions.create", return_value=mock_openai_response) as mock_create:
+        with patch.object(Completions, "create", return_value=mock_openai_response) as mock_create:
             request_to_openai(messages, model="gpt-4", is_json=True)
             args, kwargs = mock_create.call_args
             assert kwargs["response_format"] == {"type": "json_object"}
@@ -120,8 +132,8 @@ class TestLLMService:
             **{"usage.prompt_tokens": 10, "usage.completion_tokens": 5, "usage.total_tokens": 15}
         )
 
-        # openai.chat.completions.createをモック化
-        with patch("openai.chat.completions.create", return_value=mock_openai_response) as mock_create:
+        # 共有のクライアントが使う Completions.create をモック化
+        with patch.object(Completions, "create", return_value=mock_openai_response) as mock_create:
             response, token_input, token_output, token_total = request_to_openai(
                 messages, model="gpt-4", json_schema=json_schema
             )
@@ -150,8 +162,8 @@ class TestLLMService:
             **{"usage.prompt_tokens": 10, "usage.completion_tokens": 5, "usage.total_tokens": 15}
         )
 
-        # openai.beta.chat.completions.parseをモック化
-        with patch("openai.beta.chat.completions.parse", return_value=mock_openai_parse_response) as mock_parse:
+        # 共有のクライアントが使う Completions.parse をモック化
+        with patch.object(Completions, "parse", return_value=mock_openai_parse_response) as mock_parse:
             response, token_input, token_output, token_total = request_to_openai(
                 messages, model="gpt-4", json_schema=TestModel
             )
@@ -165,8 +177,76 @@ class TestLLMService:
         args, kwargs = mock_parse.call_args
         assert kwargs["response_format"] == TestModel
 
-    def test_request_to_openai_rate_limit_error_retry(self):
-        """request_to_openai: レート制限エラーが発生した場合は3回までリトライする"""
+    def test_request_to_openai_prompt_cache_key(self, mock_openai_response):
+        """request_to_openai: 固定のsystemプロンプトが同じリクエストには同じ prompt_cache_key を付ける"""
+        system = {"role": "system", "content": "You are a helpful assistant."}
+        mock_openai_response.configure_mock(
+            **{"usage.prompt_tokens": 10, "usage.completion_tokens": 5, "usage.total_tokens": 15}
+        )
+
+        with patch.object(Completions, "create", return_value=mock_openai_response) as mock_create:
+            request_to_openai([system, {"role": "user", "content": "Hello"}], model="gpt-4")
+            request_to_openai([system, {"role": "user", "content": "Goodbye"}], model="gpt-4")
+            request_to_openai([{"role": "user", "content": "Hello"}], model="gpt-4")
+
+        first, second, without_system = (call.kwargs for call in mock_create.call_args_list)
+        assert first["extra_body"]["prompt_cache_key"] == second["extra_body"]["prompt_cache_key"]
+        assert "extra_body" not in without_system
+
+    def test_request_to_openai_records_cached_tokens(self, mock_openai_response):
+        """request_to_openai: プロンプトキャッシュから読み込まれた入力トークン数を計測結果に記録する"""
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Hello, world!"},
+        ]
+        mock_openai_response.configure_mock(
+            **{
+                "usage.prompt_tokens": 2048,
+                "usage.completion_tokens": 5,
+                "usage.total_tokens": 2053,
+                "usage.prompt_tokens_details.cached_tokens": 1024,
+            }
+        )
+        tracer = Tracer()
+
+        with (
+            patch.object(Completions, "create", return_value=mock_openai_response),
+            patch("broadlistening.pipeline.services.llm.get_tracer", return_value=tracer),
+        ):
+            response, token_input, _, _ = request_to_openai(messages, model="gpt-4")
+
+        assert token_input == 2048
+        assert tracer.cached_input_tokens() == 1024
+
+    def test_chat_client_reports_rate_limit_headers(self):
+        """共有のクライアントは、レスポンスのレート制限ヘッダーをスケジューラのプロバイダーの予算に渡す"""
+        http_client = _get_client(OpenAI, provider="openai")._client
+        response = MagicMock(headers={"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "10"})
+
+        for hook in http_client.event_hooks["response"]:
+            hook(response)
+
+        scheduler = get_scheduler()
+        # ヘッダーの反映はスケジューラのイベントループで行うため、反映されるまで待つ
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), scheduler._loop).result()
+        requests = scheduler._lanes["openai"].requests
+        assert requests.capacity == 500
+        assert requests.available <= 11
+
+    def test_request_to_openai_rate_limit_error_not_retried(self):
+        """request_to_openai: レート制限エラーは再試行せずに送出する(再試行はスケジューラが行う)"""
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Hello, world!"},
+        ]
+
+        with patch.object(Completions, "create", side_effect=_rate_limit_error()) as mock_create:
+            with pytest.raises(openai.RateLimitError):
+                request_to_openai(messages, model="gpt-4")
+            assert mock_create.call_count == 1
+
+    def test_request_to_chat_ai_rate_limit_error_retry(self):
+        """request_to_chat_ai: レート制限エラーが発生した場合はスケジューラが再試行する"""
         messages = [
             {"role": "system", "content": "You are a helpful assistant."},
             {"role": "user", "content": "Hello, world!"},
@@ -181,41 +261,30 @@ class TestLLMService:
         mock_response.usage.completion_tokens = 5
         mock_response.usage.total_tokens = 15
 
-        rate_limit_error = openai.RateLimitError(
-            message="Rate limit exceeded",
-            response=MagicMock(),
-            body=MagicMock(),
-        )
-
         # side_effectに複数の値を指定すると、呼び出しごとに順番に返される
-        side_effects = [rate_limit_error, rate_limit_error, mock_response]
+        side_effects = [_rate_limit_error(), _rate_limit_error(), mock_response]
 
-        with patch("openai.chat.completions.create", side_effect=side_effects):
+        with patch.object(Completions, "create", side_effect=side_effects) as mock_create:
             # リトライ後に正常なレスポンスが返されることを確認
-            response, token_input, token_output, token_total = request_to_openai(messages, model="gpt-4")
+            response, token_input, token_output, token_total = request_to_chat_ai(messages, model="gpt-4")
             assert response == "This is a test response after retry"
             assert token_input == 10
             assert token_output == 5
             assert token_total == 15
+            assert mock_create.call_count == 3
 
-    def test_request_to_openai_rate_limit_error_max_retries(self):
-        """request_to_openai: レート制限エラーが4回発生した場合は例外を再発生させる"""
+    def test_request_to_chat_ai_rate_limit_error_max_retries(self):
+        """request_to_chat_ai: スケジューラの再試行回数(3回)を超えてレート制限エラーが発生した場合は例外を再発生させる"""
         messages = [
             {"role": "system", "content": "You are a helpful assistant."},
             {"role": "user", "content": "Hello, world!"},
         ]
 
-        # 4回連続でRateLimitErrorを発生させる
-        rate_limit_error = openai.RateLimitError(
-            message="Rate limit exceeded",
-            response=MagicMock(),
-            body=MagicMock(),
-        )
-
-        with patch("openai.chat.completions.create", side_effect=[rate_limit_error] * 4):
+        with patch.object(Completions, "create", side_effect=[_rate_limit_error()] * 5) as mock_create:
             # 3回リトライしても失敗するため、最終的に例外が発生する
             with pytest.raises(openai.RateLimitError):
-                request_to_openai(messages, model="gpt-4")
+                request_to_chat_ai(messages, model="gpt-4")
+            assert mock_create.call_count == 4
 
     def test_request_to_openai_authentication_error(self):
         """request_to_openai: 認証エラーが発生した場合は例外を再発生させる"""
@@ -224,13 +293,13 @@ class TestLLMService:
             {"role": "user", "content": "Hello, world!"},
         ]
 
-        # openai.chat.completions.createをモック化してAuthenticationErrorを発生させる
+        # 共有のクライアントが使う Completions.create をモック化してAuthenticationErrorを発生させる
         auth_error = openai.AuthenticationError(
             message="Invalid API key",
             response=MagicMock(),
             body=MagicMock(),
         )
-        with patch("openai.chat.completions.create", side_effect=auth_error):
+        with patch.object(Completions, "create", side_effect=auth_error):
             with pytest.raises(openai.AuthenticationError):
                 request_to_openai(messages, model="gpt-4")
 
@@ -241,13 +310,13 @@ class TestLLMService:
             {"role": "user", "content": "Hello, world!"},
         ]
 
-        # openai.chat.completions.createをモック化してBadRequestErrorを発生させる
+        # 共有のクライアントが使う Completions.create をモック化してBadRequestErrorを発生させる
         bad_request_error = openai.BadRequestError(
             message="Bad request",
             response=MagicMock(),
             body=MagicMock(),
         )
-        with patch("openai.chat.completions.create", side_effect=bad_request_error):
+        with patch.object(Completions, "create", side_effect=bad_request_error):
             with pytest.raises(openai.BadRequestError):
                 request_to_openai(messages, model="gpt-4")
 
@@ -455,8 +524,8 @@ class TestLLMService:
                 with pytest.raises(openai.RateLimitError):
                     request_to_azure_chatcompletion(messages)
 
-    def test_request_to_azure_chatcompletion_rate_limit_error_retry(self):
-        """request_to_azure_chatcompletion: レート制限エラーが発生した場合は3回までリトライする"""
+    def test_request_to_chat_ai_azure_rate_limit_error_retry(self):
+        """request_to_chat_ai: Azureでレート制限エラーが発生した場合はスケジューラが再試行する"""
         messages = [
             {"role": "system", "content": "You are a helpful assistant."},
             {"role": "user", "content": "Hello, world!"},
@@ -467,9 +536,6 @@ class TestLLMService:
         mock_choice = MagicMock()
         mock_choice.message.content = "This is a test response after retry"
         mock_response.choices = [mock_choice]
-        mock_response.usage.prompt_tokens = 10
-        mock_response.usage.completion_tokens = 5
-        mock_response.usage.total_tokens = 15
 
         # usageプロパティを設定
         mock_response.usage = MagicMock()
@@ -477,16 +543,10 @@ class TestLLMService:
         mock_response.usage.completion_tokens = 5
         mock_response.usage.total_tokens = 15
 
-        rate_limit_error = openai.RateLimitError(
-            message="Rate limit exceeded",
-            response=MagicMock(),
-            body=MagicMock(),
-        )
-
         # AzureOpenAIクライアントをモック化
         mock_client = MagicMock()
         # side_effectに複数の値を指定すると、呼び出しごとに順番に返される
-        mock_client.chat.completions.create.side_effect = [rate_limit_error, rate_limit_error, mock_response]
+        mock_client.chat.completions.create.side_effect = [_rate_limit_error(), _rate_limit_error(), mock_response]
 
         # 環境変数をモック化
         env_vars = {
@@ -499,30 +559,23 @@ class TestLLMService:
         with patch.dict(os.environ, env_vars):
             with patch("broadlistening.pipeline.services.llm.AzureOpenAI", return_value=mock_client):
                 # リトライ後に正常なレスポンスが返されることを確認
-                response, token_input, token_output, token_total = request_to_azure_chatcompletion(messages)
+                response, token_input, token_output, token_total = request_to_chat_ai(messages, provider="azure")
                 assert response == "This is a test response after retry"
                 assert token_input == 10
                 assert token_output == 5
                 assert token_total == 15
                 assert mock_client.chat.completions.create.call_count == 3
 
-    def test_request_to_azure_chatcompletion_rate_limit_error_max_retries(self):
-        """request_to_azure_chatcompletion: レート制限エラーが4回発生した場合は例外を再発生させる"""
+    def test_request_to_chat_ai_azure_rate_limit_error_max_retries(self):
+        """request_to_chat_ai: Azureでスケジューラの再試行回数を超えてレート制限エラーが発生した場合は例外を再発生させる"""
         messages = [
             {"role": "system", "content": "You are a helpful assistant."},
             {"role": "user", "content": "Hello, world!"},
         ]
 
-        # 4回連続でRateLimitErrorを発生させる
-        rate_limit_error = openai.RateLimitError(
-            message="Rate limit exceeded",
-            response=MagicMock(),
-            body=MagicMock(),
-        )
-
         # AzureOpenAIクライアントをモック化
         mock_client = MagicMock()
-        mock_client.chat.completions.create.side_effect = [rate_limit_error] * 4
+        mock_client.chat.completions.create.side_effect = [_rate_limit_error()] * 5
 
         # 環境変数をモック化
         env_vars = {
@@ -536,7 +589,8 @@ class TestLLMService:
             with patch("broadlistening.pipeline.services.llm.AzureOpenAI", return_value=mock_client):
                 # 3回リトライしても失敗するため、最終的に例外が発生する
                 with pytest.raises(openai.RateLimitError):
-                    request_to_azure_chatcompletion(messages)
+                    request_to_chat_ai(messages, provider="azure")
+                assert mock_client.chat.completions.create.call_count == 4
 
     def test_request_to_chat_openai_use_openai(self, mock_openai_response):
         """request_to_chat_openai: provider=openaiの場合はrequest_to_openaiを使用する"""
@@ -722,14 +776,9 @@ class TestLLMService:
         ]
         model = "openai/gpt-4o-2024-08-06"
 
-        # レート制限エラーの場合
+        # レート制限エラーの場合(スケジューラの再試行後も失敗する)
         mock_client = MagicMock()
-        rate_limit_error = openai.RateLimitError(
-            message="Rate limit exceeded",
-            response=MagicMock(),
-            body=MagicMock(),
-        )
-        mock_client.chat.completions.create.side_effect = rate_limit_error
+        mock_client.chat.completions.create.side_effect = _rate_limit_error()
 
         env_vars = {
             "OPENROUTER_API_KEY": "test-api-key",
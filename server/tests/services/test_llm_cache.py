@@ -0,0 +1,137 @@
+import json
+import time
+from unittest.mock import patch
+
+import pytest
+from broadlistening.pipeline.services import llm_cache
+from broadlistening.pipeline.services.instrumentation import get_tracer, reset_tracer
+from broadlistening.pipeline.services.llm import request_to_chat_ai
+from broadlistening.pipeline.services.llm_cache import LLMResponseCache, llm_cache_key
+from pydantic import BaseModel
+
+
+class Labels(BaseModel):
+    label: str
+
+
+class TestLLMResponseCache:
+    """LLMのレスポンスのキャッシュのテスト"""
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = LLMResponseCache(path=tmp_path / "llm_responses.sqlite3")
+        yield cache
+        cache.close()
+
+    def test_put_and_get(self, cache):
+        """put: 保存したレスポンスとトークン使用量を取り出せる"""
+        key = llm_cache_key("openai", "gpt-4o", [{"role": "user", "content": "こんにちは"}])
+        assert cache.get(key) is None
+
+        cache.put(key, "openai", "gpt-4o", ("レスポンス", 10, 5, 15))
+
+        assert cache.get(key) == ("レスポンス", 10, 5, 15)
+
+    def test_key_depends_on_request(self):
+        """llm_cache_key: プロバイダー・モデル・メッセージ・レスポンス形式のいずれかが異なればキーも異なる"""
+        messages = [{"role": "user", "content": "こんにちは"}]
+        key = llm_cache_key("openai", "gpt-4o", messages)
+
+        assert llm_cache_key("openai", "gpt-4o", [dict(m) for m in messages]) == key
+        assert llm_cache_key("azure", "gpt-4o", messages) != key
+        assert llm_cache_key("openai", "gpt-4o-mini", messages) != key
+        assert llm_cache_key("openai", "gpt-4o", [{"role": "user", "content": "こんばんは"}]) != key
+        assert llm_cache_key("openai", "gpt-4o", messages, is_json=True) != key
+        assert llm_cache_key("openai", "gpt-4o", messages, json_schema=Labels) != key
+
+    def test_expired_entries_are_not_used(self, tmp_path):
+        """保存から期限が過ぎたレスポンスは返さない"""
+        cache = LLMResponseCache(path=tmp_path / "llm_responses.sqlite3", ttl_seconds=60)
+        cache.put("key", "openai", "gpt-4o", ("レスポンス", 1, 1, 2))
+
+        with patch("broadlistening.pipeline.services.llm_cache.time.time", return_value=time.time() + 120):
+            assert cache.get("key") is None
+        cache.close()
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """合計サイズが上限を超えると、参照が古いものから削除する"""
+        cache = LLMResponseCache(path=tmp_path / "llm_responses.sqlite3", max_bytes=250)
+        for i in range(3):
+            cache.put(f"key{i}", "openai", "gpt-4o", ("x" * 100, 1, 1, 2))
+
+        assert cache.get("key0") is None
+        assert cache.get("key2") is not None
+        assert cache.total_bytes() <= 250
+        cache.close()
+
+    def test_request_to_chat_ai_uses_cache(self, tmp_path, monkeypatch):
+        """request_to_chat_ai: 同じリクエストはLLMに送らず、トークン使用量0としてキャッシュから返す"""
+        monkeypatch.setattr(llm_cache, "_enabled", True)
+        monkeypatch.setattr(llm_cache, "_cache", LLMResponseCache(path=tmp_path / "llm_responses.sqlite3"))
+        reset_tracer()
+        messages = [{"role": "user", "content": "こんにちは"}]
+
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_openai", return_value=("レスポンス", 50, 50, 100)
+        ) as mock_request:
+            first = request_to_chat_ai(messages, model="gpt-4o", provider="openai")
+            second = request_to_chat_ai(messages, model="gpt-4o", provider="openai")
+
+            llm_cache.configure_llm_cache(False)
+            third = request_to_chat_ai(messages, model="gpt-4o", provider="openai")
+
+        assert first == ("レスポンス", 50, 50, 100)
+        assert second == ("レスポンス", 0, 0, 0)
+        assert third == first
+        assert mock_request.call_count == 2
+        stats = get_tracer().unattributed.to_dict()["llm"]["openai"]
+        assert stats["cache_hits"] == 1
+        assert stats["tokens_saved"] == 100
+
+    def test_request_to_chat_ai_caches_only_valid_responses(self, tmp_path, monkeypatch):
+        """request_to_chat_ai: 空のレスポンスや検証に失敗したレスポンスはキャッシュしない"""
+        monkeypatch.setattr(llm_cache, "_enabled", True)
+        monkeypatch.setattr(llm_cache, "_cache", LLMResponseCache(path=tmp_path / "llm_responses.sqlite3"))
+        messages = [{"role": "user", "content": "こんにちは"}]
+
+        def ask(content, **kwargs):
+            with patch(
+                "broadlistening.pipeline.services.llm.request_to_openai", return_value=(content, 1, 1, 2)
+            ) as mock_request:
+                request_to_chat_ai(messages, model="gpt-4o", provider="openai", **kwargs)
+                request_to_chat_ai(messages, model="gpt-4o", provider="openai", **kwargs)
+            return mock_request.call_count
+
+        # 空のレスポンス(contentがNoneの場合も含む)
+        assert ask(None) == 2
+        assert ask("") == 2
+        # JSONを要求したリクエストでパースできないレスポンス
+        assert ask("not json", is_json=True) == 2
+        # 呼び出し側の検証に失敗したレスポンス
+        assert ask('{"a": 1}', is_json=True, validate=lambda response: "b" in json.loads(response)) == 2
+        # 検証に成功したレスポンスはキャッシュする
+        assert ask('{"b": 1}', is_json=True, validate=lambda response: "b" in json.loads(response)) == 1
+
+    def test_request_to_chat_ai_keys_on_serving_model(self, tmp_path, monkeypatch):
+        """request_to_chat_ai: Azureのデプロイメントやローカルのアドレスが変わった場合はキャッシュを使わない"""
+        monkeypatch.setattr(llm_cache, "_enabled", True)
+        monkeypatch.setattr(llm_cache, "_cache", LLMResponseCache(path=tmp_path / "llm_responses.sqlite3"))
+        messages = [{"role": "user", "content": "こんにちは"}]
+
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_azure_chatcompletion", return_value=("応答", 1, 1, 2)
+        ) as mock_azure:
+            monkeypatch.setenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME", "gpt-4o-deployment")
+            request_to_chat_ai(messages, model="gpt-4o", provider="azure")
+            request_to_chat_ai(messages, model="gpt-4o", provider="azure")
+            monkeypatch.setenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME", "gpt-4o-mini-deployment")
+            request_to_chat_ai(messages, model="gpt-4o", provider="azure")
+        assert mock_azure.call_count == 2
+
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_local_llm", return_value=("応答", 1, 1, 2)
+        ) as mock_local:
+            request_to_chat_ai(messages, model="llama3", provider="local", local_llm_address="host-a:11434")
+            request_to_chat_ai(messages, model="llama3", provider="local", local_llm_address="host-a:11434")
+            request_to_chat_ai(messages, model="llama3", provider="local", local_llm_address="host-b:11434")
+        assert mock_local.call_count == 2
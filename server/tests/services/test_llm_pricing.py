@@ -114,6 +114,23 @@ class TestLLMPricing:
         cost = LLMPricing.calculate_cost(provider, model, token_usage_input, token_usage_output)
         assert cost == pytest.approx(expected_cost)
 
+    def test_calculate_cost_with_cached_input(self):
+        """プロンプトキャッシュから読み込まれた入力トークンは割引価格で計算される"""
+        # 入力1Mトークンのうち0.8Mがキャッシュ: 0.2M * 2.50 + 0.8M * 1.25 + 0.5M * 10.00
+        cost = LLMPricing.calculate_cost("openai", "gpt-4o", 1_000_000, 500_000, 800_000)
+        assert cost == pytest.approx(6.50)
+
+    def test_calculate_cost_cached_input_is_capped(self):
+        """キャッシュされた入力トークン数は入力トークン数を上限として扱う"""
+        cost = LLMPricing.calculate_cost("openai", "gpt-4o-mini", 1_000_000, 0, 2_000_000)
+        assert cost == pytest.approx(0.075)
+
+    def test_calculate_cost_without_cached_input_price(self):
+        """キャッシュされた入力の価格がない場合は通常の入力の価格で計算される"""
+        price = {"input": 1.00, "output": 2.00}
+        cost = LLMPricing._calculate_with_price(price, 1_000_000, 0, 500_000)
+        assert cost == pytest.approx(1.00)
+
     def test_format_cost(self):
         """コストが正しくフォーマットされる"""
         cost = 1.2345
@@ -0,0 +1,169 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import openai
+import pytest
+from broadlistening.pipeline.services.instrumentation import get_tracer, reset_tracer
+from broadlistening.pipeline.services.llm_scheduler import (
+    LLMScheduler,
+    RateLimitBudget,
+    estimate_tokens,
+    parse_rate_limit_headers,
+    parse_retry_after,
+)
+
+
+def _rate_limit_error(headers: dict | None = None, message: str = "Rate limit exceeded") -> openai.RateLimitError:
+    response = MagicMock()
+    response.headers = headers or {}
+    return openai.RateLimitError(message=message, response=response, body=MagicMock())
+
+
+class TestLLMScheduler:
+    """LLMリクエストスケジューラのテスト"""
+
+    @pytest.fixture
+    def make_scheduler(self):
+        """テストの終了時に停止するスケジューラを作成するフィクスチャ"""
+        schedulers = []
+
+        def make(**kwargs):
+            scheduler = LLMScheduler(**kwargs)
+            schedulers.append(scheduler)
+            return scheduler
+
+        yield make
+        for scheduler in schedulers:
+            scheduler.shutdown()
+
+    def test_parse_retry_after(self):
+        """parse_retry_after: retry-after系のヘッダーから待機秒数を取り出す"""
+        assert parse_retry_after(_rate_limit_error({"retry-after-ms": "1500"})) == 1.5
+        assert parse_retry_after(_rate_limit_error({"retry-after": "3"})) == 3.0
+        assert parse_retry_after(_rate_limit_error({"x-ratelimit-reset-requests": "1m2.5s"})) == 62.5
+        assert parse_retry_after(_rate_limit_error({"x-ratelimit-reset-tokens": "20ms"})) == 0.02
+        assert parse_retry_after(_rate_limit_error({})) is None
+
+    def test_parse_rate_limit_headers(self):
+        """parse_rate_limit_headers: 残りの予算・上限・リセットまでの時間を種類ごとに取り出す"""
+        headers = {
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-remaining-requests": "499",
+            "x-ratelimit-reset-requests": "20ms",
+            "x-ratelimit-remaining-tokens": "1000",
+        }
+        assert parse_rate_limit_headers(headers) == {
+            "requests": RateLimitBudget(remaining=499, limit=500, reset=0.02),
+            "tokens": RateLimitBudget(remaining=1000),
+        }
+        assert parse_rate_limit_headers({"retry-after": "1"}) == {}
+
+    def test_estimate_tokens(self):
+        """estimate_tokens: メッセージの文字数から見積もる"""
+        messages = [{"role": "system", "content": "abc"}, {"role": "user", "content": "テスト"}]
+        assert estimate_tokens(messages) == 6
+
+    def test_submit_returns_result(self, make_scheduler):
+        """submit: 関数の戻り値をそのまま返す"""
+        scheduler = make_scheduler()
+        assert scheduler.submit("openai", lambda: ("ok", 1, 2, 3), 10) == ("ok", 1, 2, 3)
+
+    def test_executor_fits_largest_provider_limit(self, monkeypatch, make_scheduler):
+        """スレッドプールはプロバイダー別の同時実行数の上限のうち最大のものに合わせる"""
+        monkeypatch.setenv("LLM_MAX_CONCURRENCY", "4")
+        monkeypatch.setenv("LLM_MAX_CONCURRENCY_BIGPROVIDER", "100")
+        scheduler = make_scheduler()
+        assert scheduler._executor._max_workers == 200
+
+    def test_submit_records_to_caller_span(self, make_scheduler):
+        """submit: 計測は呼び出し元のステップのスパンに記録する"""
+        reset_tracer()
+        tracer = get_tracer()
+        scheduler = make_scheduler()
+        with tracer.span("extraction") as span:
+            scheduler.submit("openai", lambda: ("ok", 1, 2, 3))
+        scheduler.submit("openai", lambda: ("ok", 10, 20, 30))
+
+        assert span.llm_tokens() == 3
+        assert tracer.unattributed.llm_tokens() == 30
+        reset_tracer()
+
+    def test_submit_limits_concurrency(self, monkeypatch, make_scheduler):
+        """submit: 呼び出し元のスレッド数に関わらず同時実行数の上限を守る"""
+        monkeypatch.setenv("LLM_MAX_CONCURRENCY_TESTPROVIDER", "2")
+        scheduler = make_scheduler()
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+
+        def request():
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.05)
+            with lock:
+                state["running"] -= 1
+            return ("ok", 0, 0, 0)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: scheduler.submit("testprovider", request), range(8)))
+
+        assert results == [("ok", 0, 0, 0)] * 8
+        assert state["max"] == 2
+
+    def test_submit_retries_rate_limit_error(self, make_scheduler):
+        """submit: レート制限エラーはヘッダーの待機時間後に再試行し、同時実行数を下げる"""
+        scheduler = make_scheduler(max_retries=2)
+        request = MagicMock(side_effect=[_rate_limit_error({"retry-after": "0"}), ("ok", 1, 1, 2)])
+
+        assert scheduler.submit("openai", request) == ("ok", 1, 1, 2)
+        assert request.call_count == 2
+        assert scheduler._lanes["openai"].concurrency < scheduler._lanes["openai"].limits.max_concurrency
+
+    def test_submit_does_not_retry_insufficient_quota(self, make_scheduler):
+        """submit: 残高不足のエラーは再試行せずに送出する"""
+        scheduler = make_scheduler(max_retries=2)
+        request = MagicMock(side_effect=_rate_limit_error({"retry-after": "0"}, message="insufficient_quota"))
+
+        with pytest.raises(openai.RateLimitError):
+            scheduler.submit("openai", request)
+        assert request.call_count == 1
+
+    def test_submit_respects_requests_per_minute(self, monkeypatch, make_scheduler):
+        """submit: RPMの予算を使い切った場合は補充されるまで待つ"""
+        # 6000RPM = 100件/秒。バケットの初期残高(6000件)を使い切った状態から1件送る
+        monkeypatch.setenv("LLM_RPM_LIMIT_RPMPROVIDER", "6000")
+        scheduler = make_scheduler()
+        scheduler.submit("rpmprovider", lambda: ("ok", 0, 0, 0))
+        scheduler._lanes["rpmprovider"].requests.available = 0
+
+        start = time.monotonic()
+        scheduler.submit("rpmprovider", lambda: ("ok", 0, 0, 0))
+        assert time.monotonic() - start >= 0.005
+
+    def test_response_headers_limit_next_requests(self, make_scheduler):
+        """observe_rate_limit_headers: 成功したレスポンスの残りの予算を反映し、使い切った場合はリセットまで待つ"""
+        scheduler = make_scheduler()
+        headers = {
+            "x-ratelimit-limit-requests": "6000",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "50ms",
+            "x-ratelimit-limit-tokens": "100000",
+            "x-ratelimit-remaining-tokens": "40000",
+        }
+
+        def request():
+            scheduler.observe_rate_limit_headers("openai", headers)
+            return ("ok", 0, 0, 0)
+
+        scheduler.submit("openai", request)
+        start = time.monotonic()
+        scheduler.submit("openai", lambda: ("ok", 0, 0, 0))
+
+        assert time.monotonic() - start >= 0.04
+        lane = scheduler._lanes["openai"]
+        # 環境変数で上限を設定していなくても、ヘッダーの上限でバケットを作る
+        assert lane.requests.capacity == 6000
+        assert lane.tokens.capacity == 100000
+        assert lane.tokens.available < 100000
@@ -0,0 +1,59 @@
+import numpy as np
+from broadlistening.pipeline.services import local_embedding
+from broadlistening.pipeline.services.local_embedding import LocalEmbeddingEngine
+
+
+class _FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size, convert_to_numpy, show_progress_bar):
+        self.calls.append((list(texts), batch_size))
+        return np.array([[len(text), 0.5] for text in texts], dtype=np.float64)
+
+
+class TestLocalEmbeddingEngine:
+    """ローカル埋め込みエンジンのテスト"""
+
+    def test_encode_sorts_by_length_and_restores_order(self):
+        """encode: 文字数順に並べてモデルに渡し、元の順序の float32 行列を返す"""
+        engine = LocalEmbeddingEngine(batch_size=8)
+        engine._model = _FakeModel()
+
+        result = engine.encode(["ccc", "a", "bb", "dddd"])
+
+        assert engine._model.calls == [(["a", "bb", "ccc", "dddd"], 8)]
+        assert result.dtype == np.float32
+        np.testing.assert_array_equal(result[:, 0], [3, 1, 2, 4])
+
+    def test_encode_empty(self):
+        """encode: 空の入力ではモデルを読み込まない"""
+        engine = LocalEmbeddingEngine()
+        assert engine.encode([]).shape == (0, 0)
+        assert engine._model is None
+
+    def test_settings_from_env(self, monkeypatch):
+        """環境変数からバッチサイズ・スレッド数・バックエンドを読み込む"""
+        monkeypatch.setenv("LOCAL_EMBEDDING_BATCH_SIZE", "64")
+        monkeypatch.setenv("LOCAL_EMBEDDING_THREADS", "2")
+        monkeypatch.setenv("LOCAL_EMBEDDING_BACKEND", "ONNX-INT8")
+
+        engine = LocalEmbeddingEngine()
+
+        assert (engine.batch_size, engine.threads, engine.backend) == (64, 2, "onnx-int8")
+
+    def test_cache_namespace_includes_backend(self, monkeypatch):
+        """cache_namespace: ONNXのバックエンドと量子化の設定ごとに別の名前を返す"""
+        monkeypatch.setattr(local_embedding, "find_spec", lambda name: object())
+        names = {
+            LocalEmbeddingEngine(backend="torch").cache_namespace(),
+            LocalEmbeddingEngine(backend="onnx").cache_namespace(),
+            LocalEmbeddingEngine(backend="onnx-int8", quantization="avx2").cache_namespace(),
+            LocalEmbeddingEngine(backend="onnx-int8", quantization="arm64").cache_namespace(),
+        }
+        assert len(names) == 4
+        assert LocalEmbeddingEngine(backend="torch").cache_namespace() == local_embedding.LOCAL_EMBEDDING_MODEL
+
+        # ONNXが使えずtorchで計算する場合はtorchと同じ名前になる
+        monkeypatch.setattr(local_embedding, "find_spec", lambda name: None)
+        assert LocalEmbeddingEngine(backend="onnx-int8").cache_namespace() == local_embedding.LOCAL_EMBEDDING_MODEL
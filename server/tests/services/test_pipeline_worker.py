@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+from src.services import pipeline_worker
+from src.services.pipeline_worker import PipelineWorkerPool
+
+
+class TestPipelineWorkerPool:
+    """常駐ワーカープールのテスト(ワーカープロセスの代わりにスレッドで実行する)"""
+
+    @pytest.fixture
+    def pool(self):
+        pool = PipelineWorkerPool(max_workers=1)
+        executor = ThreadPoolExecutor(max_workers=1)
+        with patch.object(pool, "_ensure_executor", return_value=executor):
+            yield pool
+        executor.shutdown(wait=True)
+
+    def test_on_done_receives_job_result(self, pool):
+        """ジョブの終了後に、成功した場合は None、失敗した場合は例外を引数に on_done が呼ばれる"""
+        done = {}
+        finished = threading.Event()
+
+        def run_job(argv):
+            if argv == ["fail"]:
+                raise RuntimeError("pipeline failed")
+
+        def on_done(slug, error):
+            done[slug] = error
+            if len(done) == 2:
+                finished.set()
+
+        with patch.object(pipeline_worker, "_run_job", side_effect=run_job):
+            pool.submit("first", ["config.json"], on_done)
+            pool.submit("second", ["fail"], on_done)
+            assert finished.wait(timeout=5)
+
+        assert done["first"] is None
+        assert isinstance(done["second"], RuntimeError)
+
+    def test_submit_restarts_unusable_pool(self):
+        """submit: プールに投入できない場合はプールを作り直して投入する"""
+        pool = PipelineWorkerPool(max_workers=1)
+        broken = ThreadPoolExecutor(max_workers=1)
+        broken.shutdown()
+        replacement = ThreadPoolExecutor(max_workers=1)
+        finished = threading.Event()
+
+        with (
+            patch.object(pool, "_ensure_executor", side_effect=[broken, replacement]),
+            patch.object(pipeline_worker, "_run_job", return_value=None),
+        ):
+            pool.submit("report", ["config.json"], lambda slug, error: finished.set())
+            assert finished.wait(timeout=5)
+        replacement.shutdown(wait=True)
@@ -0,0 +1,51 @@
+import json
+import os
+
+from src.services.report_slices import ReportSliceIndex
+
+
+class TestReportSliceIndex:
+    """公開レポートAPIの部分取得用の索引のテスト"""
+
+    def write_result(self, path, data, mtime_ns):
+        path.write_text(json.dumps(data))
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_rebuilds_when_file_changes(self, tmp_path):
+        """ファイルが変わらない間は索引を再利用し、変わると作り直す"""
+        path = tmp_path / "hierarchical_result.json"
+        result = {
+            "arguments": [{"arg_id": "A0_0", "cluster_ids": ["0", "1_1"]}],
+            "clusters": [{"level": 0, "id": "0"}, {"level": 1, "id": "1_1", "parent": "0"}],
+        }
+        self.write_result(path, result, 1_000_000_000)
+        index = ReportSliceIndex()
+
+        first = index.get(path)
+        assert index.get(path) is first
+        assert first.overview["cluster_num"] == {"0": 1, "1": 1}
+        assert first.arguments_by_cluster == {"0": [0], "1_1": [0]}
+
+        result["arguments"].append({"arg_id": "A1_0", "cluster_ids": ["0", "1_1"]})
+        self.write_result(path, result, 2_000_000_000)
+        updated = index.get(path)
+        assert updated.etag != first.etag
+        page, next_offset = updated.list_arguments(cluster_id="1_1", limit=1)
+        assert [a["arg_id"] for a in page] == ["A0_0"]
+        assert next_offset == 1
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """保持する索引の数が上限を超えると、最後に参照されたのが古いものから破棄する"""
+        paths = []
+        for name in ["a", "b", "c"]:
+            path = tmp_path / f"{name}.json"
+            self.write_result(path, {"overview": name}, 1_000_000_000)
+            paths.append(path)
+        index = ReportSliceIndex(max_entries=2)
+
+        first = index.get(paths[0])
+        index.get(paths[1])
+        assert index.get(paths[0]) is first
+        index.get(paths[2])
+        assert index.get(paths[0]) is first
+        assert index._lookup(str(paths[1]), (1_000_000_000, paths[1].stat().st_size)) is None
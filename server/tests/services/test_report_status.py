@@ -1,8 +1,12 @@
+import json
 from copy import deepcopy
+from datetime import datetime
+from types import SimpleNamespace
 
 import pytest
 
-from src.schemas.report import ReportVisibility
+from src.schemas.report import ReportStatus, ReportVisibility
+from src.services import report_status
 from src.services.report_status import convert_old_format_status
 
 
@@ -155,3 +159,89 @@ class TestReportStatus:
         assert "visibility" in result["new-slug"]
         assert result["new-slug"]["visibility"] == original_new_visibility
         assert "is_public" not in result["new-slug"]
+
+
+class TestReportStatusStore:
+    """メモリ上のステータスの索引と、ファイルへのまとめた書き出しのテスト"""
+
+    @pytest.fixture
+    def state_file(self, tmp_path, monkeypatch):
+        state_file = tmp_path / "report_status.json"
+        data = {
+            slug: {
+                "slug": slug,
+                "status": status,
+                "title": slug,
+                "description": "",
+                "visibility": "public" if slug != "d" else "private",
+                "created_at": f"2025-05-0{i + 1}T00:00:00+00:00",
+            }
+            for i, (slug, status) in enumerate([("a", "ready"), ("b", "processing"), ("c", "deleted"), ("d", "ready")])
+        }
+        state_file.write_text(json.dumps(data))
+        monkeypatch.setattr(report_status, "STATE_FILE", state_file)
+        monkeypatch.setattr(report_status, "_report_status", {})
+        monkeypatch.setattr(report_status, "_loaded", False)
+        monkeypatch.setattr(report_status, "_reports", {})
+        monkeypatch.setattr(report_status, "_slugs_by_status", {})
+        monkeypatch.setattr(report_status._writer, "delay", 60)
+        yield state_file
+        report_status.flush_status()
+
+    def test_indexes_reports_and_writes_changes_behind(self, state_file):
+        """ステータスの索引から参照でき、変更はファイルにまとめて書き出される"""
+        assert [r.slug for r in report_status.load_status_as_reports()] == ["a", "b", "d"]
+        assert [r.slug for r in report_status.list_reports_by_status([ReportStatus.READY])] == ["a", "d"]
+        report_a = report_status.get_report("a")
+        assert report_status.get_report("a") is report_a
+        assert report_status.get_report("missing") is None
+
+        report_status.set_status("b", "ready")
+        report_status.set_status("a", "error")
+
+        assert [r.slug for r in report_status.list_reports_by_status([ReportStatus.READY])] == ["b", "d"]
+        assert report_status.get_report("a").status == ReportStatus.ERROR
+        # ファイルへの書き出しは後でまとめて行われる
+        assert json.loads(state_file.read_text())["a"]["status"] == "ready"
+
+        report_status.flush_status()
+        saved = json.loads(state_file.read_text())
+        assert saved["a"]["status"] == "error"
+        assert saved["b"]["status"] == "ready"
+        assert not state_file.with_name(state_file.name + ".tmp").exists()
+
+    def test_query_reports_paginates_with_cursor(self, state_file):
+        """絞り込み・並べ替えた結果をカーソルでページ分割して返す"""
+        page, cursor = report_status.query_reports(sort="-created_at", limit=2)
+        assert [r.slug for r in page] == ["d", "b"]
+        assert cursor is not None
+
+        # 前のページを取得した後に追加されたレポートがあっても、続きから返す
+        report_status.add_new_report_to_status(SimpleNamespace(input="e", question="e", intro="", is_pubcom=False))
+        page, cursor = report_status.query_reports(sort="-created_at", limit=2, cursor=cursor)
+        assert [r.slug for r in page] == ["a"]
+        assert cursor is None
+
+        page, _ = report_status.query_reports(
+            statuses=[ReportStatus.READY],
+            visibilities=[ReportVisibility.PUBLIC],
+            created_after=datetime(2025, 5, 1),
+            sort="title",
+        )
+        assert [r.slug for r in page] == ["a"]
+
+        with pytest.raises(ValueError):
+            report_status.query_reports(sort="unknown")
+        with pytest.raises(ValueError):
+            report_status.query_reports(cursor="invalid")
+
+    def test_serialize_reports_projects_fields(self, state_file):
+        """指定したフィールドだけをレスポンスの形式で返す"""
+        reports = [report_status.get_report("a")]
+        assert report_status.serialize_reports(reports, ["slug", "createdAt"]) == [
+            {"slug": "a", "createdAt": "2025-05-01T00:00:00+00:00"}
+        ]
+        assert report_status.serialize_reports(reports, ["created_at"]) == [{"createdAt": "2025-05-01T00:00:00+00:00"}]
+        assert report_status.serialize_reports(reports)[0]["isPubcom"] is False
+        with pytest.raises(ValueError):
+            report_status.serialize_reports(reports, ["unknown"])
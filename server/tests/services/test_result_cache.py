@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+
+import orjson
+from broadlistening.pipeline.services.result_format import PROVENANCE_FILENAME, compact_result
+from src.services.result_cache import ResultCache
+
+
+class TestResultCache:
+    """公開レポートAPIの結果ファイルキャッシュのテスト"""
+
+    def write_result(self, path, data, mtime_ns):
+        path.write_text(json.dumps(data))
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_reloads_when_file_or_visibility_changes(self, tmp_path):
+        """ファイルが変わらない間はキャッシュを返し、更新日時・サイズや公開設定が変わると読み込み直す"""
+        path = tmp_path / "hierarchical_result.json"
+        self.write_result(path, {"overview": "before"}, 1_000_000_000)
+        cache = ResultCache(max_bytes=1024**2)
+
+        first = cache.get(path, "public")
+        assert cache.get(path, "public") is first
+        assert orjson.loads(gzip.decompress(first.gzip)) == {"overview": "before", "visibility": "public"}
+
+        assert orjson.loads(cache.get(path, "unlisted").body)["visibility"] == "unlisted"
+
+        self.write_result(path, {"overview": "after"}, 2_000_000_000)
+        updated = cache.get(path, "unlisted")
+        assert orjson.loads(updated.body)["overview"] == "after"
+        assert updated.etag != first.etag
+        assert cache.stats == {"hits": 1, "misses": 3}
+
+    def test_evicts_least_recently_used_within_budget(self, tmp_path):
+        """合計サイズが上限を超えると、最後に参照されたのが古いものから削除する"""
+        paths = []
+        for name in ["a", "b", "c"]:
+            path = tmp_path / f"{name}.json"
+            self.write_result(path, {"overview": name * 200}, 1_000_000_000)
+            paths.append(path)
+        entry_bytes = ResultCache(max_bytes=1024**2).get(paths[0], "public").nbytes
+        cache = ResultCache(max_bytes=entry_bytes * 2)
+
+        a = cache.get(paths[0], "public")
+        cache.get(paths[1], "public")
+        assert cache.get(paths[0], "public") is a
+        cache.get(paths[2], "public")
+
+        assert cache.get(paths[0], "public") is a
+        assert cache.stats["misses"] == 3
+        cache.get(paths[1], "public")
+        assert cache.stats["misses"] == 4
+
+    def test_expands_compact_result(self, tmp_path):
+        """コンパクト形式の結果ファイルは従来の形式に戻し、hierarchical_provenance.json の内容は含めずに返す"""
+        legacy = {
+            "arguments": [
+                {
+                    "arg_id": "A0_0",
+                    "argument": "意見",
+                    "x": 0.0,
+                    "y": 1.0,
+                    "p": 0,
+                    "cluster_ids": ["0", "1_0"],
+                    "attributes": None,
+                    "url": None,
+                }
+            ],
+            "propertyMap": {},
+            "config": {"question": "質問", "extraction": {"prompt": "抽出", "limit": 10}},
+        }
+        compact, provenance = compact_result(legacy)
+        path = tmp_path / "hierarchical_result.json"
+        self.write_result(path, compact, 1_000_000_000)
+        (tmp_path / PROVENANCE_FILENAME).write_text(json.dumps(provenance))
+
+        body = orjson.loads(ResultCache(max_bytes=1024**2).get(path, "public").body)
+        assert body == {
+            **legacy,
+            "config": {"question": "質問", "extraction": {"limit": 10}},
+            "visibility": "public",
+        }
+
+    def test_omits_provenance_from_legacy_result(self, tmp_path):
+        """従来の形式の結果ファイルからも、プロンプト・ソースコード・実行記録を除いて返す"""
+        path = tmp_path / "hierarchical_result.json"
+        config = {
+            "question": "質問",
+            "plan": [{"step": "extraction", "run": True, "reason": "not trace of previous run"}],
+            "extraction": {"prompt": "抽出", "source_code": "def extraction(): ...", "model": "gpt-4o-mini"},
+        }
+        self.write_result(path, {"overview": "概要", "config": config}, 1_000_000_000)
+
+        body = orjson.loads(ResultCache(max_bytes=1024**2).get(path, "public").body)
+        assert body["config"] == {"question": "質問", "extraction": {"model": "gpt-4o-mini"}}
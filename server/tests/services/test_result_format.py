@@ -0,0 +1,68 @@
+from broadlistening.pipeline.services.result_format import (
+    argument_count,
+    compact_result,
+    expand_result,
+    is_compact,
+)
+
+
+class TestResultFormat:
+    """結果ファイルのコンパクト形式のテスト"""
+
+    def legacy_result(self):
+        return {
+            "arguments": [
+                {
+                    "arg_id": "A0_0",
+                    "argument": "意見0",
+                    "x": 0.5,
+                    "y": 1.5,
+                    "p": 0,
+                    "cluster_ids": ["0", "1_0", "2_3"],
+                    "attributes": {"age": "20"},
+                    "url": "https://example.com/0",
+                },
+                {
+                    "arg_id": "A1_0",
+                    "argument": "意見1",
+                    "x": 2.0,
+                    "y": 3.0,
+                    "p": 0,
+                    "cluster_ids": ["0", "1_1", "2_5"],
+                    "attributes": None,
+                    "url": None,
+                },
+            ],
+            "clusters": [{"level": 0, "id": "0", "label": "全体"}],
+            "propertyMap": {"sentiment": {"A0_0": "positive", "A1_0": None}},
+            "overview": "概要",
+            "comment_num": 2,
+            "config": {
+                "question": "質問",
+                "plan": [{"step": "extraction", "run": True}],
+                "previously_completed_jobs": [],
+                "extraction": {"limit": 10, "model": "gpt-4o-mini", "prompt": "抽出", "source_code": "def f(): ..."},
+            },
+        }
+
+    def test_round_trip(self):
+        """コンパクト形式に変換して戻すと、従来の形式と同じ内容になる"""
+        legacy = self.legacy_result()
+        compact, provenance = compact_result(legacy)
+
+        assert is_compact(compact)
+        assert compact["arguments"]["arg_id"] == ["A0_0", "A1_0"]
+        assert compact["arguments"]["cluster_levels"] == [["1_0", "1_1"], ["2_3", "2_5"]]
+        assert compact["propertyMap"] == {"sentiment": ["positive", None]}
+        assert compact["config"] == {"question": "質問", "extraction": {"limit": 10, "model": "gpt-4o-mini"}}
+        assert provenance["extraction"] == {"prompt": "抽出", "source_code": "def f(): ..."}
+        assert argument_count(compact) == argument_count(legacy) == 2
+
+        assert expand_result(compact, provenance) == legacy
+        # provenance を渡さない場合は設定を戻さない
+        assert "plan" not in expand_result(compact)["config"]
+
+    def test_expand_legacy_result_as_is(self):
+        """従来の形式の結果はそのまま返す"""
+        legacy = self.legacy_result()
+        assert expand_result(legacy) is legacy
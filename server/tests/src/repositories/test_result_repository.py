@@ -0,0 +1,130 @@
+import csv
+import json
+from unittest.mock import patch
+
+import pytest
+
+from broadlistening.pipeline.services.result_format import compact_result, is_compact
+from src.core.exceptions import ResultClusterNotFound, ResultFileNotFound, ResultJSONParseError
+from src.repositories.result_repository import ResultRepository
+from src.schemas.cluster import ClusterUpdate
+from src.schemas.report_config import ReportConfigUpdate
+
+
+class TestResultRepository:
+    """ResultRepositoryのテスト"""
+
+    @pytest.fixture
+    def report_dir(self, tmp_path):
+        """テスト用のレポートディレクトリ"""
+        (tmp_path / "test-slug").mkdir()
+        with patch("src.repositories.result_repository.settings") as mock_settings:
+            mock_settings.REPORT_DIR = tmp_path
+            yield tmp_path / "test-slug"
+
+    @pytest.fixture
+    def result(self):
+        """テスト用の結果ファイルの内容"""
+        return {
+            "arguments": [{"arg_id": "A1_0"}, {"arg_id": "A1_1"}, {"arg_id": "A2_0"}],
+            "clusters": [
+                {"level": 0, "id": "0", "label": "全体", "takeaway": "", "value": 3, "parent": ""},
+                {"level": 1, "id": "1_0", "label": "ラベル1", "takeaway": "説明1", "value": 2, "parent": "0"},
+                {"level": 1, "id": "1_1", "label": "ラベル2", "takeaway": "説明2", "value": 1, "parent": "0"},
+            ],
+            "comment_num": 5,
+            "config": {
+                "question": "元のタイトル",
+                "intro": "元の調査概要",
+                "provider": "openai",
+                "model": "gpt-4o-mini",
+                "extraction": {"limit": 2},
+            },
+        }
+
+    @pytest.fixture
+    def result_path(self, report_dir, result):
+        path = report_dir / "hierarchical_result.json"
+        path.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        return path
+
+    def test_update_cluster(self, result_path):
+        """update_cluster: 指定したクラスタのラベルと説明だけを書き換える"""
+        ResultRepository("test-slug").update_cluster(ClusterUpdate(id="1_1", label="新ラベル", description="新説明"))
+
+        updated = json.loads(result_path.read_text(encoding="utf-8"))
+        assert updated["clusters"][2]["label"] == "新ラベル"
+        assert updated["clusters"][2]["takeaway"] == "新説明"
+        assert updated["clusters"][1]["label"] == "ラベル1"
+        assert list(result_path.parent.iterdir()) == [result_path]
+
+    def test_update_cluster_updates_comments_csv(self, report_dir, result_path):
+        """update_cluster: 大カテゴリのラベルは元コメント付きのCSVにも反映する"""
+        comments_path = report_dir / "final_result_with_comments.csv"
+        with open(comments_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["comment-id", "arg_id", "category_id", "category"])
+            writer.writerow(["1", "A1_0", "1_0", "ラベル1"])
+            writer.writerow(["2", "A2_0", "1_1", "ラベル2"])
+
+        ResultRepository("test-slug").update_cluster(ClusterUpdate(id="1_0", label="新ラベル", description="新説明"))
+
+        with open(comments_path, encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        assert [row["category"] for row in rows] == ["新ラベル", "ラベル2"]
+
+    def test_update_cluster_not_found(self, result_path):
+        """update_cluster: 存在しないクラスタを指定した場合はエラーになり、ファイルは変更しない"""
+        before = result_path.read_text(encoding="utf-8")
+
+        with pytest.raises(ResultClusterNotFound):
+            ResultRepository("test-slug").update_cluster(ClusterUpdate(id="9_9", label="x", description="y"))
+
+        assert result_path.read_text(encoding="utf-8") == before
+
+    def test_update_config(self, result_path):
+        """update_config: タイトルを書き換え、調査概要には分析件数の説明を付け加える"""
+        ResultRepository("test-slug").update_config(ReportConfigUpdate(question="新タイトル", intro="新しい調査概要"))
+
+        config = json.loads(result_path.read_text(encoding="utf-8"))["config"]
+        assert config["question"] == "新タイトル"
+        assert config["intro"].startswith("新しい調査概要\n")
+        assert "データの件数は2件" in config["intro"]
+        assert "OpenAI API (gpt-4o-mini)を用いて3件の意見" in config["intro"]
+
+    def test_update_config_keeps_unspecified_fields(self, result_path):
+        """update_config: 指定しなかった項目は変更しない"""
+        ResultRepository("test-slug").update_config(ReportConfigUpdate(question="新タイトル"))
+
+        config = json.loads(result_path.read_text(encoding="utf-8"))["config"]
+        assert config["intro"] == "元の調査概要"
+
+    def test_update_compact_result(self, report_dir, result):
+        """コンパクト形式の結果ファイルも更新でき、同じ形式で書き出す"""
+        compact, _ = compact_result(
+            {**result, "arguments": [{"arg_id": a["arg_id"], "cluster_ids": ["0"]} for a in result["arguments"]]}
+        )
+        path = report_dir / "hierarchical_result.json"
+        path.write_text(json.dumps(compact, ensure_ascii=False), encoding="utf-8")
+
+        repository = ResultRepository("test-slug")
+        repository.update_config(ReportConfigUpdate(intro="新しい調査概要"))
+        repository.update_cluster(ClusterUpdate(id="1_1", label="新ラベル", description="新説明"))
+
+        updated = json.loads(path.read_text(encoding="utf-8"))
+        assert is_compact(updated)
+        assert "OpenAI API (gpt-4o-mini)を用いて3件の意見" in updated["config"]["intro"]
+        assert updated["clusters"][2]["label"] == "新ラベル"
+        assert updated["arguments"]["arg_id"] == ["A1_0", "A1_1", "A2_0"]
+
+    def test_file_not_found(self, report_dir):
+        """結果ファイルが存在しない場合はResultFileNotFoundが発生する"""
+        with pytest.raises(ResultFileNotFound):
+            ResultRepository("test-slug").update_config(ReportConfigUpdate(question="新タイトル"))
+
+    def test_invalid_json(self, report_dir):
+        """結果ファイルのパースに失敗した場合はResultJSONParseErrorが発生する"""
+        (report_dir / "hierarchical_result.json").write_text("{", encoding="utf-8")
+
+        with pytest.raises(ResultJSONParseError):
+            ResultRepository("test-slug").update_cluster(ClusterUpdate(id="1_0", label="x", description="y"))
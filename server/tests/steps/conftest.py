@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# パイプラインのステップは hierarchical_main.py と同じく pipeline ディレクトリから `services` を読み込むため、
+# テスト実行時にも pipeline ディレクトリをパスに追加する
+sys.path.append(str(Path(__file__).parent.parent.parent / "broadlistening" / "pipeline"))
@@ -0,0 +1,50 @@
+import csv
+import os
+
+from broadlistening.pipeline.steps.extraction import (
+    ARGUMENT_INDEX_FILENAME,
+    ExtractionJournal,
+    _write_arguments_and_relations,
+)
+
+
+def _read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+class TestWriteArgumentsAndRelations:
+    """ジャーナルから args.csv / relations.csv を書き出す処理のテスト"""
+
+    def test_deduplicates_arguments_across_comments(self, tmp_path):
+        """同じ意見は最初に抽出したコメントのarg-idにまとめ、重複排除用の一時ファイルは残さない"""
+        journal = ExtractionJournal(str(tmp_path / "extraction_journal.jsonl"), {"prompt": "テスト"})
+        journal.append(
+            [
+                ("1", "本文1", ["駐輪場がほしい", "公園を増やしてほしい"]),
+                ("2", "本文2", ["駐輪場がほしい"]),
+                ("3", "本文3", ["公園を増やしてほしい", "図書館を延長してほしい", "図書館を延長してほしい"]),
+            ]
+        )
+        args_path = tmp_path / "args.csv"
+        relations_path = tmp_path / "relations.csv"
+
+        count = _write_arguments_and_relations(journal, ["1", "2", "3"], str(args_path), str(relations_path))
+
+        assert count == 3
+        assert _read_rows(args_path) == [
+            ["arg-id", "argument"],
+            ["A1_0", "駐輪場がほしい"],
+            ["A1_1", "公園を増やしてほしい"],
+            ["A3_1", "図書館を延長してほしい"],
+        ]
+        assert _read_rows(relations_path) == [
+            ["arg-id", "comment-id"],
+            ["A1_0", "1"],
+            ["A1_1", "1"],
+            ["A1_0", "2"],
+            ["A1_1", "3"],
+            ["A3_1", "3"],
+            ["A3_1", "3"],
+        ]
+        assert not os.path.exists(tmp_path / ARGUMENT_INDEX_FILENAME)
@@ -0,0 +1,221 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from broadlistening.pipeline.services.result_format import PROVENANCE_FILENAME, expand_result, is_compact
+from broadlistening.pipeline.steps import hierarchical_aggregation
+from broadlistening.pipeline.steps.hierarchical_aggregation import (
+    _build_arguments,
+    _build_property_map,
+    json_serialize_numpy,
+)
+
+
+def _legacy_build_arguments(clusters, comments, relation_df, config):
+    """書き換え前の_build_arguments(引数ごとに全コメントを走査する実装)"""
+    cluster_columns = [col for col in clusters.columns if col.startswith("cluster-level-") and "id" in col]
+    comments_copy = comments.copy()
+    comments_copy["comment-id"] = comments_copy["comment-id"].astype(str)
+    arg_comment_map = {}
+    if "comment-id" in relation_df.columns:
+        relation_df["comment-id"] = relation_df["comment-id"].astype(str)
+        arg_comment_map = dict(zip(relation_df["arg-id"], relation_df["comment-id"], strict=False))
+    attribute_columns = [col for col in comments.columns if col.startswith("attribute_")]
+
+    arguments = []
+    for _, row in clusters.iterrows():
+        cluster_ids = ["0"]
+        for cluster_column in cluster_columns:
+            cluster_ids.append(str(row[cluster_column]))
+        argument = {
+            "arg_id": str(row["arg-id"]),
+            "argument": str(row["argument"]),
+            "x": float(row["x"]),
+            "y": float(row["y"]),
+            "p": 0,
+            "cluster_ids": cluster_ids,
+            "attributes": None,
+            "url": None,
+        }
+        if row["arg-id"] in arg_comment_map:
+            comment_id = arg_comment_map[row["arg-id"]]
+            comment_rows = comments_copy[comments_copy["comment-id"] == comment_id]
+            if not comment_rows.empty:
+                comment_row = comment_rows.iloc[0]
+                if config.get("enable_source_link", False) and "url" in comment_row and comment_row["url"] is not None:
+                    argument["url"] = str(comment_row["url"])
+                if attribute_columns:
+                    attributes = {}
+                    for attr_col in attribute_columns:
+                        attr_name = attr_col[len("attribute_") :]
+                        attr_value = comment_row.get(attr_col, None)
+                        if attr_value is not None:
+                            if isinstance(attr_value, np.integer):
+                                attr_value = int(attr_value)
+                            elif isinstance(attr_value, np.floating):
+                                attr_value = float(attr_value)
+                        attributes[attr_name] = attr_value
+                    if any(v is not None for v in attributes.values()):
+                        argument["attributes"] = attributes
+        arguments.append(argument)
+    return arguments
+
+
+def _legacy_build_property_map(arguments, comments, hidden_properties_map, config):
+    """書き換え前の_build_property_map(行ごとにiterrowsする実装)"""
+    property_columns = list(hidden_properties_map.keys()) + list(config["extraction"]["categories"].keys())
+    property_map = {}
+    for prop in property_columns:
+        property_map[prop] = {}
+        for arg_id, row in arguments.iterrows():
+            value = row[prop] if not pd.isna(row[prop]) else None
+            if value is not None:
+                if isinstance(value, np.integer):
+                    value = int(value)
+                elif isinstance(value, np.floating):
+                    value = float(value)
+                else:
+                    value = str(value)
+            property_map[prop][str(arg_id)] = value
+    return property_map
+
+
+def _synthetic_inputs(num_comments: int, num_args: int, seed: int = 0):
+    """欠損値・重複したcomment-id・コメントに対応しない意見を含む入力を生成する"""
+    rng = np.random.default_rng(seed)
+    comment_ids = rng.integers(0, num_comments * 2, size=num_comments)
+    comments = pd.DataFrame(
+        {
+            "comment-id": comment_ids,
+            "comment-body": [f"コメント{i}" for i in range(num_comments)],
+            "url": [None if i % 7 == 0 else f"https://example.com/{i}" for i in range(num_comments)],
+            "attribute_age": rng.integers(10, 80, size=num_comments),
+            "attribute_score": np.where(rng.random(num_comments) < 0.2, np.nan, rng.random(num_comments)),
+            "attribute_area": rng.choice(["東京", "大阪", None], size=num_comments),
+        }
+    )
+    arg_ids = [f"A{i}_0" for i in range(num_args)]
+    relation_df = pd.DataFrame(
+        {
+            # 一部の意見は複数のコメントに対応し、一部はどのコメントにも対応しない
+            "arg-id": arg_ids[: num_args * 9 // 10] + arg_ids[: num_args // 10],
+            "comment-id": rng.integers(0, num_comments * 2, size=num_args // 10 * 10),
+        }
+    )
+    clusters = pd.DataFrame(
+        {
+            "arg-id": arg_ids,
+            "argument": [f"意見{i}" for i in range(num_args)],
+            "x": rng.random(num_args),
+            "y": rng.random(num_args),
+            "cluster-level-1-id": [f"1_{i % 5}" for i in range(num_args)],
+            "cluster-level-2-id": rng.integers(0, 50, size=num_args),
+        }
+    )
+    arguments = pd.DataFrame(
+        {
+            "arg-id": arg_ids,
+            "argument": [f"意見{i}" for i in range(num_args)],
+            "sentiment": rng.choice(["positive", "negative", None], size=num_args),
+            "rank": rng.integers(0, 5, size=num_args),
+            "score": np.where(rng.random(num_args) < 0.3, np.nan, rng.random(num_args)),
+            "flag": rng.random(num_args) < 0.5,
+        }
+    ).set_index("arg-id")
+    return clusters, comments, relation_df, arguments
+
+
+def _dump(value) -> str:
+    return json.dumps(json_serialize_numpy(value), ensure_ascii=False)
+
+
+class TestHierarchicalAggregation:
+    """hierarchical_aggregationの出力構築のテスト"""
+
+    @pytest.mark.parametrize("enable_source_link", [True, False])
+    def test_build_arguments_matches_legacy(self, enable_source_link):
+        """_build_arguments: 書き換え前の実装と同じ出力になる"""
+        clusters, comments, relation_df, _ = _synthetic_inputs(num_comments=500, num_args=800)
+        config = {"enable_source_link": enable_source_link}
+
+        expected = _legacy_build_arguments(clusters, comments, relation_df.copy(), config)
+        actual = _build_arguments(clusters, comments, relation_df.copy(), config)
+
+        assert _dump(actual) == _dump(expected)
+
+    def test_build_arguments_without_attributes(self):
+        """_build_arguments: 属性カラムやurlカラムがない場合はNoneのままにする"""
+        clusters, comments, relation_df, _ = _synthetic_inputs(num_comments=50, num_args=80)
+        comments = comments[["comment-id", "comment-body"]]
+        config = {"enable_source_link": True}
+
+        actual = _build_arguments(clusters, comments, relation_df.copy(), config)
+
+        assert _dump(actual) == _dump(_legacy_build_arguments(clusters, comments, relation_df.copy(), config))
+        assert all(argument["attributes"] is None and argument["url"] is None for argument in actual)
+
+    def test_build_property_map_matches_legacy(self):
+        """_build_property_map: 書き換え前の実装と同じ出力になる"""
+        _, comments, _, arguments = _synthetic_inputs(num_comments=50, num_args=800)
+        hidden_properties_map = {"sentiment": ["negative"], "rank": []}
+        config = {"extraction": {"categories": {"score": {}, "flag": {}}}}
+
+        expected = _legacy_build_property_map(arguments, comments, hidden_properties_map, config)
+        actual = _build_property_map(arguments, comments, hidden_properties_map, config)
+
+        assert _dump(actual) == _dump(expected)
+
+    def test_build_property_map_missing_column(self):
+        """_build_property_map: args.csvに存在しないカラムを指定した場合はエラーになる"""
+        _, comments, _, arguments = _synthetic_inputs(num_comments=10, num_args=10)
+
+        with pytest.raises(ValueError):
+            _build_property_map(arguments, comments, {"unknown": []}, {"extraction": {"categories": {}}})
+
+    def test_build_arguments_scales_linearly(self):
+        """_build_arguments: 大きな入力でも書き換え前の実装と同じ出力を、より短い時間で返す"""
+        clusters, comments, relation_df, _ = _synthetic_inputs(num_comments=5000, num_args=5000, seed=1)
+        config = {"enable_source_link": True}
+
+        start = time.perf_counter()
+        expected = _legacy_build_arguments(clusters, comments, relation_df.copy(), config)
+        legacy_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = _build_arguments(clusters, comments, relation_df.copy(), config)
+        elapsed = time.perf_counter() - start
+
+        assert _dump(actual) == _dump(expected)
+        assert elapsed < legacy_elapsed
+
+    @pytest.mark.parametrize("result_format", ["compact", "legacy"])
+    def test_write_result(self, tmp_path, monkeypatch, result_format):
+        """write_result: コンパクト形式ではプロンプト・ソースコードを別ファイルに分け、一度だけ書き出す"""
+        monkeypatch.setattr(hierarchical_aggregation, "PIPELINE_DIR", tmp_path)
+        monkeypatch.setenv("PIPELINE_RESULT_FORMAT", result_format)
+        output_dir = tmp_path / "outputs" / "test"
+        output_dir.mkdir(parents=True)
+        clusters, comments, relation_df, _ = _synthetic_inputs(num_comments=50, num_args=50)
+        results = json_serialize_numpy(
+            {
+                "arguments": _build_arguments(clusters, comments, relation_df, {"enable_source_link": True}),
+                "clusters": [],
+                "propertyMap": {},
+                "config": {"question": "質問", "plan": [], "extraction": {"prompt": "抽出", "source_code": "..."}},
+            }
+        )
+
+        hierarchical_aggregation.write_result("test", results)
+
+        written = json.loads((output_dir / "hierarchical_result.json").read_text())
+        if result_format == "legacy":
+            # 属性の欠損値(NaN)を含むため、JSONの文字列として比較する
+            assert json.dumps(written, sort_keys=True) == json.dumps(results, sort_keys=True)
+            assert not (output_dir / PROVENANCE_FILENAME).exists()
+        else:
+            assert is_compact(written)
+            assert "source_code" not in written["config"]["extraction"]
+            provenance = json.loads((output_dir / PROVENANCE_FILENAME).read_text())
+            expanded = expand_result(written, provenance)
+            assert json.dumps(expanded, sort_keys=True) == json.dumps(results, sort_keys=True)
@@ -0,0 +1,87 @@
+import json
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from broadlistening.pipeline import hierarchical_utils
+from broadlistening.pipeline.services.artifacts import read_table, save_embeddings, write_table
+from broadlistening.pipeline.steps import hierarchical_clustering as hierarchical_clustering_module
+from broadlistening.pipeline.steps.hierarchical_clustering import hierarchical_clustering
+
+JOB_NAME = "test-hierarchical-clustering-dedup"
+
+
+class _ProjectionUMAP:
+    """埋め込みの先頭2次元をそのまま座標として返す(umap を使わずにステップの配線を確認する)"""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def fit_transform(self, embeddings):
+        return np.asarray(embeddings)[:, :2]
+
+
+@pytest.fixture
+def output_dir(monkeypatch):
+    output_dir = hierarchical_utils.PIPELINE_DIR / "outputs" / JOB_NAME
+    shutil.rmtree(output_dir, ignore_errors=True)
+    monkeypatch.chdir(hierarchical_utils.PIPELINE_DIR)
+    monkeypatch.setattr(
+        hierarchical_clustering_module, "import_module", lambda name: SimpleNamespace(UMAP=_ProjectionUMAP)
+    )
+    yield output_dir
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def _initialize(tmp_path, clustering_options):
+    # LLMを使うステップはプロンプトを設定に含める(プロンプトファイルを読まない)
+    config = {spec["step"]: {"prompt": "テスト"} for spec in hierarchical_utils.specs if spec.get("use_llm")}
+    config.update({"input": JOB_NAME, "question": "テスト", "hierarchical_clustering": clustering_options})
+    config_path = tmp_path / f"{JOB_NAME}.json"
+    config_path.write_text(json.dumps(config))
+    return hierarchical_utils.initialization(["hierarchical_main.py", str(config_path), "-skip-interaction"])
+
+
+class TestHierarchicalClusteringDedup:
+    """hierarchical_clustering.dedup の設定がクラスタリングまで届くことのテスト"""
+
+    def test_default_options(self, tmp_path, output_dir):
+        """dedup を指定しない場合は "off" がデフォルト値として設定される"""
+        config = _initialize(tmp_path, {"cluster_nums": [2]})
+
+        assert config["hierarchical_clustering"]["dedup"] == "off"
+        assert config["hierarchical_clustering"]["dedup_threshold"] is None
+
+    def test_dedup_enabled_config(self, tmp_path, output_dir):
+        """dedup を指定した設定が検証を通り、同じ意見をまとめてクラスタリングする"""
+        config = _initialize(tmp_path, {"cluster_nums": [2], "dedup": "text", "dedup_threshold": 0.9})
+        arguments = [
+            "駅前に駐輪場がほしい",
+            "駅前に駐輪場がほしい",
+            "公園を増やしてほしい",
+            "図書館の開館時間を延ばしてほしい",
+        ]
+        arg_ids = [f"A{i}_0" for i in range(len(arguments))]
+        write_table(JOB_NAME, "args", pd.DataFrame({"arg-id": arg_ids, "argument": arguments}))
+        save_embeddings(JOB_NAME, arg_ids, np.array([[0.0, 0.0], [0.0, 0.0], [10.0, 10.0], [10.0, 11.0]]))
+
+        hierarchical_clustering(config)
+
+        assert config["hierarchical_clustering_dedup"] == {"mode": "text", "arguments": 4, "representatives": 3}
+        clusters = read_table(JOB_NAME, "hierarchical_clusters")
+        assert clusters["multiplicity"].tolist() == [2, 2, 1, 1]
+        assert clusters.loc[0, "cluster-level-1-id"] == clusters.loc[1, "cluster-level-1-id"]
+        assert clusters.loc[2, "cluster-level-1-id"] != clusters.loc[0, "cluster-level-1-id"]
+
+    def test_previous_clustering_without_dedup_is_not_rerun(self, tmp_path, output_dir):
+        """dedup を追加する前のレポートは、デフォルト値("off")との差分で再クラスタリングしない"""
+        config = _initialize(tmp_path, {"cluster_nums": [2]})
+        previous_jobs = [
+            {"step": "hierarchical_clustering", "params": {"cluster_nums": [2]}},
+        ]
+
+        migrated = hierarchical_utils._migrate_previous_jobs(config, previous_jobs)
+
+        assert migrated[0]["params"] == {"dedup": "off", "cluster_nums": [2]}